@@ -40,14 +40,18 @@ setup(
     ],
     install_requires=(
         "circuits==3.0",
-        "dnslib==0.9.3",
+        "dnslib==0.9.26",
         "redisco==0.2.4",
         "cachetools==0.4.0",
     ),
+    extras_require={
+        "dnssec": ["cryptography"],
+    },
     entry_points={
         "console_scripts": [
             "udnsd=udns.server:main",
             "udnsc=udns.client:main",
+            "udns-replay=udns.replay:main",
         ]
     },
     test_suite="tests.main.main",
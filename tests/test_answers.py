@@ -0,0 +1,121 @@
+"""Test Answers"""
+
+
+from dnslib import DNSRecord, EDNS0, QTYPE, RR, A
+
+from udns.storage import Entry
+from udns.answers import edns, glue, negative, nodata, nxdomain, payload
+from udns.answers import sections, select, targets, terminal, truncate
+
+
+RECORDS = {
+    "abc.com.": [
+        Entry("abc.com.", "10 mail.abc.com.", 1, QTYPE.MX, 300),
+        Entry("abc.com.", "127.0.0.1", 1, QTYPE.A, 300),
+    ],
+    "web.abc.com.": [
+        Entry("web.abc.com.", "www.abc.com.", 1, QTYPE.CNAME, 300),
+        Entry("www.abc.com.", "127.0.0.2", 1, QTYPE.A, 300),
+    ],
+    "ftp.abc.com.": [
+        Entry("ftp.abc.com.", "old.abc.com.", 1, QTYPE.CNAME, 300),
+    ],
+    "mail.abc.com.": [
+        Entry("mail.abc.com.", "127.0.0.25", 1, QTYPE.A, 300),
+        Entry("mail.abc.com.", "::1", 1, QTYPE.AAAA, 300),
+        Entry("mail.abc.com.", "v=spf1 -all", 1, QTYPE.TXT, 300),
+    ],
+}
+
+
+def test_select():
+    records = RECORDS["abc.com."]
+
+    assert [r.rtype for r in select(records, QTYPE.MX, 1)] == [QTYPE.MX]
+    assert len(select(records, QTYPE.ANY, 1)) == 2
+    assert select(records, QTYPE.AAAA, 1) == []
+    assert select(records, QTYPE.A, 3) == []
+
+    records = RECORDS["web.abc.com."]
+
+    assert select(records, QTYPE.A, 1) == records
+    assert select(records, QTYPE.CNAME, 1) == records[:1]
+
+
+def test_glue():
+    rrs = [record.rr for record in RECORDS["abc.com."]]
+
+    names = targets(rrs)
+    assert names == ["mail.abc.com."]
+
+    assert [str(rr.rdata) for rr in glue(names, RECORDS)] == [
+        "127.0.0.25", "::1"
+    ]
+
+    # Addresses already in the answer need no glue
+    rrs.append(RECORDS["mail.abc.com."][0].rr)
+    assert targets(rrs) == []
+
+
+def test_negative():
+    records = RECORDS["web.abc.com."]
+
+    assert terminal("web.abc.com.", records) == "www.abc.com."
+    assert terminal("abc.com.", RECORDS["abc.com."]) == "abc.com."
+
+    assert not nodata(records, QTYPE.A, 1)
+    assert nodata(records, QTYPE.MX, 1)
+    assert not nxdomain("web.abc.com.", records)
+
+    # A CNAME to a name without records
+    assert nxdomain("ftp.abc.com.", RECORDS["ftp.abc.com."])
+
+    soa = Entry(
+        "abc.com.", "ns.abc.com. admin.abc.com. 1 3600 600 86400 60",
+        1, QTYPE.SOA, 300
+    )
+    assert [rr.ttl for rr in negative([soa.rr])] == [60]
+
+    # NODATA: the SOA of the zone goes to the authority section
+    rrs = [record.rr for record in select(records, QTYPE.MX, 1)]
+    rrs.extend(negative([soa.rr]))
+    rr, auth = sections(rrs, QTYPE.MX, qname="web.abc.com.")
+    assert [r.rtype for r in rr] == [QTYPE.CNAME]
+    assert [r.rtype for r in auth] == [QTYPE.SOA]
+
+    # Unless it is the answer to a SOA question
+    rrs = [soa.rr]
+    assert sections(rrs, QTYPE.SOA, qname="abc.com.") == (rrs, [])
+    assert sections(rrs, QTYPE.SOA, qname="www.abc.com.") == ([], rrs)
+
+
+def test_truncate():
+    request = DNSRecord.question("abc.com.", "MX")
+    assert payload(request) == 512
+
+    request.add_ar(EDNS0(udp_len=1232))
+    assert payload(request) == 1232
+    assert payload(request.reply()) == 512
+
+    reply = request.reply()
+    reply.add_ar(*edns(request))
+    assert payload(reply) == 1232
+
+    glue = [RR("mail.abc.com.", rdata=A("127.0.0.25"))] * 100
+    reply.add_answer(*[RR("abc.com.", rdata=A("127.0.0.1"))] * 10)
+
+    # Glue is dropped first
+    reply.add_ar(*glue)
+    data = truncate(reply, 512)
+    record = DNSRecord.parse(data)
+    assert len(data) <= 512
+    assert not record.header.tc
+    assert len(record.rr) == 10
+    assert [rr.rtype for rr in record.ar] == [QTYPE.OPT]
+
+    # then the answer (with TC set)
+    reply.add_answer(*[RR("abc.com.", rdata=A("127.0.0.1"))] * 100)
+    data = truncate(reply, 1232)
+    record = DNSRecord.parse(data)
+    assert record.header.tc
+    assert record.rr == []
@@ -0,0 +1,57 @@
+"""Test Batch Updates"""
+
+
+from io import StringIO
+
+
+from dnslib import QTYPE
+
+from udns.batch import apply, parse_json, parse_nsupdate
+from udns.storage import MemoryStorage
+
+
+JSON = u"""{"op": "add", "name": "www.abc.com.", "data": "127.0.0.1"}
+{"op": "add", "zone": "abc.com.", "name": "mail", "data": "127.0.0.2"}
+{"op": "add", "name": "www.xyz.com.", "data": "127.0.0.1"}
+{"op": "add", "name": "ftp.abc.com.", "data": "localhost"}
+{"op": "replace", "name": "www.abc.com.", "data": "127.0.0.3"}
+"""
+
+NSUPDATE = u"""zone abc.com
+update delete mail.abc.com. A
+update add ftp.abc.com. 60 IN CNAME www.abc.com.
+send
+prereq nxdomain abc.com.
+"""
+
+
+def test_batch():
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+
+    results = list(apply(db, parse_json(StringIO(JSON))))
+
+    assert [r.lineno for r in results] == [1, 2, 3, 4, 5]
+    assert [r.error is None for r in results] == [
+        True, True, False, False, True
+    ]
+
+    # All changes of a transaction are made under a single serial
+    assert zone.serial == 1
+
+    records = db.resolve(["www.abc.com.", "mail.abc.com."])
+    assert [r.rdata for r in records["www.abc.com."]] == ["127.0.0.3"]
+    assert records["mail.abc.com."][0].ttl == 300
+
+    results = list(apply(db, parse_nsupdate(StringIO(NSUPDATE))))
+
+    assert [(r.lineno, r.error is None) for r in results] == [
+        (2, True), (3, True), (5, False)
+    ]
+    assert zone.serial == 2
+
+    records = db.resolve(["mail.abc.com.", "ftp.abc.com."])
+    assert records["mail.abc.com."] == []
+    assert [r.rtype for r in records["ftp.abc.com."]] == [
+        QTYPE.CNAME, QTYPE.A
+    ]
@@ -0,0 +1,63 @@
+"""Test Cache"""
+
+
+from threading import Thread
+
+
+from dnslib import RR, A
+
+from udns.cache import Cache
+
+
+def test_cache():
+    cache = Cache(64, shards=4)
+
+    for i in range(128):
+        rr = RR("abc.com.", rdata=A("127.0.0.1"))
+        cache[("{0:d}.abc.com.".format(i), 1, 1)] = [rr]
+
+    # Each shard evicts its own least recently used entries
+    assert len(cache) <= 64
+    assert ("127.abc.com.", 1, 1) in cache
+
+    (key, rrs, age), = [e for e in cache.dump() if e[0][0] == "127.abc.com."]
+    assert rrs[0].rname == "abc.com." and age >= 0
+
+    removed = cache.evict(lambda key, rrs: key[0].startswith("127."))
+    assert removed == [("127.abc.com.", 1, 1)]
+    assert cache.get(("127.abc.com.", 1, 1)) is None
+
+
+def test_expire():
+    cache = Cache(16)
+
+    key = ("www.abc.com.", 1, 1)
+    cache[key] = [RR("www.abc.com.", rdata=A("127.0.0.1"), ttl=1)]
+
+    assert cache.expire() == []
+    assert cache[key][0].ttl == 0
+    assert cache.expire() == [key]
+    assert key not in cache
+
+    cache[key] = [RR("www.abc.com.", rdata=A("127.0.0.1"), ttl=10)]
+    assert cache.expire(8) == []
+    assert cache[key][0].ttl == 2
+    assert cache.expire(3) == [key]
+
+
+def test_threads():
+    cache = Cache(1024, shards=8)
+
+    def worker(n):
+        for i in range(1000):
+            key = ("{0:d}.{1:d}.abc.com.".format(i % 100, n), 1, 1)
+            if cache.get(key) is None:
+                cache[key] = [RR(key[0], rdata=A("127.0.0.1"))]
+
+    threads = [Thread(target=worker, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(cache) == 800
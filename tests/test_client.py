@@ -0,0 +1,35 @@
+"""Test Client"""
+
+
+from pytest import raises
+
+from udns import __version__
+from udns.client import main
+
+
+def test_main(tmpdir, capsys):
+    dbfile = str(tmpdir.join("udns.db"))
+
+    def udnsc(*args):
+        main(["--storage", "sqlite", "--dbfile", dbfile] + list(args))
+        return capsys.readouterr().out
+
+    with raises(SystemExit):
+        udnsc("--version")
+    assert capsys.readouterr().out.strip() == __version__
+
+    udnsc("create", "abc.com.")
+    udnsc("add", "abc.com.", "www", "127.0.0.2")
+    assert udnsc("list").split() == ["abc.com."]
+
+    operations = tmpdir.join("operations.txt")
+    operations.write("update add mail.abc.com. 300 A 127.0.0.25\n")
+    assert udnsc("batch", str(operations)).split() == ["1:", "ok"]
+
+    assert [line.split() for line in udnsc("show", "abc.com.").splitlines()] \
+        == [
+            ["www.abc.com.", "0", "IN", "A", "127.0.0.2"],
+            ["mail.abc.com.", "300", "IN", "A", "127.0.0.25"],
+        ]
+
+    assert "$ORIGIN abc.com" in udnsc("export", "abc.com.")
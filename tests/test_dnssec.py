@@ -0,0 +1,181 @@
+"""Test DNSSEC"""
+
+
+import hashlib
+from struct import pack
+from binascii import hexlify, unhexlify
+
+
+from dnslib.label import DNSBuffer
+from dnslib import DNSRecord, EDNS0, QTYPE, RR
+
+from udns import answers, dnssec
+from udns.storage import Entry
+
+
+ZONE = """
+abc.com. 300 IN SOA ns.abc.com. admin.abc.com. 1 3600 600 86400 60
+abc.com. 300 IN NS ns.abc.com.
+ns.abc.com. 300 IN A 127.0.0.1
+www.abc.com. 300 IN A 127.0.0.2
+web.abc.com. 300 IN CNAME www.abc.com.
+sub.abc.com. 300 IN NS ns.sub.abc.com.
+ns.sub.abc.com. 300 IN A 127.0.0.3
+"""
+
+
+# DER encoded DigestInfo of a SHA-256 digest (RFC 8017 9.2)
+SHA256_INFO = unhexlify("3031300d060960864801650304020105000420")
+
+
+def wire(name):
+    """Return the uncompressed wire format of the (lowercased) ``name``"""
+
+    labels = [label for label in str(name).lower().split(".") if label]
+    return b"".join(
+        pack("!B", len(label)) + label.encode("ascii") for label in labels
+    ) + b"\x00"
+
+
+def verify(rrsig, rrs, key):
+    """Check the signature of ``rrsig`` over ``rrs`` with ``key``
+
+    The signed data (RFC 4034 3.1.8.1) and its padded digest are built
+    here independently of :mod:`udns.dnssec` (for RRsets without names in
+    their rdata) and compared with the decrypted signature.
+    """
+
+    rdata = rrsig.rdata
+    assert rdata.key_tag == key.tag()
+    assert rdata.algorithm == dnssec.RSASHA256
+
+    data = pack(
+        "!HBBIIIH", rdata.covered, rdata.algorithm, rdata.labels,
+        rdata.orig_ttl, rdata.sig_exp, rdata.sig_inc, rdata.key_tag
+    ) + wire(rdata.name)
+
+    rdatas = []
+    for rr in rrs:
+        buffer = DNSBuffer()
+        rr.rdata.pack(buffer)
+        rdatas.append(bytes(buffer.data))
+
+    for rd in sorted(set(rdatas)):
+        data += wire(rrs[0].rname) + pack(
+            "!HHIH", rrs[0].rtype, rrs[0].rclass, rdata.orig_ttl, len(rd)
+        ) + rd
+
+    size = (key.n.bit_length() + 7) // 8
+    info = SHA256_INFO + hashlib.sha256(data).digest()
+    expected = b"\x00\x01" + b"\xff" * (size - len(info) - 3) + b"\x00" + info
+
+    signature = int(hexlify(rdata.sig), 16)
+    decrypted = unhexlify(
+        "{0:x}".format(pow(signature, key.e, key.n)).rjust(2 * size, "0")
+    )
+
+    assert len(rdata.sig) == size
+    assert decrypted == expected
+
+
+def test_key(tmpdir):
+    key = dnssec.generate_key(1024, flags=dnssec.ZONE | dnssec.SEP)
+
+    assert key.ksk
+    assert key.n.bit_length() == 1024
+    assert pow(pow(42, key.e, key.n), key.d, key.n) == 42
+
+    base = dnssec.save_key(key, "abc.com.", str(tmpdir))
+    assert base.endswith("Kabc.com.+008+{0:05d}".format(key.tag()))
+
+    loaded = dnssec.load_key(base + ".private")
+    assert (loaded.n, loaded.e, loaded.d) == (key.n, key.e, key.d)
+    assert loaded.flags == key.flags
+    assert loaded.tag() == key.tag()
+
+
+def test_sign_zone():
+    ksk = dnssec.generate_key(1024, flags=dnssec.ZONE | dnssec.SEP)
+    zsk = dnssec.generate_key(1024)
+
+    rrs = RR.fromZone(ZONE)
+    signed = dnssec.sign_zone("abc.com.", rrs, [ksk, zsk], 0, 86400)
+
+    nsec = [rr for rr in signed if rr.rtype == dnssec.NSEC_TYPE]
+    assert [(str(rr.rname), str(rr.rdata.label)) for rr in nsec] == [
+        ("abc.com.", "ns.abc.com."),
+        ("ns.abc.com.", "sub.abc.com."),
+        ("sub.abc.com.", "web.abc.com."),
+        ("web.abc.com.", "www.abc.com."),
+        ("www.abc.com.", "abc.com."),
+    ]
+    assert nsec[0].ttl == 60
+
+    rrsigs = dict(
+        ((str(rr.rname), rr.rdata.covered, rr.rdata.key_tag), rr)
+        for rr in signed if rr.rtype == dnssec.RRSIG_TYPE
+    )
+
+    # The KSK signs the DNSKEY RRset, the ZSK all others
+    dnskeys = [rr for rr in signed if rr.rtype == dnssec.DNSKEY_TYPE]
+    verify(rrsigs["abc.com.", dnssec.DNSKEY_TYPE, ksk.tag()], dnskeys, ksk)
+    assert ("abc.com.", dnssec.DNSKEY_TYPE, zsk.tag()) not in rrsigs
+
+    www = [rr for rr in rrs if str(rr.rname) == "www.abc.com."]
+    verify(rrsigs["www.abc.com.", QTYPE.A, zsk.tag()], www, zsk)
+
+    # Delegations only have their NSEC signed and glue is left alone
+    assert ("sub.abc.com.", QTYPE.NS, zsk.tag()) not in rrsigs
+    assert ("sub.abc.com.", dnssec.NSEC_TYPE, zsk.tag()) in rrsigs
+    assert not [k for k in rrsigs if k[0] == "ns.sub.abc.com."]
+
+
+def test_answers():
+    key = dnssec.generate_key(1024)
+
+    rrs = RR.fromZone(ZONE)
+    signed = dnssec.sign_zone("abc.com.", rrs, [key], 0, 86400)
+
+    records = [
+        Entry.from_rr(rr) for rr in rrs + signed
+        if str(rr.rname) == "www.abc.com."
+    ]
+
+    selected = [r.rr for r in answers.select(records, QTYPE.A, 1)]
+    assert [rr.rtype for rr in selected] == [QTYPE.A, dnssec.RRSIG_TYPE]
+
+    assert answers.sections(selected, QTYPE.A) == (selected[:1], [])
+    assert answers.sections(selected, QTYPE.A, True) == (selected, [])
+
+    # No data: the NSEC record (and its signature) go to the authority
+    selected = [r.rr for r in answers.select(records, QTYPE.MX, 1)]
+    rr, auth = answers.sections(selected, QTYPE.MX, True)
+    assert rr == []
+    assert [r.rtype for r in auth] == [dnssec.NSEC_TYPE, dnssec.RRSIG_TYPE]
+
+    # with the SOA of the zone (and its signature) ahead of them
+    soa = [
+        rr for rr in rrs + signed if str(rr.rname) == "abc.com." and (
+            rr.rtype == QTYPE.SOA or (
+                rr.rtype == dnssec.RRSIG_TYPE and rr.rdata.covered == QTYPE.SOA
+            )
+        )
+    ]
+    rr, auth = answers.sections(
+        selected + answers.negative(soa), QTYPE.MX, True, "www.abc.com."
+    )
+    assert rr == []
+    assert [(r.rtype, r.ttl) for r in auth[:2]] == [
+        (QTYPE.SOA, 60), (dnssec.RRSIG_TYPE, 60)
+    ]
+    assert [r.rtype for r in auth[2:]] == [
+        dnssec.NSEC_TYPE, dnssec.RRSIG_TYPE
+    ]
+
+    request = DNSRecord.question("www.abc.com.")
+    assert not answers.dnssec_ok(request)
+    assert answers.edns(request) == []
+
+    request.add_ar(EDNS0(flags="do", udp_len=1232))
+    assert answers.dnssec_ok(request)
+    assert answers.edns(request)[0].ttl & answers.DO
@@ -0,0 +1,104 @@
+"""Test Forwarders"""
+
+
+from json import dumps
+
+
+from pytest import raises
+
+from dnslib import RR
+
+from udns.forwarders import load_forwarders, parse_server, parse_servers
+from udns.forwarders import valid_ttls
+from udns.forwarders import Forwarder, Forwarders
+
+
+def test_parse_server():
+    assert parse_server("10.0.0.1") == ("10.0.0.1", 53)
+    assert parse_server("10.0.0.1:5353") == ("10.0.0.1", 5353)
+    assert parse_server("fd00::1") == ("fd00::1", 53)
+    assert parse_server("[fd00::1]:5353") == ("fd00::1", 5353)
+
+    assert parse_servers("8.8.8.8, 1.1.1.1") == [
+        ("8.8.8.8", 53), ("1.1.1.1", 53)
+    ]
+
+
+def test_forwarders():
+    default = Forwarder(".", [("8.8.8.8", 53)])
+    forwarders = Forwarders(default)
+    assert forwarders.match("corp.internal.") is default
+
+    corp = Forwarder("corp.internal", [("10.0.0.1", 53), ("10.0.0.2", 53)])
+    cluster = Forwarder("svc.cluster.local.", [("10.96.0.10", 53)])
+    dev = Forwarder("dev.corp.internal.", [("10.0.1.1", 53)])
+    for forwarder in (corp, cluster, dev):
+        forwarders.add(forwarder)
+
+    assert forwarders.match("corp.internal.") is corp
+    assert forwarders.match("www.CORP.internal.") is corp
+    assert forwarders.match("a.dev.corp.internal.") is dev
+    assert forwarders.match("x.svc.cluster.local.") is cluster
+    assert forwarders.match("cluster.local.") is default
+    assert forwarders.match("notcorp.internal.") is default
+    assert forwarders.match(".") is default
+    assert list(forwarders) == [default, corp, dev, cluster]
+
+    # Servers are used in turn
+    assert [corp.server() for _ in range(3)] == [
+        ("10.0.0.1", 53), ("10.0.0.2", 53), ("10.0.0.1", 53)
+    ]
+
+
+def test_clamp():
+    rrs = RR.fromZone("a.corp. 3600 IN A 10.0.0.1\na.corp. 0 IN A 10.0.0.2")
+
+    Forwarder(".", [], max_ttl=300).clamp(rrs)
+    assert [rr.ttl for rr in rrs] == [300, 0]
+
+    Forwarder(".", [], min_ttl=30, max_ttl=300).clamp(rrs)
+    assert [rr.ttl for rr in rrs] == [300, 30]
+
+    Forwarder(".", []).clamp(rrs)
+    assert [rr.ttl for rr in rrs] == [300, 30]
+
+    # Jitter shortens (never lengthens) all records of an answer alike
+    ttls = set()
+    for _ in range(50):
+        rrs = RR.fromZone("a. 1000 IN A 10.0.0.1\na. 1000 IN MX 10 b.")
+        Forwarder(".", [], min_ttl=950, jitter=0.1).clamp(rrs)
+        assert rrs[0].ttl == rrs[1].ttl
+        ttls.add(rrs[0].ttl)
+
+    assert len(ttls) > 1
+    assert min(ttls) >= 950 and max(ttls) <= 1000
+
+
+def test_valid_ttls():
+    assert valid_ttls(None, None)
+    assert valid_ttls(30, None)
+    assert valid_ttls(30, 300)
+    assert not valid_ttls(300, 30)
+    assert not valid_ttls(-1, None)
+
+
+def test_load_forwarders(tmpdir):
+    config = tmpdir.join("forwarders.json")
+    config.write(dumps({
+        "corp.internal": {"servers": ["10.0.0.1:5353"], "max_ttl": 300},
+    }))
+
+    assert load_forwarders(str(config)) == [
+        ("corp.internal.", [("10.0.0.1", 5353)], None, 300),
+    ]
+
+    config.write(dumps({
+        "corp.internal.": {"servers": ["10.0.0.1"], "min_ttl": 600,
+                           "max_ttl": 300}
+    }))
+    with raises(ValueError):
+        load_forwarders(str(config))
+
+    config.write(dumps({"corp.internal.": {"servers": []}}))
+    with raises(ValueError):
+        load_forwarders(str(config))
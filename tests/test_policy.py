@@ -0,0 +1,84 @@
+"""Test Response Policy"""
+
+
+from dnslib import QTYPE
+
+from udns.policy import parse, Policy, Rules
+from udns.policy import DROP, NODATA, NXDOMAIN, PASSTHRU, REWRITE
+
+
+ZONE = """\
+$TTL 60
+@ SOA localhost. root.localhost. ( 1 3600
+      600 86400 60 )
+  NS localhost.
+$ORIGIN rpz.local.
+ads.example.com             CNAME   .
+*.ads.example.com           CNAME   .
+tracker.example.com         CNAME   *.
+good.ads.example.com        CNAME   rpz-passthru.
+bad.example.com.rpz.local.  CNAME   rpz-drop.
+home.example.com            A       127.0.0.1
+                            TXT     "hello world"
+"""
+
+
+def test_parse():
+    records = list(parse(ZONE.splitlines()))
+
+    assert records[0] == ("ads.example.com", QTYPE.CNAME, 1, 60, ".")
+    assert records[4][0] == "bad.example.com"
+    assert records[-1] == (
+        "home.example.com", QTYPE.TXT, 1, 60, "\"hello world\""
+    )
+
+    # Plain lists of names
+    assert list(parse(["evil.com", "*.evil.com"])) == [
+        ("evil.com", QTYPE.CNAME, 1, 300, "."),
+        ("*.evil.com", QTYPE.CNAME, 1, 300, "."),
+    ]
+
+
+def test_rules():
+    rules = Rules([(b"com.b", 1), (b"com.a", 0), (b"com.b", 2)], "xyz")
+
+    assert len(rules) == 2
+    assert rules.get(b"com.a") == "x"
+    assert rules.get(b"com.b") == "y"
+    assert rules.get(b"com.c") is None
+    assert rules.get(b"com") is None
+
+
+def test_policy(tmpdir):
+    zone = tmpdir.join("rpz.zone")
+    zone.write(ZONE)
+
+    names = tmpdir.join("names.txt")
+    names.write("evil.com\nads.example.com\n")
+
+    policy = Policy([str(zone), str(names)])
+
+    def kind(qname):
+        action = policy.match(qname)
+        return action and action.kind
+
+    assert kind("ads.example.com.") == NXDOMAIN
+    assert kind("www.ads.example.com.") == NXDOMAIN
+    assert kind("good.ads.example.com.") == PASSTHRU
+    assert kind("Tracker.Example.COM.") == NODATA
+    assert kind("bad.example.com.") == DROP
+    assert kind("evil.com.") == NXDOMAIN
+    assert kind("www.evil.com.") is None
+    assert kind("example.com.") is None
+
+    action = policy.match("home.example.com.")
+    assert action.kind == REWRITE
+
+    rrs = policy.answer(action, "home.example.com.", QTYPE.A, 1)
+    assert [str(rr.rdata) for rr in rrs] == ["127.0.0.1"]
+    assert policy.answer(action, "home.example.com.", QTYPE.MX, 1) == []
+
+    assert not policy.changed()
+    names.write("evil.com\n", mode="a")
+    names.setmtime(names.mtime() + 10)
+    assert policy.changed()
@@ -0,0 +1,119 @@
+"""Test Replay"""
+
+
+from io import StringIO
+from json import loads
+from struct import pack
+
+
+from dnslib import DNSRecord, QTYPE
+
+from udns.replay import is_capture, main, parse_log, read_queries, synthesize
+
+
+def frame(src, dst, sport, dport, payload):
+    """Return an Ethernet frame of an IPv4 UDP datagram"""
+
+    udp = pack("!HHHH", sport, dport, 8 + len(payload), 0) + payload
+    ip = pack(
+        "!BBHHHBBH4s4s", 0x45, 0, 20 + len(udp), 0, 0x4000, 64, 17, 0,
+        bytes(bytearray(src)), bytes(bytearray(dst))
+    ) + udp
+    return b"\x00" * 12 + b"\x08\x00" + ip
+
+
+def capture(filename, packets):
+    with open(filename, "wb") as f:
+        f.write(pack("<IHHiIII", 0xa1b2c3d4, 2, 4, 0, 0, 65535, 1))
+        for time, data in packets:
+            f.write(pack("<IIII", time, 500000, len(data), len(data)))
+            f.write(data)
+
+
+def test_pcap(tmpdir):
+    client, server = (10, 0, 0, 9), (10, 0, 0, 1)
+
+    query = DNSRecord.question("www.abc.com")
+    reply = DNSRecord.parse(synthesize(query, 300))
+
+    filename = str(tmpdir.join("capture.pcap"))
+    capture(filename, [
+        (1, frame(client, server, 40000, 53, query.pack())),
+        (1, frame(server, client, 53, 40000, reply.pack())),
+        (2, frame(client, server, 40000, 5353, query.pack())),
+    ])
+
+    assert is_capture(filename)
+
+    queries, responses = read_queries(filename)
+    queries = list(queries)
+
+    assert len(queries) == 1
+    assert queries[0].time == 1.5
+    assert queries[0].data == query.pack()
+
+    assert list(responses) == [("www.abc.com.", QTYPE.A, 1)]
+
+
+def test_parse_log():
+    log = StringIO(
+        u"# queries\n"
+        u"www.abc.com\n"
+        u"abc.com mx\n"
+        u"{\"time\": 1.5, \"qname\": \"abc.com.\", \"qtype\": \"AAAA\", "
+        u"\"qclass\": \"IN\", \"type\": \"cached\"}\n"
+    )
+
+    queries = list(parse_log(log))
+    questions = [DNSRecord.parse(query.data).q for query in queries]
+
+    assert [query.time for query in queries] == [None, None, 1.5]
+    assert [(str(q.qname), q.qtype) for q in questions] == [
+        ("www.abc.com.", QTYPE.A),
+        ("abc.com.", QTYPE.MX),
+        ("abc.com.", QTYPE.AAAA),
+    ]
+
+
+def test_synthesize(tmpdir):
+    request = DNSRecord.question("www.abc.com")
+    reply = DNSRecord.parse(synthesize(request, 60))
+
+    assert reply.header.id == request.header.id
+    assert [(rr.rtype, rr.ttl) for rr in reply.rr] == [(QTYPE.A, 60)]
+
+    # The same name always gets the same answer
+    again = DNSRecord.parse(synthesize(DNSRecord.question("WWW.abc.com"), 60))
+    assert str(again.rr[0].rdata) == str(reply.rr[0].rdata)
+
+    request = DNSRecord.question("abc.com", "MX")
+    assert DNSRecord.parse(synthesize(request, 60)).rr == []
+
+    log = tmpdir.join("queries.log")
+    log.write("www.abc.com\n")
+    assert not is_capture(str(log))
+
+
+def test_main(tmpdir, capsys):
+    zone = tmpdir.join("abc.com")
+    zone.write(
+        "$TTL 300\n"
+        "$ORIGIN abc.com.\n"
+        "@ IN SOA ns.abc.com. admin.abc.com. 1 3600 600 86400 60\n"
+        "www IN A 127.0.0.2\n"
+    )
+
+    log = tmpdir.join("queries.log")
+    log.write("www.abc.com\nwww.xyz.com\nwww.xyz.com\n")
+
+    main([
+        "--zone", "abc.com.={0:s}".format(str(zone)),
+        "--concurrency", "1", "--json", str(log)
+    ])
+
+    summary = loads(capsys.readouterr().out.splitlines()[-1])
+
+    assert summary["summary"]
+    assert summary["queries"] == summary["answered"] == 3
+    assert summary["lost"] == 0
+    assert summary["forwarded"] == summary["synthesized"] == 1
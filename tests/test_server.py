@@ -0,0 +1,653 @@
+"""Test Server
+
+An in-process server on MemoryStorage forwarding to the fake upstream of
+udns-replay (no Redis or network needed).
+"""
+
+
+from time import sleep
+from json import loads
+from logging import getLogger
+from contextlib import contextmanager
+from struct import pack, unpack
+from ssl import SSLContext, CERT_NONE, PROTOCOL_TLS_CLIENT
+from socket import create_connection, socket, timeout, error as SocketError
+from socket import AF_INET, SOCK_DGRAM, SOCK_STREAM
+
+
+try:
+    from urllib.parse import urlencode
+    from urllib.error import HTTPError
+    from urllib.request import Request, urlopen
+except ImportError:  # pragma: no cover
+    from urllib import urlencode  # noqa
+    from urllib2 import HTTPError, Request, urlopen  # noqa
+
+
+from pytest import raises
+
+
+from dnslib import DNSRecord, EDNS0, QTYPE, RCODE, RD, RR, A, SOA
+
+from udns import client, dnssec, tsig, xfr
+from udns.answers import dnssec_ok
+from udns.update import ANY
+from udns.replay import question, Ready, Upstream
+from udns.storage import Entry, MemoryStorage
+from udns.server import parse_args, Server
+
+
+@contextmanager
+def serve(db, *argv, **options):
+    upstream = Upstream(options.get("responses", {}), 60)
+    upstream.start()
+
+    # Forwarding to the fake upstream after any other ``servers``
+    servers = options.get("servers", []) + [upstream.address]
+
+    args = parse_args([
+        "--bind", "127.0.0.1:0",
+        "--forward", ",".join("{0:s}:{1:d}".format(*s) for s in servers),
+    ] + list(argv))
+
+    server = Server(args, db, options.get("hosts", {}), getLogger(__name__))
+    ready = Ready().register(server)
+
+    server.start()
+    assert ready.flag.wait(5)
+
+    try:
+        yield server, upstream
+    finally:
+        server.stop()
+        upstream.stop()
+
+
+KEY = "hmac-sha256:update:c2VjcmV0c2VjcmV0"
+
+
+def exchange(server, data):
+    sock = socket(AF_INET, SOCK_DGRAM)
+    sock.settimeout(2)
+
+    try:
+        sock.sendto(data, (server.transport.host, server.transport.port))
+        return DNSRecord.parse(sock.recv(65535))
+    finally:
+        sock.close()
+
+
+def query(server, qname, qtype="A", do=False):
+    request = DNSRecord.question(qname, qtype)
+    if do:
+        request.add_ar(EDNS0(flags="do"))
+    return exchange(server, request.pack())
+
+
+class BrokenStorage(MemoryStorage):
+
+    def resolve(self, names):
+        raise IOError("database unavailable")
+
+
+def test_lookup_failed():
+    with serve(BrokenStorage()) as (server, upstream):
+        reply = query(server, "www.abc.com")
+
+        assert reply.header.rcode == RCODE.SERVFAIL
+        assert upstream.synthesized == 0
+
+
+def test_attach():
+    closed = socket(AF_INET, SOCK_STREAM)
+    closed.bind(("127.0.0.1", 0))
+    port = closed.getsockname()[1]
+    closed.close()
+
+    hosts = {("localhost.", QTYPE.A, 1): ["127.0.0.1"]}
+
+    with serve(None, "--dbport", str(port), hosts=hosts) as (server, upstream):
+        # Until Redis is attached the hosts (and cache) are served
+        assert [str(rr.rdata) for rr in query(server, "localhost").rr] == [
+            "127.0.0.1"
+        ]
+
+        # and queries needing the database are answered with SERVFAIL
+        reply = query(server, "www.abc.com")
+        assert reply.header.rcode == RCODE.SERVFAIL
+        assert upstream.synthesized == 0
+
+
+def test_negative():
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+    db.add_record(zone, "@", "ns.abc.com. admin.abc.com. 1 3600 600 86400 60",
+                  rtype=QTYPE.SOA)
+    db.add_record(zone, "www", "127.0.0.2")
+    db.add_record(zone, "ftp", "old.abc.com.", rtype=QTYPE.CNAME)
+
+    with serve(db) as (server, upstream):
+        for i in range(2):
+            # NODATA (then from the cache) with the SOA as the authority
+            reply = query(server, "www.abc.com", "MX")
+            assert reply.header.rcode == RCODE.NOERROR
+            assert reply.rr == []
+            assert [(str(rr.rname), rr.rtype) for rr in reply.auth] == [
+                ("abc.com.", QTYPE.SOA)
+            ]
+            assert reply.auth[0].ttl <= 60
+
+        reply = query(server, "ftp.abc.com")
+        assert reply.header.rcode == RCODE.NXDOMAIN
+        assert [rr.rtype for rr in reply.rr] == [QTYPE.CNAME]
+        assert [rr.rtype for rr in reply.auth] == [QTYPE.SOA]
+
+        assert upstream.synthesized == 0
+
+
+SIGNED = """
+abc.com. 300 IN SOA ns.abc.com. admin.abc.com. 1 3600 600 86400 60
+abc.com. 300 IN MX 10 mail.abc.com.
+mail.abc.com. 300 IN A 127.0.0.25
+"""
+
+
+def test_glue_signed():
+    rrs = RR.fromZone(SIGNED)
+    signed = dnssec.sign_zone(
+        "abc.com.", rrs, [dnssec.generate_key(1024)], 0, 2 ** 31
+    )
+
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+    db.update(zone, adds=[Entry.from_rr(rr) for rr in rrs + signed])
+
+    with serve(db) as (server, upstream):
+        reply = query(server, "abc.com", "MX")
+        assert [str(rr.rname) for rr in reply.ar] == ["mail.abc.com."]
+
+        # The glue seeds the cache with the signatures of the addresses
+        reply = query(server, "mail.abc.com", "A", do=True)
+        assert dnssec_ok(reply)
+        assert [rr.rtype for rr in reply.rr] == [QTYPE.A, QTYPE.RRSIG]
+
+        # but no NODATA answer lacking its proof
+        reply = query(server, "mail.abc.com", "AAAA", do=True)
+        assert [rr.rtype for rr in reply.auth] == [
+            QTYPE.SOA, QTYPE.RRSIG, QTYPE.NSEC, QTYPE.RRSIG
+        ]
+
+
+def test_relay_ids(monkeypatch):
+    # Every upstream request first draws the same id
+    monkeypatch.setattr("dnslib.dns.random.randint", lambda a, b: 1)
+
+    with serve(MemoryStorage()) as (server, upstream):
+        address = server.transport.host, server.transport.port
+
+        socks = []
+        for qname in ("www.abc.com", "www.xyz.com"):
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.settimeout(2)
+            sock.sendto(DNSRecord.question(qname).pack(), address)
+            socks.append(sock)
+
+        try:
+            replies = [DNSRecord.parse(sock.recv(65535)) for sock in socks]
+        finally:
+            for sock in socks:
+                sock.close()
+
+        assert [str(reply.q.qname) for reply in replies] == [
+            "www.abc.com.", "www.xyz.com."
+        ]
+        assert upstream.synthesized == 2
+
+
+def test_expiry():
+    with serve(MemoryStorage(), "--max-ttl", "1") as (server, upstream):
+        assert [rr.ttl for rr in query(server, "www.xyz.com").rr] == [1]
+        assert query(server, "www.xyz.com").rr
+        assert upstream.synthesized == 1
+
+        # Gone (and forwarded again) once its clamped ttl has run out
+        sleep(2.5)
+        assert query(server, "www.xyz.com").rr
+        assert upstream.synthesized == 2
+
+
+def test_upstream_negative():
+    soa = RR(
+        "xyz.com.", QTYPE.SOA, ttl=60,
+        rdata=SOA("ns.xyz.com.", "admin.xyz.com.", (1, 3600, 600, 86400, 60))
+    )
+
+    nxdomain = DNSRecord.question("nx.xyz.com").reply()
+    nxdomain.header.rcode = RCODE.NXDOMAIN
+    nxdomain.add_auth(soa)
+
+    servfail = DNSRecord.question("www.xyz.com").reply()
+    servfail.header.rcode = RCODE.SERVFAIL
+
+    nodata = DNSRecord.question("www.xyz.com", "MX").reply()
+    nodata.add_auth(soa)
+
+    responses = dict(
+        (question(r), r.pack()) for r in (nxdomain, servfail, nodata)
+    )
+
+    with serve(MemoryStorage(), responses=responses) as (server, upstream):
+        for i in range(2):
+            reply = query(server, "nx.xyz.com")
+            assert reply.header.rcode == RCODE.NXDOMAIN
+            assert [rr.rtype for rr in reply.auth] == [QTYPE.SOA]
+
+            reply = query(server, "www.xyz.com")
+            assert reply.header.rcode == RCODE.SERVFAIL
+
+            reply = query(server, "www.xyz.com", "MX")
+            assert reply.header.rcode == RCODE.NOERROR
+            assert reply.rr == []
+            assert [rr.rtype for rr in reply.auth] == [QTYPE.SOA]
+
+        # Only the NODATA answer (with its SOA) was cached
+        assert upstream.recorded == 5
+
+
+def test_update():
+    db = MemoryStorage()
+    db.create_zone("abc.com.", ttl=300)
+
+    request = DNSRecord.question("abc.com.", "SOA")
+    request.header.opcode = 5
+    request.add_auth(RR("www.abc.com.", 1, ANY, 0, RD()))
+    request.add_auth(RR("www.abc.com.", 1, 1, 60, A("127.0.0.2")))
+    data, signature = tsig.sign(request.pack(), tsig.parse_key(KEY))
+
+    with serve(db, "--tsig-key", KEY) as (server, upstream):
+        assert exchange(server, data).header.rcode == RCODE.NOERROR
+
+        records = db.resolve(["www.abc.com."])["www.abc.com."]
+        assert [r.rdata for r in records] == ["127.0.0.2"]
+
+
+def test_stream_malformed():
+    with serve(MemoryStorage()) as (server, upstream):
+        address = server.stream.host, server.stream.port
+
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(2)
+        sock.connect(address)
+
+        try:
+            sock.sendall(pack("!H", 3) + b"abc")
+            assert sock.recv(65535) == b""
+        finally:
+            sock.close()
+
+        # A query pipelined with a truncated UPDATE is not dispatched again
+        # (on reading more) but the connection closed
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(2)
+        sock.connect(address)
+
+        request = DNSRecord.question("abc.com.", "SOA")
+        request.header.opcode = 5
+        request.add_auth(RR("www.abc.com.", 1, ANY, 0, RD()))
+        truncated = request.pack()[:-3]
+
+        data = DNSRecord.question("www.abc.com").pack()
+        messages = [pack("!H", len(data)) + data]
+        messages.append(pack("!H", len(truncated)) + truncated)
+
+        try:
+            sock.sendall(b"".join(messages))
+            sleep(0.5)
+            try:
+                sock.sendall(messages[0])
+            except SocketError:
+                pass
+
+            data = b""
+            while True:
+                try:
+                    chunk = sock.recv(65535)
+                except SocketError:
+                    break
+                if not chunk:
+                    break
+                data += chunk
+            assert len(data) <= 2 + unpack("!H", data[:2] or b"\0\0")[0]
+        finally:
+            sock.close()
+
+        # Other connections are still served
+        sock = socket(AF_INET, SOCK_STREAM)
+        sock.settimeout(2)
+        sock.connect(address)
+
+        try:
+            data = DNSRecord.question("www.abc.com").pack()
+            sock.sendall(pack("!H", len(data)) + data)
+            data = sock.recv(65535)
+            assert DNSRecord.parse(data[2:]).header.rcode == RCODE.NOERROR
+        finally:
+            sock.close()
+
+
+def notify(server, zone):
+    request = xfr.notify(zone)
+    request.header.aa = 0
+    return exchange(server, request.pack())
+
+
+def test_notify():
+    primary = socket(AF_INET, SOCK_STREAM)
+    primary.bind(("127.0.0.1", 0))
+    primary.listen(8)
+    primary.settimeout(2)
+
+    secondary = "abc.com=127.0.0.1:{0:d}".format(primary.getsockname()[1])
+
+    with serve(MemoryStorage(), "--secondary", secondary) as (server, _):
+        # The transfer started on start up is held open by the primary
+        sock, address = primary.accept()
+
+        # NOTIFYs arriving meanwhile are accepted but coalesced
+        for i in range(5):
+            assert notify(server, "abc.com.").header.rcode == RCODE.NOERROR
+        assert notify(server, "xyz.com.").header.rcode == RCODE.REFUSED
+
+        # into a single transfer following the running one
+        sock.close()
+        sock, address = primary.accept()
+        sock.close()
+
+        with raises(timeout):
+            primary.accept()
+
+        # Only the primary of the zone may NOTIFY it
+        server.primaries["abc.com."] = "127.0.0.2"
+        assert notify(server, "abc.com.").header.rcode == RCODE.REFUSED
+
+    primary.close()
+
+
+def certificate(tmpdir):
+    from datetime import datetime, timedelta
+
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes, serialization
+    from cryptography.hazmat.primitives.asymmetric import rsa
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, u"localhost")])
+    now = datetime.utcnow()
+    cert = x509.CertificateBuilder().subject_name(name).issuer_name(
+        name
+    ).public_key(key.public_key()).serial_number(1).not_valid_before(
+        now - timedelta(days=1)
+    ).not_valid_after(now + timedelta(days=1)).sign(key, hashes.SHA256())
+
+    filename = str(tmpdir.join("udns.pem"))
+    with open(filename, "wb") as f:
+        f.write(key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.TraditionalOpenSSL,
+            serialization.NoEncryption()
+        ))
+        f.write(cert.public_bytes(serialization.Encoding.PEM))
+
+    return filename
+
+
+def test_tls_idle(tmpdir):
+    options = ("--tls", "127.0.0.1:0", "--certfile", certificate(tmpdir))
+
+    with serve(MemoryStorage(), *options) as (server, upstream):
+        address = server.tls.host, server.tls.port
+        server.tls.timeout = 1
+
+        # A connection starting no handshake holds up no other queries
+        idle = create_connection(address, 2)
+        try:
+            assert query(server, "www.abc.com").rr
+
+            context = SSLContext(PROTOCOL_TLS_CLIENT)
+            context.check_hostname = False
+            context.verify_mode = CERT_NONE
+
+            sock = context.wrap_socket(create_connection(address, 2))
+            try:
+                data = DNSRecord.question("www.xyz.com").pack()
+                sock.sendall(pack("!H", len(data)) + data)
+                data = sock.recv(65535)
+                assert DNSRecord.parse(data[2:]).rr
+            finally:
+                sock.close()
+
+            # and is closed once its handshake is overdue
+            idle.settimeout(3)
+            assert idle.recv(1) == b""
+        finally:
+            idle.close()
+
+
+def test_truncated():
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+    for i in range(40):
+        db.add_record(zone, "@", "{0:d} mx{0:d}.abc.com.".format(i),
+                      rtype=QTYPE.MX)
+        db.add_record(zone, "mx{0:d}".format(i), "127.0.0.{0:d}".format(i))
+
+    with serve(db) as (server, upstream):
+        # Without EDNS replies fit 512 bytes (dropping glue, then with TC)
+        request = DNSRecord.question("abc.com.", "MX")
+        reply = exchange(server, request.pack())
+        assert len(reply.pack()) <= 512
+        assert reply.header.tc and reply.rr == []
+
+        # or the payload size of the client, offered back in the reply
+        request.add_ar(EDNS0(udp_len=1232))
+        reply = exchange(server, request.pack())
+        assert len(reply.pack()) <= 1232
+        assert not reply.header.tc
+        assert len(reply.rr) == 40
+        assert [(rr.rtype, rr.rclass) for rr in reply.ar] == [
+            (QTYPE.OPT, 1232)
+        ]
+
+        # Over TCP they are not truncated
+        sock = create_connection((server.stream.host, server.stream.port), 2)
+        try:
+            data = request.pack()
+            sock.sendall(pack("!H", len(data)) + data)
+            length, = unpack("!H", sock.recv(2))
+            data = b""
+            while len(data) < length:
+                data += sock.recv(length - len(data))
+            assert len(DNSRecord.parse(data).ar) == 41
+        finally:
+            sock.close()
+
+
+def test_upstream_timeout(monkeypatch):
+    # Every upstream request is sent with id 1
+    monkeypatch.setattr("dnslib.dns.random.randint", lambda a, b: 1)
+
+    # A server never answering (first in the pool)
+    dead = socket(AF_INET, SOCK_DGRAM)
+    dead.bind(("127.0.0.1", 0))
+    servers = [dead.getsockname()]
+
+    options = ("--upstream-timeout", "0.1", "--max-pending", "1")
+
+    try:
+        with serve(MemoryStorage(), *options, servers=servers) as (
+                server, upstream):
+            address = server.transport.host, server.transport.port
+
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.settimeout(3)
+
+            try:
+                sock.sendto(DNSRecord.question("www.abc.com").pack(), address)
+                data, peer = dead.recvfrom(65535)
+
+                # No more queries are forwarded while one is pending
+                reply = query(server, "www.xyz.com")
+                assert reply.header.rcode == RCODE.SERVFAIL
+
+                # nor is a response from another address accepted
+                spoofed = DNSRecord.parse(data).reply()
+                spoofed.add_answer(RR("www.abc.com.", rdata=A("127.0.0.66")))
+                spoofer = socket(AF_INET, SOCK_DGRAM)
+                spoofer.sendto(spoofed.pack(), peer)
+                spoofer.close()
+
+                # The query times out and is retried on the next server
+                reply = DNSRecord.parse(sock.recv(65535))
+                assert [str(rr.rdata) for rr in reply.rr] != ["127.0.0.66"]
+                assert reply.rr
+                assert upstream.synthesized == 1
+            finally:
+                sock.close()
+
+            # Once all servers timed out it is answered with SERVFAIL
+            upstream.stop()
+
+            sock = socket(AF_INET, SOCK_DGRAM)
+            sock.settimeout(5)
+
+            try:
+                sock.sendto(DNSRecord.question("www.def.com").pack(), address)
+                reply = DNSRecord.parse(sock.recv(65535))
+                assert reply.header.rcode == RCODE.SERVFAIL
+                assert not server.peers
+            finally:
+                sock.close()
+    finally:
+        dead.close()
+
+
+TOKEN = "secret"
+
+
+def control(server, path, data=None, token=TOKEN, **params):
+    url = "http://{0:s}:{1:d}/cache{2:s}".format(
+        server.control.host, server.control.port, path
+    )
+    if params:
+        url = "{0:s}?{1:s}".format(url, urlencode(params))
+
+    request = Request(url, data=data)
+    if data is not None:
+        request.add_header("Content-Type", "text/plain")
+    if token is not None:
+        request.add_header("Authorization", "Bearer {0:s}".format(token))
+
+    try:
+        response = urlopen(request, timeout=2)
+    except HTTPError as error:
+        return error.code, None
+
+    return response.getcode(), loads(response.read().decode("utf-8"))
+
+
+def controlled(*argv):
+    return serve(
+        MemoryStorage(),
+        "--control", "127.0.0.1:0", "--control-token", TOKEN, *argv
+    )
+
+
+def test_control():
+    with controlled() as (server, upstream):
+        assert query(server, "www.xyz.com").rr[0].ttl == 60
+        sleep(2.5)
+
+        status, entries = control(server, "")
+        assert status == 200
+        entry, = entries
+        assert (entry["name"], entry["type"], entry["view"]) == (
+            "www.xyz.com.", "A", "default"
+        )
+        assert entry["age"] == 2
+
+        # The ttl counted down (once) by the age of the entry
+        reply = query(server, "www.xyz.com")
+        assert 57 <= entry["ttl"] <= 58
+        assert reply.rr[0].ttl == entry["ttl"]
+
+        assert control(server, "", token=None) == (401, None)
+        assert control(server, "", token="wrong") == (401, None)
+
+        assert control(server, "/flush", name="www.xyz.com") == (405, None)
+        assert control(server, "/flush", b"") == (400, None)
+        assert control(server, "/flush", b"", name="www.xyz.com") == (
+            200, {"flushed": 1}
+        )
+        assert control(server, "") == (200, [])
+
+        assert control(server, "/warm", b"www.abc.com BOGUS\n") == (400, None)
+        assert control(server, "/warm", b"www.abc.com\n# comment\n") == (
+            200, {"queued": 1}
+        )
+
+        sleep(0.5)
+        status, entries = control(server, "")
+        assert [entry["name"] for entry in entries] == ["www.abc.com."]
+        assert upstream.synthesized == 2
+
+
+def test_purge():
+    with serve(MemoryStorage()) as (server, upstream):
+        cache = server.cache
+        names = (
+            "abc.com.", "www.abc.com.", "mail.abc.com.", "www.xabc.com.",
+            "xyz.com."
+        )
+        for name in names:
+            cache[(name, QTYPE.A, 1)] = []
+
+        # Names are matched ignoring case (and a trailing dot)
+        assert server.purge(name="WWW.abc.com") == [("www.abc.com.", 1, 1)]
+
+        # and suffixes on label boundaries (the name itself included)
+        assert sorted(server.purge(suffix="abc.com.")) == [
+            ("abc.com.", 1, 1), ("mail.abc.com.", 1, 1)
+        ]
+        assert sorted(cache.keys()) == [
+            ("www.xabc.com.", 1, 1), ("xyz.com.", 1, 1)
+        ]
+
+
+def test_udnsc_cache(tmpdir, capsys):
+    with controlled() as (server, upstream):
+        url = "http://{0:s}:{1:d}".format(
+            server.control.host, server.control.port
+        )
+
+        def udnsc(*args):
+            client.main(["cache", "--url", url, "--token", TOKEN] + list(args))
+            return capsys.readouterr().out
+
+        names = tmpdir.join("names.txt")
+        names.write("www.xyz.com\nwww.xyz.com AAAA\n")
+        assert udnsc("warm", str(names)).strip() == "Queued 2 queries"
+
+        sleep(0.5)
+        assert sorted(udnsc("dump").splitlines()) == [
+            "www.xyz.com. 60 IN A (default)",
+            "www.xyz.com. 60 IN AAAA (default)",
+        ]
+
+        assert udnsc("flush", "--suffix", "xyz.com").strip() == \
+            "Flushed 2 entries"
+        assert loads(udnsc("dump", "--json")) == []
+
+        with raises(SystemExit):
+            client.main(["cache", "--url", url, "--token", "wrong", "dump"])
+        assert capsys.readouterr().out.startswith("Error: 401")
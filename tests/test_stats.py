@@ -0,0 +1,36 @@
+"""Test Stats"""
+
+
+from udns.stats import Stats
+from udns.web import Metrics
+
+
+def test_counter():
+    stats = Stats()
+    counter = stats.counter("queries_total", "Total queries")
+    counter.inc()
+    counter.inc(2)
+
+    assert counter.value == 3
+    assert "udns_queries_total 3" in stats.render()
+
+
+def test_histogram():
+    stats = Stats()
+    histogram = stats.histogram("latency_seconds", "Latency", (0.1, 1.0))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5.0)
+
+    lines = stats.render().splitlines()
+
+    assert "udns_latency_seconds_bucket{le=\"0.1\"} 1" in lines
+    assert "udns_latency_seconds_bucket{le=\"1.0\"} 2" in lines
+    assert "udns_latency_seconds_bucket{le=\"+Inf\"} 3" in lines
+    assert "udns_latency_seconds_count 3" in lines
+
+
+def test_metrics_handlers():
+    # Only GET /metrics is served (no /metrics/init)
+    metrics = Metrics(Stats())
+    assert [f.__name__ for f in metrics.handlers()] == ["index"]
@@ -0,0 +1,77 @@
+"""Test Storage"""
+
+
+from io import StringIO
+
+
+from dnslib import QTYPE
+
+from udns.storage import MemoryStorage, SQLiteStorage
+
+
+ZONE = u"""$TTL 300
+$ORIGIN abc.com.
+@       IN A     127.0.0.1
+www     IN CNAME abc.com.
+"""
+
+
+def test_sqlite(tmpdir):
+    db = SQLiteStorage(str(tmpdir.join("udns.db")))
+
+    zone = db.create_zone("abc.com.")
+    db.load(zone, StringIO(ZONE))
+
+    zone = db.get_zone("abc.com.")
+    assert zone.ttl == 300
+    assert db.zones() == ["abc.com."]
+
+    db.add_record(zone, "mail", "127.0.0.2")
+
+    results = db.resolve(["www.abc.com.", "mail.abc.com.", "ftp.abc.com."])
+
+    assert [r.rtype for r in results["www.abc.com."]] == [
+        QTYPE.CNAME, QTYPE.A
+    ]
+    assert [r.rdata for r in results["mail.abc.com."]] == ["127.0.0.2"]
+    assert results["ftp.abc.com."] == []
+
+    db.delete_record(zone, "mail")
+    assert db.find_records(["mail.abc.com."]) == {"mail.abc.com.": []}
+
+    db.delete_zone(zone)
+    assert db.zones() == []
+    assert db.find_records(["abc.com."]) == {"abc.com.": []}
+
+
+def test_iter_records(tmpdir):
+    for db in (MemoryStorage(), SQLiteStorage(str(tmpdir.join("u.db")))):
+        zone = db.create_zone("abc.com.")
+        db.load(zone, StringIO(ZONE))
+        for i in range(5):
+            db.add_record(
+                zone, "host{0:d}".format(i), "127.0.1.{0:d}".format(i)
+            )
+
+        # Pages of any size yield the records in order
+        records = db.records(zone)
+        for size in (1, 2, 7, 1000):
+            assert list(db.iter_records(zone, size)) == list(records)
+
+        lines = list(db.iter_export(zone, 3))
+        assert lines[:3] == ["$TTL 300", "$ORIGIN abc.com", ""]
+        assert len(lines) == 3 + len(records)
+        assert "\n".join(lines) == db.export(zone)
+
+
+def test_soa_serial():
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+    db.add_record(zone, "@", "ns.abc.com. admin.abc.com. 1 3600 600 86400 60",
+                  rtype=QTYPE.SOA)
+    db.add_record(zone, "www", "127.0.0.2")
+
+    # The SOA records served carry the zone's (bumped) serial
+    soa, = db.resolve(["abc.com."])["abc.com."]
+    assert soa.rr.rdata.times[0] == zone.serial == 2
+    assert db.soa(zone).rdata.times[0] == 2
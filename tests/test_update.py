@@ -0,0 +1,86 @@
+"""Test Dynamic Updates"""
+
+
+from struct import pack
+
+
+from pytest import raises
+from dnslib import DNSError, DNSRecord, RCODE, RD, RR, A
+
+from udns import tsig
+from udns.update import apply, parse, ANY, NONE
+from udns.storage import MemoryStorage
+
+
+KEY = tsig.parse_key("hmac-sha256:update:c2VjcmV0c2VjcmV0")
+
+
+def test_update():
+    db = MemoryStorage()
+    zone = db.create_zone("abc.com.", ttl=300)
+
+    present = RR("www.abc.com.", 1, ANY, 0, RD())
+    absent = RR("www.abc.com.", 255, NONE, 0, RD())
+    add = RR("www.abc.com.", 1, 1, 60, A("127.0.0.1"))
+
+    assert apply(db, "abc.com.", [present], [add]) == (RCODE.NXRRSET, set())
+    assert apply(db, "xyz.com.", [], [add])[0] == RCODE.NOTAUTH
+
+    assert apply(db, "abc.com.", [absent], [add]) == (
+        RCODE.NOERROR, set(["www.abc.com."])
+    )
+    assert zone.serial == 1
+
+    # Replace the A RRset
+    delete = RR("www.abc.com.", 1, ANY, 0, RD())
+    add = RR("www.abc.com.", 1, 1, 60, A("127.0.0.2"))
+    assert apply(db, "abc.com.", [present], [delete, add])[0] == RCODE.NOERROR
+
+    records = db.resolve(["www.abc.com."])["www.abc.com."]
+    assert [r.rdata for r in records] == ["127.0.0.2"]
+    assert zone.serial == 2
+
+    outside = RR("www.xyz.com.", 1, 1, 60, A("127.0.0.3"))
+    assert apply(db, "abc.com.", [], [outside])[0] == RCODE.NOTZONE
+
+
+def test_parse():
+    request = DNSRecord.question("abc.com.", "SOA")
+    request.header.opcode = 5
+    request.add_answer(RR("www.abc.com.", 1, ANY, 0, RD()))
+    request.add_auth(RR("www.abc.com.", 255, ANY, 0, RD()))
+
+    record = parse(request.pack())
+
+    assert record.q.qname == "abc.com."
+    assert [rr.rclass for rr in record.rr] == [ANY]
+    assert [rr.rtype for rr in record.auth] == [255]
+
+    # Truncated messages fail to parse as any other malformed message
+    with raises(DNSError):
+        parse(request.pack()[:-3])
+
+
+def test_tsig():
+    request = DNSRecord.question("abc.com.", "SOA").pack()
+    data, signature = tsig.sign(request, KEY)
+
+    context = tsig.verify(data, {KEY.name: KEY})
+    assert context.error == 0
+
+    assert tsig.verify(request, {KEY.name: KEY}) is None
+    assert tsig.verify(data, {}).error == tsig.BADKEY
+
+    tampered = bytearray(data)
+    tampered[2] ^= 0x01
+    assert tsig.verify(bytes(tampered), {KEY.name: KEY}).error == tsig.BADSIG
+
+    assert tsig.verify(data, {KEY.name: KEY}, now=0).error == tsig.BADTIME
+
+    # The response MAC covers the request MAC
+    response = context.sign(DNSRecord.parse(request).reply().pack())
+    _, signed = tsig.split(response)
+    assert signed.mac == KEY.mac(
+        pack("!H", len(signature.mac)), signature.mac,
+        tsig.split(response)[0], signed.variables()
+    )
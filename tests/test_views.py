@@ -0,0 +1,48 @@
+"""Test Views"""
+
+
+from pytest import raises
+
+from udns.views import parse_network, Radix, View, Views
+
+
+def test_radix():
+    radix = Radix()
+    radix.insert("10.0.0.0/8", "ten")
+    radix.insert("10.1.0.0/16", "ten-one")
+    radix.insert("10.1.2.3", "host")
+    radix.insert("fd00::/8", "ula")
+
+    assert radix.lookup("10.9.9.9") == "ten"
+    assert radix.lookup("10.1.9.9") == "ten-one"
+    assert radix.lookup("10.1.2.3") == "host"
+    assert radix.lookup("::ffff:10.1.2.4") == "ten-one"
+    assert radix.lookup("fd12::1") == "ula"
+    assert radix.lookup("192.168.0.1") is None
+    assert radix.lookup("2001:db8::1", "default") == "default"
+
+    radix.insert("0.0.0.0/0", "any")
+    assert radix.lookup("192.168.0.1") == "any"
+
+
+def test_parse_network():
+    assert parse_network("10.1.2.3/8")[1:] == (10 << 24, 8)
+
+    with raises(ValueError):
+        parse_network("10.0.0.0/33")
+
+    with raises(ValueError):
+        parse_network("example.com")
+
+
+def test_views():
+    default = View("default", None, {}, {})
+    views = Views(default)
+
+    internal = View("internal", None, {}, {}, ["10.0.0.0/8"])
+    views.add(internal)
+
+    assert views.match("10.0.0.1") is internal
+    assert views.match("192.168.0.1") is default
+    assert views.match("not-an-address") is default
+    assert list(views) == [default, internal]
@@ -0,0 +1,48 @@
+"""Test DNS-over-HTTPS"""
+
+
+from dnslib import DNSRecord, RCODE
+
+from udns.web import DNSQuery, Exchange
+
+
+class Remote(object):
+    ip, port = "127.0.0.1", 40000
+
+
+class Request(object):
+    remote = Remote()
+
+
+class Response(object):
+
+    def __init__(self):
+        self.headers = {}
+        self.body = None
+
+
+def test_timeout():
+    query = DNSQuery(None, "server", timeout=0)
+
+    record = DNSRecord.question("www.abc.com")
+    answered = Exchange(Request(), Response(), query.channel)
+    dropped = Exchange(Request(), Response(), query.channel)
+
+    query.pending.append((0, answered, record))
+    query.pending.append((0, dropped, record))
+
+    reply = record.reply()
+    answered.reply(query, reply, reply.pack())
+
+    query.expire()
+    assert not query.pending
+
+    assert DNSRecord.parse(answered.response.body).header.rcode == 0
+    reply = DNSRecord.parse(dropped.response.body)
+    assert reply.header.id == record.header.id
+    assert reply.header.rcode == RCODE.SERVFAIL
+
+    # A reply coming after the timeout is not sent again
+    body = dropped.response.body
+    dropped.reply(query, record.reply(), record.reply().pack())
+    assert dropped.response.body is body
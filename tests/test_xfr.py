@@ -0,0 +1,63 @@
+"""Test Zone Transfers"""
+
+
+from dnslib import QTYPE
+
+from udns import xfr
+from udns.storage import MemoryStorage
+
+
+def test_records():
+    db = MemoryStorage()
+
+    zone = db.create_zone("abc.com.", ttl=300)
+    db.add_record(zone, "@", "127.0.0.1")
+    db.add_record(zone, "www", "127.0.0.2")
+
+    assert xfr.records(db, "xyz.com.") is None
+
+    rrs = xfr.records(db, "abc.com.")
+    assert [rr.rtype for rr in rrs] == [
+        QTYPE.SOA, QTYPE.A, QTYPE.A, QTYPE.SOA
+    ]
+    assert xfr.serial_of(rrs[0]) == 2
+
+    rrs = xfr.records(db, "abc.com.", 2)
+    assert len(rrs) == 1
+
+    db.delete_record(zone, "www")
+
+    rrs = xfr.records(db, "abc.com.", 2)
+    assert [xfr.serial_of(rr) for rr in rrs if rr.rtype == QTYPE.SOA] == [
+        3, 2, 3, 3
+    ]
+
+
+def test_apply():
+    primary = MemoryStorage()
+    secondary = MemoryStorage()
+
+    zone = primary.create_zone("abc.com.", ttl=300)
+    primary.add_record(zone, "www", "127.0.0.1")
+
+    rrs = xfr.records(primary, "abc.com.")
+    changed = xfr.apply(secondary, "abc.com.", ("axfr", rrs[0], rrs[1:-1]))
+
+    assert changed == set(["abc.com.", "www.abc.com."])
+    assert secondary.get_zone("abc.com.").serial == 1
+
+    primary.delete_record(zone, "www")
+    primary.add_record(zone, "mail", "127.0.0.2")
+
+    rrs = xfr.records(primary, "abc.com.", 1)
+    assert xfr._incremental(rrs)
+
+    result = ("ixfr", rrs[0], xfr._diffs(rrs))
+    changed = xfr.apply(secondary, "abc.com.", result)
+
+    assert changed == set(["abc.com.", "www.abc.com.", "mail.abc.com."])
+    assert secondary.get_zone("abc.com.").serial == 3
+    assert secondary.resolve(["www.abc.com."])["www.abc.com."] == []
+    assert [
+        r.rdata for r in secondary.resolve(["mail.abc.com."])["mail.abc.com."]
+    ] == ["127.0.0.2"]
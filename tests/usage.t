@@ -2,8 +2,20 @@ udnsd Usage:
 
   $ udnsd --help
   usage: udnsd [-h] [-v] [--debug] [--verbose] [--logfile FILE] [--pidfile FILE]
-               [--dbhost HOST] [--dbport PORT] [--cachesize SIZEe] [-b BIND]
-               [-d] [-f FORWARD]
+               [--storage {redis,sqlite}] [--dbfile FILE] [--dbhost HOST]
+               [--dbport PORT] [--dbworkers N] [--cachesize SIZEe]
+               [--cacheshards N] [--views FILE] [--policy FILE]
+               [--policy-reload SECONDS] [--minimal-responses] [--querylog FILE]
+               [--querylog-sample RATE] [--querylog-size SIZE] [--profile]
+               [--profile-output PREFIX] [--metrics BIND] [--control BIND]
+               [--control-token TOKEN] [--tls BIND] [--https BIND]
+               [--certfile FILE] [--keyfile FILE] [--secondary ZONE=HOST[:PORT]]
+               [--refresh SECONDS] [--notify HOST[:PORT]]
+               [--notify-interval SECONDS] [--tsig-key [ALG:]NAME:SECRET]
+               [--allow-transfer ADDRESS] [-b BIND] [-d] [-f FORWARD]
+               [--forwarders FILE] [--upstream-timeout SECONDS]
+               [--max-pending N] [--min-ttl SECONDS] [--max-ttl SECONDS]
+               [--ttl-jitter FRACTION]
   
   optional arguments:
     -h, --help            show this help message and exit
@@ -12,30 +24,111 @@ udnsd Usage:
     --verbose             enable verbose logging (default: False)
     --logfile FILE        write logs to FILE (default: /dev/stdout)
     --pidfile FILE        write process id to FILE (default: udns.pid)
+    --storage {redis,sqlite}
+                          storage backend to use for zones and records (default:
+                          redis)
+    --dbfile FILE         set database file to FILE (SQLite) (default: udns.db)
     --dbhost HOST         set database host to HOST (Redis) (default: localhost)
     --dbport PORT         set database port to PORT (Redis) (default: 6379)
+    --dbworkers N         perform database lookups on a pool of N threads
+                          (default: 4)
     --cachesize SIZEe     set cache size to SIZE (default: 1024)
+    --cacheshards N       partition the cache into N independently locked shards
+                          (default: 16)
+    --views FILE          serve split-horizon views (by client network) from
+                          FILE (JSON) (default: None)
+    --policy FILE         apply the response policy zone (RPZ) or list of names
+                          in FILE (default: [])
+    --policy-reload SECONDS
+                          check the response policy files for changes every
+                          SECONDS (default: 60)
+    --minimal-responses   only send answers (no glue in the additional section)
+                          (default: False)
+    --querylog FILE       write a structured (JSON lines) query log to FILE
+                          (default: None)
+    --querylog-sample RATE
+                          log only a RATE (0.0-1.0) fraction of queries
+                          (default: 1.0)
+    --querylog-size SIZE  buffer up to SIZE query log records before dropping
+                          (default: 65536)
+    --profile             enable per-stage tracing and stack sampling (dump on
+                          SIGUSR1) (default: False)
+    --profile-output PREFIX
+                          write profiles dumped on SIGUSR1 to
+                          PREFIX.{folded,stages} (default: udns-profile)
+    --metrics BIND        serve prometheus metrics over HTTP on BIND
+                          (address:port) (default: None)
+    --control BIND        serve the cache control API over HTTP on BIND
+                          (address:port) (default: None)
+    --control-token TOKEN
+                          bearer token required by the control API (or
+                          $UDNS_CONTROL_TOKEN) (default: None)
+    --tls BIND            serve DNS-over-TLS on BIND (address:port, e.g:
+                          0.0.0.0:853) (default: None)
+    --https BIND          serve DNS-over-HTTPS on BIND (address:port, e.g:
+                          0.0.0.0:443) (default: None)
+    --certfile FILE       TLS certificate (chain) for --tls and --https
+                          (default: None)
+    --keyfile FILE        TLS private key (if not included in --certfile)
+                          (default: None)
+    --secondary ZONE=HOST[:PORT]
+                          serve ZONE as a secondary transferred from HOST
+                          (default: [])
+    --refresh SECONDS     refresh secondary zones every SECONDS (besides on
+                          NOTIFY) (default: 3600)
+    --notify HOST[:PORT]  send NOTIFY to HOST when a zone's serial changes
+                          (default: [])
+    --notify-interval SECONDS
+                          check zone serials for changes every SECONDS (default:
+                          1)
+    --tsig-key [ALG:]NAME:SECRET
+                          accept dynamic updates signed with the (base64) SECRET
+                          of NAME (default: [])
+    --allow-transfer ADDRESS
+                          only allow zone transfers to ADDRESS (repeatable)
+                          (default: [])
     -b BIND, --bind BIND  Bind to address:[port] (default: 0.0.0.0:53)
     -d, --daemon          run as a background process (default: False)
     -f FORWARD, --forward FORWARD
-                          DNS server to forward to (default: 8.8.8.8)
+                          DNS servers to forward to (HOST[:PORT],...) (default:
+                          8.8.8.8)
+    --forwarders FILE     forward the names of zones to their own servers (JSON
+                          FILE) (default: None)
+    --upstream-timeout SECONDS
+                          retry forwarded queries on the next server after
+                          SECONDS (default: 2.0)
+    --max-pending N       answer SERVFAIL rather than forward with N queries
+                          pending (default: 10000)
+    --min-ttl SECONDS     cache forwarded answers for at least SECONDS (default:
+                          None)
+    --max-ttl SECONDS     cache forwarded answers for at most SECONDS (default:
+                          None)
+    --ttl-jitter FRACTION
+                          shorten the ttls of cached answers by up to FRACTION
+                          (e.g: 0.1) (default: 0.0)
 
 udnsc Usage:
 
   $ udnsc --help
-  usage: udnsc [-h] [-v] [--dbhost HOST] [--dbport PORT]
-               {create,add,delete,list,show,export,dbshell} ...
+  usage: udnsc [-h] [-v] [--storage {redis,sqlite}] [--dbfile FILE]
+               [--dbhost HOST] [--dbport PORT]
+               {create,add,delete,list,show,export,batch,cache,keygen,sign,dbshell}
+               ...
   
   optional arguments:
     -h, --help            show this help message and exit
     -v, --version         show program's version number and exit
+    --storage {redis,sqlite}
+                          storage backend to use for zones and records (default:
+                          redis)
+    --dbfile FILE         set database file to FILE (SQLite) (default: udns.db)
     --dbhost HOST         set database host to HOST (Redis) (default: localhost)
     --dbport PORT         set database port to PORT (Redis) (default: 6379)
   
   Commands:
     Available Commands
   
-    {create,add,delete,list,show,export,dbshell}
+    {create,add,delete,list,show,export,batch,cache,keygen,sign,dbshell}
                           Description
       create              Create a new Zone
       add                 Add a Zone or Record entry
@@ -43,4 +136,9 @@ udnsc Usage:
       list                List Zones
       show                Display records of a zone
       export              Export a Zone
+      batch               Apply a batch of add/delete/replace operations
+      cache               Inspect, flush or warm the cache of a running server
+      keygen              Generate a DNSSEC key for a Zone
+      sign                Sign a Zone (precompute its RRSIG, NSEC and DNSKEY
+                          records)
       dbshell             Interactive DB Shell
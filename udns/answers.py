@@ -0,0 +1,294 @@
+"""Answers
+
+Assembly of answers from the records of a name: records are selected by
+the type and class of the question (following CNAMEs) and the targets of
+MX, NS and SRV records get their addresses (glue) added to the additional
+section.
+
+Signed zones (see :mod:`udns.dnssec`) hold precomputed RRSIG and NSEC
+records: the RRSIGs of the selected records and, for names without data
+of the type, the NSEC record proving it are selected alongside and only
+sent to clients setting the DNSSEC OK (DO) bit (RFC 4035 3.1).
+
+Negative answers (NODATA, or NXDOMAIN for a CNAME to a missing name of a
+local zone) carry the SOA record of the zone (and its RRSIGs) in the
+authority section with the negative ttl (RFC 2308 3, RFC 4035 3.1.3).
+"""
+
+
+from dnslib import CLASS, EDNS0, QTYPE
+
+
+A = QTYPE.reverse["A"]
+AAAA = QTYPE.reverse["AAAA"]
+CNAME = QTYPE.reverse["CNAME"]
+SOA = QTYPE.reverse["SOA"]
+
+ANY = QTYPE.reverse["ANY"]
+OPT = QTYPE.reverse["OPT"]
+
+NSEC = QTYPE.reverse["NSEC"]
+RRSIG = QTYPE.reverse["RRSIG"]
+
+DNSSEC = (NSEC, RRSIG)
+
+# DNSSEC OK flag in the ttl of OPT records (RFC 3225)
+DO = 1 << 15
+
+# UDP payload size advertised in requests (and the most offered in
+# responses) to EDNS queries
+PAYLOAD = 4096
+
+# UDP payload size of queries without EDNS (RFC 1035 4.2.1)
+MINIMUM = 512
+
+# Types whose targets are looked up in a follow-up query (RFC 1034 3.6.2)
+GLUE = {
+    QTYPE.reverse["MX"]: lambda rdata: rdata.label,
+    QTYPE.reverse["NS"]: lambda rdata: rdata.label,
+    QTYPE.reverse["SRV"]: lambda rdata: rdata.target,
+}
+
+ADDRESSES = (A, AAAA)
+
+
+def wanted(rtype, rclass, qtype, qclass):
+    return (
+        (qtype in (ANY, rtype)) and
+        (qclass in (CLASS.reverse["*"], rclass))
+    )
+
+
+def covered(record):
+    """Return the type covered by the (stored) RRSIG ``record``"""
+
+    return QTYPE.reverse.get(record.rdata.split(None, 1)[0].upper())
+
+
+def select(records, qtype, qclass):
+    """Select the records answering a question for ``qtype`` and ``qclass``
+
+    ``records`` are those found for the name (as resolved by
+    :meth:`~udns.storage.Storage.resolve`: a CNAME followed by the records
+    of its target). An empty list means no data for the type.
+
+    The RRSIGs of the selected records are selected with them and if
+    there is no data of the type the NSEC records (and their RRSIGs) of
+    the name proving so.
+    """
+
+    selected = [
+        record for record in records
+        if (record.rtype == CNAME and qtype != CNAME) or
+        wanted(record.rtype, record.rclass, qtype, qclass)
+    ]
+
+    if qtype in (ANY,) + DNSSEC:
+        return selected
+
+    rrsets = set((record.rname, record.rtype) for record in selected)
+
+    if all(record.rtype == CNAME for record in selected):
+        # No data: the NSEC record of the (last) name denies the type
+        aliases = set(record.rname for record in selected)
+        proof = [
+            record for record in records
+            if record.rtype == NSEC and record.rname not in aliases
+        ]
+        selected.extend(proof)
+        rrsets.update((record.rname, NSEC) for record in proof)
+
+    selected.extend(
+        record for record in records
+        if record.rtype == RRSIG and
+        (record.rname, covered(record)) in rrsets
+    )
+
+    return selected
+
+
+def terminal(qname, records):
+    """Return the name the (resolved) ``records`` of ``qname`` end at
+
+    That is the target of its CNAME (if any) or else ``qname`` itself.
+    """
+
+    for record in records:
+        if record.rtype == CNAME and record.rname == qname:
+            return record.rdata
+    return qname
+
+
+def nodata(records, qtype, qclass):
+    """Return whether ``records`` hold no data for ``qtype`` and ``qclass``"""
+
+    return not any(
+        wanted(record.rtype, record.rclass, qtype, qclass)
+        for record in records
+    )
+
+
+def nxdomain(qname, records):
+    """Return whether ``qname`` is a CNAME to a name without records"""
+
+    name = terminal(qname, records)
+    return name != qname and not any(
+        record.rname == name for record in records
+    )
+
+
+def negated(rr):
+    """Return whether ``rr`` is part of the proof of a negative answer
+
+    That is a SOA or NSEC record (or an RRSIG of one) in the authority
+    section of a NODATA or NXDOMAIN response.
+    """
+
+    if rr.rtype == RRSIG:
+        return rr.rdata.covered in (SOA, NSEC)
+    return rr.rtype in (SOA, NSEC)
+
+
+def negative(rrs):
+    """Set the ttls of the SOA ``rrs`` (and RRSIGs) to the negative ttl
+
+    That is the lesser of the SOA's ttl and its minimum (RFC 2308 3).
+    """
+
+    soa = [rr for rr in rrs if rr.rtype == SOA]
+    if soa:
+        ttl = min(soa[0].ttl, soa[0].rdata.times[-1])
+        for rr in rrs:
+            rr.ttl = ttl
+
+    return rrs
+
+
+def dnssec_ok(request):
+    """Return whether ``request`` has the DNSSEC OK (DO) bit set"""
+
+    return any(rr.rtype == OPT and rr.ttl & DO for rr in request.ar)
+
+
+def payload(record):
+    """Return the UDP payload size of ``record``
+
+    That is the size offered in its OPT record (RFC 6891 6.2.3), up to
+    :data:`PAYLOAD`, or 512 bytes without one.
+    """
+
+    for rr in record.ar:
+        if rr.rtype == OPT:
+            return max(MINIMUM, min(rr.rclass, PAYLOAD))
+
+    return MINIMUM
+
+
+def edns(request):
+    """Return the OPT record of the response to ``request`` (if any)
+
+    It offers the payload size of the request (see :func:`payload`), the
+    size responses to it are limited to over UDP.
+    """
+
+    if not any(rr.rtype == OPT for rr in request.ar):
+        return []
+
+    flags = "do" if dnssec_ok(request) else ""
+    return [EDNS0(flags=flags, udp_len=payload(request))]
+
+
+def truncate(reply, size):
+    """Return ``reply`` packed in at most ``size`` bytes (for UDP)
+
+    The additional section (glue) is dropped first; if that is not
+    enough the answer and authority sections go too and the TC bit is
+    set for the client to retry over TCP (RFC 2181 9).
+    """
+
+    data = reply.pack()
+    if len(data) <= size:
+        return data
+
+    reply.ar = [rr for rr in reply.ar if rr.rtype == OPT]
+    data = reply.pack()
+    if len(data) <= size:
+        return data
+
+    reply.rr = []
+    reply.auth = []
+    reply.header.tc = 1
+
+    return reply.pack()
+
+
+def sections(rrs, qtype, dnssec=False, qname=None):
+    """Split the (cached) answer ``rrs`` into answer and authority records
+
+    The SOA of a negative answer and NSEC records (and their RRSIGs)
+    proving there is no data go to the authority section. Without
+    ``dnssec`` (DO not set) RRSIG and NSEC records are left out unless
+    they are what was asked for. ``qname`` tells the SOA of a negative
+    answer from the one answering a SOA question.
+    """
+
+    if qtype == ANY:
+        return list(rrs), []
+
+    name = qname
+    for rr in rrs:
+        if rr.rtype == CNAME and rr.rname == name:
+            name = rr.rdata.label
+
+    def covers(rr, rtype):
+        return rr.rtype == rtype or (
+            rr.rtype == RRSIG and rr.rdata.covered == rtype
+        )
+
+    def soa(rr):
+        return covers(rr, SOA) and (
+            qtype != SOA or (name is not None and rr.rname != name)
+        )
+
+    auth = [rr for rr in rrs if soa(rr)]
+    rrs = [rr for rr in rrs if not soa(rr)]
+
+    if qtype in DNSSEC:
+        return rrs, auth
+
+    if not dnssec:
+        return (
+            [rr for rr in rrs if rr.rtype not in DNSSEC],
+            [rr for rr in auth if rr.rtype not in DNSSEC]
+        )
+
+    return (
+        [rr for rr in rrs if not covers(rr, NSEC)],
+        auth + [rr for rr in rrs if covers(rr, NSEC)]
+    )
+
+
+def targets(rrs):
+    """Return the names (in order) whose addresses complete ``rrs``"""
+
+    answered = set(str(rr.rname) for rr in rrs if rr.rtype in ADDRESSES)
+
+    names = []
+    for rr in rrs:
+        if rr.rtype in GLUE:
+            name = str(GLUE[rr.rtype](rr.rdata))
+            if name not in answered and name not in names:
+                names.append(name)
+    return names
+
+
+def glue(names, records):
+    """Return the address records of ``names`` in ``records``
+
+    ``records`` maps names to lists of records (with an ``rr`` property).
+    """
+
+    return [
+        record.rr for name in names for record in records.get(name, ())
+        if record.rtype in ADDRESSES
+    ]
@@ -0,0 +1,330 @@
+"""Batch Updates
+
+Streams of add, delete and replace operations in JSON lines or in (a
+subset of) the nsupdate(1) syntax, applied to a storage backend in
+transactions: each zone touched by a transaction is changed once (under
+a single new serial) no matter how many operations it contains.
+
+JSON lines look like::
+
+    {"op": "add", "name": "www.abc.com.", "type": "A", "data": "1.2.3.4"}
+    {"op": "replace", "zone": "abc.com.", "name": "www", "data": "1.2.3.5"}
+    {"op": "delete", "name": "ftp.abc.com.", "type": "A"}
+
+and are applied in transactions of up to ``size`` operations. nsupdate
+input is applied in the transactions delimited by its ``send`` commands.
+"""
+
+
+from json import loads
+from collections import namedtuple
+
+
+from dnslib import DNSError, CLASS, QTYPE
+
+
+from .storage import matches, to_rr, Entry
+
+
+ACTIONS = ("add", "delete", "replace")
+
+
+Operation = namedtuple(
+    "Operation",
+    ("lineno", "action", "zone", "rname", "rdata", "rclass", "rtype", "ttl")
+)
+
+Result = namedtuple("Result", ("lineno", "operation", "error"))
+
+
+# Marks the end of a transaction in a stream of operations
+SEND = None
+
+
+class BatchError(Exception):
+    """Raised for operations that cannot be parsed or applied"""
+
+
+def absolute(name):
+    return name if name.endswith(".") else "{0:s}.".format(name)
+
+
+def parse_type(rtype, default=None):
+    if rtype is None:
+        return default
+
+    try:
+        return getattr(QTYPE, rtype.upper())
+    except AttributeError:
+        raise BatchError("Unknown type {0:s}".format(rtype))
+
+
+def parse_class(rclass):
+    try:
+        return getattr(CLASS, rclass.upper())
+    except AttributeError:
+        raise BatchError("Unknown class {0:s}".format(rclass))
+
+
+def parse_json(f):
+    """Parse JSON lines from ``f`` yielding ``(lineno, operation)`` tuples
+
+    Operations that cannot be parsed are yielded as :class:`BatchError`.
+    """
+
+    for lineno, line in enumerate(f, 1):
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        try:
+            data = loads(line)
+
+            if not isinstance(data, dict):
+                raise BatchError("Expected an object")
+
+            action = data.get("op")
+            if action not in ACTIONS:
+                raise BatchError("Unknown op {0!r}".format(action))
+
+            if "name" not in data:
+                raise BatchError("Missing name")
+
+            if action != "delete" and "data" not in data:
+                raise BatchError("Missing data")
+
+            yield lineno, Operation(
+                lineno, action, data.get("zone"), data["name"],
+                data.get("data"), parse_class(data.get("class", "IN")),
+                parse_type(
+                    data.get("type"), None if action == "delete" else QTYPE.A
+                ),
+                data.get("ttl")
+            )
+        except (BatchError, ValueError) as error:
+            yield lineno, BatchError(str(error))
+
+
+# nsupdate commands that have no meaning here and are ignored
+IGNORED = ("server", "local", "key", "gsstsig", "oldgsstsig", "realm",
+           "debug", "show", "answer", "quit")
+
+
+def parse_nsupdate(f):
+    """Parse nsupdate(1) commands from ``f``
+
+    Supports ``zone``, ``origin``, ``ttl``, ``class``, ``[update] add``,
+    ``[update] del[ete]`` and ``send``; prerequisites are not supported.
+    Yields ``(lineno, operation)`` tuples with :data:`SEND` delimiting
+    transactions.
+    """
+
+    zone, origin, ttl, rclass = None, None, None, CLASS.IN
+
+    for lineno, line in enumerate(f, 1):
+        tokens = line.split(";", 1)[0].split()
+        if not tokens:
+            continue
+
+        command, args = tokens[0].lower(), tokens[1:]
+
+        try:
+            if command == "update":
+                if not args:
+                    raise BatchError("Missing update command")
+                command, args = args[0].lower(), args[1:]
+
+            if command == "send":
+                yield lineno, SEND
+            elif command in IGNORED:
+                continue
+            elif command == "zone":
+                zone = absolute(args[0])
+            elif command == "origin":
+                origin = absolute(args[0])
+            elif command == "ttl":
+                ttl = int(args[0])
+            elif command == "class":
+                rclass = parse_class(args[0])
+            elif command in ("add", "del", "delete"):
+                yield lineno, _parse_update(
+                    lineno, "add" if command == "add" else "delete",
+                    args, zone, origin, ttl, rclass
+                )
+            else:
+                raise BatchError("Unsupported command {0:s}".format(command))
+        except IndexError:
+            yield lineno, BatchError("Missing arguments to {0:s}".format(
+                command
+            ))
+        except (BatchError, ValueError) as error:
+            yield lineno, BatchError(str(error))
+
+    yield None, SEND
+
+
+def _parse_update(lineno, action, args, zone, origin, ttl, rclass):
+    # NAME [TTL] [CLASS] [TYPE [RDATA...]]
+    args = list(args)
+
+    rname = args.pop(0)
+    if not rname.endswith(".") and origin is not None:
+        rname = "{0:s}.{1:s}".format(rname, origin)
+    rname = absolute(rname)
+
+    if args and args[0].isdigit():
+        ttl = int(args.pop(0))
+
+    if args and args[0].upper() in CLASS.reverse:
+        rclass = parse_class(args.pop(0))
+
+    rtype = parse_type(args.pop(0)) if args else None
+    rdata = " ".join(args) or None
+
+    if action == "add" and (rtype is None or rdata is None):
+        raise BatchError("add requires a type and data")
+
+    return Operation(lineno, action, zone, rname, rdata, rclass, rtype, ttl)
+
+
+def transactions(items, size=1000):
+    """Group a stream of parsed operations into transactions
+
+    Yields lists of ``(lineno, operation)`` tuples ending at each
+    :data:`SEND` and after at most ``size`` operations.
+    """
+
+    pending = []
+
+    for lineno, item in items:
+        if item is SEND:
+            if pending:
+                yield pending
+            pending = []
+            continue
+
+        pending.append((lineno, item))
+
+        if len(pending) >= size:
+            yield pending
+            pending = []
+
+    if pending:
+        yield pending
+
+
+def find_zone(zones, rname):
+    """Return the longest of ``zones`` ``rname`` belongs to (or ``None``)"""
+
+    labels = rname.rstrip(".").split(".")
+    for i in range(len(labels)):
+        name = "{0:s}.".format(".".join(labels[i:]))
+        if name in zones:
+            return name
+
+
+def resolve(zones, operation):
+    """Return the zone and fully qualified name an operation applies to"""
+
+    if operation.zone is not None:
+        zone = absolute(operation.zone)
+        rname = operation.rname
+        if rname == "@":
+            rname = zone
+        elif not rname.endswith("."):
+            rname = "{0:s}.{1:s}".format(rname, zone)
+    else:
+        rname = absolute(operation.rname)
+        zone = find_zone(zones, rname)
+
+    if zone is None or zone not in zones:
+        raise BatchError("No zone found for {0:s}".format(rname))
+
+    if rname != zone and not rname.endswith(".{0:s}".format(zone)):
+        raise BatchError("{0:s} is not in zone {1:s}".format(rname, zone))
+
+    return zone, rname
+
+
+def prepare(zones, operation):
+    """Validate ``operation`` returning its zone, deletes and adds"""
+
+    zone, rname = resolve(zones, operation)
+
+    deletes, adds = [], []
+
+    if operation.action in ("delete", "replace"):
+        deletes.append((rname, operation.rtype, operation.rdata
+                        if operation.action == "delete" else None))
+
+    if operation.action in ("add", "replace"):
+        entry = Entry(
+            rname, operation.rdata, operation.rclass, operation.rtype,
+            operation.ttl
+        )
+
+        try:
+            to_rr(*entry._replace(ttl=0))
+        except (DNSError, IndexError, ValueError) as error:
+            raise BatchError("Invalid data {0!r}: {1:s}".format(
+                operation.rdata, str(error)
+            ))
+
+        adds.append(entry)
+
+    return zone, deletes, adds
+
+
+def apply(db, items, size=1000):
+    """Apply a stream of parsed operations to ``db``
+
+    Yields a :class:`Result` per operation, in order, once the transaction
+    it belongs to has been applied.
+    """
+
+    zones = set(db.zones())
+
+    for transaction in transactions(items, size):
+        results = []
+        changes = {}
+
+        for lineno, operation in transaction:
+            if isinstance(operation, BatchError):
+                results.append(Result(lineno, None, operation))
+                continue
+
+            try:
+                zone, deletes, adds = prepare(zones, operation)
+            except BatchError as error:
+                results.append(Result(lineno, operation, error))
+                continue
+
+            change = changes.setdefault(zone, ([], [], []))
+            change[0].extend(deletes)
+            # Deletes are applied first; so cancel matching earlier adds
+            change[1][:] = [
+                entry for entry in change[1]
+                if not any(matches(entry, *delete) for delete in deletes)
+            ]
+            change[1].extend(adds)
+            change[2].append(len(results))
+
+            results.append(Result(lineno, operation, None))
+
+        for name, (deletes, adds, indices) in sorted(changes.items()):
+            try:
+                zone = db.get_zone(name)
+                adds = [
+                    entry if entry.ttl is not None
+                    else entry._replace(ttl=zone.ttl)
+                    for entry in adds
+                ]
+                db.update(zone, deletes, adds)
+            except Exception as error:
+                for i in indices:
+                    results[i] = results[i]._replace(
+                        error=BatchError(str(error))
+                    )
+
+        for result in results:
+            yield result
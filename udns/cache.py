@@ -0,0 +1,150 @@
+"""Cache
+
+An LRU cache of answers partitioned into shards by the hash of their key
+``(qname, qtype, qclass)``. Each shard is a separate LRU with its own lock
+so that lookups from several threads only contend when they hit the same
+shard; there is no global lock. Entries remember when they were stored
+so that their age can be reported; the ttls of their records are counted
+down in place (see :meth:`Cache.expire`).
+"""
+
+
+from threading import Lock
+
+
+from cachetools import LRUCache
+
+
+from .stats import clock
+
+
+# Marks missing entries
+MISSING = object()
+
+
+class Shard(object):
+
+    def __init__(self, maxsize):
+        self.lock = Lock()
+        self.entries = LRUCache(maxsize=maxsize)
+
+
+class Cache(object):
+    """Sharded LRU cache of (at most) ``maxsize`` entries"""
+
+    def __init__(self, maxsize, shards=16):
+        shards = max(1, min(shards, maxsize))
+
+        # Every shard holds an equal share of the entries
+        size = -(-maxsize // shards)
+
+        self.maxsize = maxsize
+        self.shards = tuple(Shard(size) for _ in range(shards))
+
+    def shard(self, key):
+        return self.shards[hash(key) % len(self.shards)]
+
+    def __len__(self):
+        return sum(len(shard.entries) for shard in self.shards)
+
+    def __contains__(self, key):
+        shard = self.shard(key)
+        with shard.lock:
+            return key in shard.entries
+
+    def __getitem__(self, key):
+        shard = self.shard(key)
+        with shard.lock:
+            return shard.entries[key][1]
+
+    def __setitem__(self, key, value):
+        shard = self.shard(key)
+        with shard.lock:
+            shard.entries[key] = (clock(), value)
+
+    def __delitem__(self, key):
+        shard = self.shard(key)
+        with shard.lock:
+            del shard.entries[key]
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        shard = self.shard(key)
+        with shard.lock:
+            entry = shard.entries.get(key, MISSING)
+        return default if entry is MISSING else entry[1]
+
+    def pop(self, key, default=None):
+        shard = self.shard(key)
+        with shard.lock:
+            entry = shard.entries.pop(key, MISSING)
+        return default if entry is MISSING else entry[1]
+
+    def keys(self):
+        return [key for key, value, age in self.dump()]
+
+    def items(self):
+        return [(key, value) for key, value, age in self.dump()]
+
+    def dump(self):
+        """Return a snapshot of all entries as ``(key, value, age)``
+
+        The snapshot is taken shard by shard; ``age`` is the number of
+        seconds since the entry was stored.
+        """
+
+        now = clock()
+
+        entries = []
+        for shard in self.shards:
+            with shard.lock:
+                entries.extend(
+                    (key, value, now - stored)
+                    for key, (stored, value) in shard.entries.items()
+                )
+        return entries
+
+    def clear(self):
+        for shard in self.shards:
+            with shard.lock:
+                shard.entries.clear()
+
+    def evict(self, predicate):
+        """Remove the entries for which ``predicate(key, value)`` is true
+
+        Returns the removed keys.
+        """
+
+        removed = []
+
+        for shard in self.shards:
+            with shard.lock:
+                keys = [
+                    key for key, (stored, value) in shard.entries.items()
+                    if predicate(key, value)
+                ]
+                for key in keys:
+                    del shard.entries[key]
+            removed.extend(keys)
+
+        return removed
+
+    def expire(self, seconds=1):
+        """Count down the ttls of all records by ``seconds``
+
+        Entries with a record whose ttl ran out are removed and their
+        keys returned.
+        """
+
+        def expired(key, rrs):
+            if any(rr.ttl < seconds for rr in rrs):
+                return True
+
+            for rr in rrs:
+                rr.ttl -= seconds
+
+            return False
+
+        return self.evict(expired)
@@ -3,96 +3,282 @@
 # Author:   James Mills, prologic at shortcircuit dot net dot au
 
 
-"""Client"""
+"""Client
+
+Modules are imported by the commands needing them (and the database is
+only set up for commands using it) so that scripts running many quick
+commands do not pay for the start up of every command.
+"""
 
 
 from __future__ import print_function
 
 
+import sys
 from os import environ
-from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType
-from code import InteractiveConsole
-
-
-from dnslib import CLASS, QTYPE
+from time import time
+from json import dumps, loads
+from itertools import chain
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+from argparse import ArgumentTypeError, FileType
 
-from redisco import connection_setup
 
-
-from .models import Zone
 from . import __version__
 
 
-def create(args):
-    zone = Zone.objects.filter(name=args.zone).first()
+def create(args, db):
+    zone = db.get_zone(args.zone)
 
     if zone:
         print("Zone {0:s} already exists!".format(args.zone))
         raise SystemExit(1)
 
-    zone = Zone(name=args.zone, ttl=args.ttl)
-    zone.save()
+    zone = db.create_zone(args.zone, ttl=args.ttl)
 
     if args.file is not None:
-        zone.load(args.file)
+        db.load(zone, args.file)
 
 
-def add(args):
-    zone = Zone.objects.filter(name=args.zone).first()
+def add(args, db):
+    zone = db.get_zone(args.zone)
 
     if not zone:
         print("Zone {0:s} not found!".format(args.zone))
         raise SystemExit(1)
 
     if args.rname and args.rdata:
-        zone.add_record(
-            args.rname, args.rdata, ttl=args.ttl,
-            rclass=getattr(CLASS, args.rclass),
-            rtype=getattr(QTYPE, args.rtype)
+        db.add_record(
+            zone, args.rname, args.rdata, ttl=args.ttl,
+            rclass=args.rclass, rtype=args.rtype
         )
     else:
         print("Must specify both a name and data!")
         raise SystemExit(1)
 
 
-def delete(args):
-    zone = Zone.objects.filter(name=args.zone).first()
+def delete(args, db):
+    zone = db.get_zone(args.zone)
 
     if not zone:
         print("Zone {0:s} not found!".format(args.zone))
         raise SystemExit(1)
 
     if args.rname:
-        zone.delete_record(args.rname)
+        db.delete_record(zone, args.rname)
     else:
-        zone.delete()
+        db.delete_zone(zone)
+
+
+def list(args, db):
+    print("\n".join(db.zones()))
+
+
+def write(lines, compress=False):
+    """Write ``lines`` to stdout as they come (gzip compressed)"""
+
+    if not compress:
+        for line in lines:
+            print(line)
+        return
 
+    from gzip import GzipFile
 
-def list(args):
-    print("\n".join(zone.name for zone in Zone.objects.all()))
+    stream = getattr(sys.stdout, "buffer", sys.stdout)
+    with GzipFile(filename="", mode="wb", fileobj=stream) as f:
+        for line in lines:
+            f.write((line + "\n").encode("utf-8"))
 
 
-def show(args):
-    zone = Zone.objects.filter(name=args.zone).first()
+def show(args, db):
+    zone = db.get_zone(args.zone)
 
     if not zone:
         print("Zone {0:s} not found!".format(args.zone))
         raise SystemExit(1)
 
-    print("\n".join(record.rr.toZone() for record in zone.records))
+    write(
+        record.rr.toZone()
+        for record in db.iter_records(zone, args.page_size)
+    )
+
+
+def export(args, db):
+    zone = db.get_zone(args.zone)
+
+    if not zone:
+        print("Zone {0:s} not found!".format(args.zone))
+        raise SystemExit(1)
+
+    write(db.iter_export(zone, args.page_size), args.gzip)
+
+
+def batch(args, db):
+    from .batch import apply, parse_json, parse_nsupdate
+
+    lines = iter(args.file)
+
+    fmt = args.format
+    if fmt == "auto":
+        first = []
+        for line in lines:
+            first.append(line)
+            if line.strip():
+                break
+        json = "".join(first).lstrip().startswith("{")
+        fmt = "json" if json else "nsupdate"
+        lines = chain(first, lines)
+
+    parse = parse_json if fmt == "json" else parse_nsupdate
+
+    errors = 0
+
+    for lineno, operation, error in apply(db, parse(lines), args.size):
+        if error is not None:
+            errors += 1
+
+        if fmt == "json":
+            result = {"line": lineno, "status": "ok"}
+            if error is not None:
+                result.update(status="error", error=str(error))
+            print(dumps(result, sort_keys=True))
+        elif error is None:
+            print("{0:d}: ok".format(lineno))
+        else:
+            print("{0:d}: error: {1:s}".format(lineno, str(error)))
+
+    if errors:
+        raise SystemExit(1)
+
+
+def keygen(args, db):
+    from .dnssec import generate_key, save_key, ALGORITHMS, SEP, ZONE
+
+    algorithms = dict((v[0], k) for k, v in ALGORITHMS.items())
+
+    key = generate_key(
+        args.bits, algorithms[args.algorithm],
+        ZONE | SEP if args.ksk else ZONE
+    )
 
+    print(save_key(key, args.zone, args.directory))
 
-def export(args):
-    zone = Zone.objects.filter(name=args.zone).first()
+
+def sign(args, db):
+    from dnslib import QTYPE
+
+    from .xfr import with_serial
+    from .storage import next_serial, Entry
+    from .dnssec import load_key, sign_zone, TYPES
+
+    zone = db.get_zone(args.zone)
 
     if not zone:
         print("Zone {0:s} not found!".format(args.zone))
         raise SystemExit(1)
 
-    print(zone.export())
+    keys = [load_key(filename) for filename in args.keys]
+
+    # The signed SOA carries the serial the zone will have once updated
+    soa = with_serial(db.soa(zone), next_serial(zone.serial))
 
+    records = [
+        record for record in db.records(zone)
+        if record.rtype not in TYPES and record.rtype != QTYPE.SOA
+    ]
+    rrs = [soa] + [record.rr for record in records]
+
+    # Allow for clocks of validators running behind by up to an hour
+    inception = int(time()) - 3600
+    expiration = inception + args.validity * 86400
+
+    try:
+        signed = sign_zone(zone.name, rrs, keys, inception, expiration)
+    except ValueError as error:
+        print("Cannot sign {0:s}: {1:s}".format(zone.name, str(error)))
+        raise SystemExit(1)
+
+    deletes = set(
+        (record.rname, record.rtype, None)
+        for record in db.records(zone)
+        if record.rtype in TYPES or record.rtype == QTYPE.SOA
+    )
+    adds = [Entry.from_rr(rr) for rr in [soa] + signed]
+
+    db.update(zone, deletes, adds)
+
+    print("Signed {0:s} with {1:d} keys ({2:d} records)".format(
+        zone.name, len(keys), len(signed)
+    ))
+
+
+def control(args, path, data=None, **params):
+    """Make a request to the control API of a running udnsd"""
+
+    try:
+        from urllib.parse import urlencode
+        from urllib.error import HTTPError, URLError
+        from urllib.request import Request, urlopen
+    except ImportError:  # pragma: no cover
+        from urllib import urlencode  # noqa
+        from urllib2 import HTTPError, Request, URLError, urlopen  # noqa
+
+    token = args.token or environ.get("UDNS_CONTROL_TOKEN")
+    if not token:
+        print("Must specify a control token!")
+        raise SystemExit(1)
+
+    url = "{0:s}/cache{1:s}".format(args.url.rstrip("/"), path)
+    params = dict((k, v) for k, v in params.items() if v is not None)
+    if params:
+        url = "{0:s}?{1:s}".format(url, urlencode(params))
+
+    request = Request(url, data=data)
+    request.add_header("Authorization", "Bearer {0:s}".format(token))
+    if data is not None:
+        request.add_header("Content-Type", "text/plain")
+
+    try:
+        return loads(urlopen(request).read().decode("utf-8"))
+    except HTTPError as error:
+        print("Error: {0:d} {1:s}".format(error.code, str(error.reason)))
+    except URLError as error:
+        print("Error: {0:s}".format(str(error.reason)))
+
+    raise SystemExit(1)
+
+
+def cache_dump(args, db):
+    entries = control(args, "")
+
+    if args.json:
+        print(dumps(entries, indent=2, sort_keys=True))
+        return
+
+    for entry in entries:
+        print("{0:s} {1:d} {2:s} {3:s} ({4:s})".format(
+            entry["name"], entry["ttl"], entry["class"], entry["type"],
+            entry["view"]
+        ))
+
+
+def cache_flush(args, db):
+    if args.suffix:
+        result = control(args, "/flush", b"", suffix=args.name)
+    else:
+        result = control(args, "/flush", b"", name=args.name)
+
+    print("Flushed {0:d} entries".format(result["flushed"]))
+
+
+def cache_warm(args, db):
+    result = control(args, "/warm", args.file.read().encode("utf-8"))
+
+    print("Queued {0:d} queries".format(result["queued"]))
+
+
+def dbshell(args, db):
+    from code import InteractiveConsole
 
-def dbshell(args):
     vars = {}
     vars.update(globals())
     vars.update(locals())
@@ -100,17 +286,50 @@ def dbshell(args):
     console.interact()
 
 
+def rclass(value):
+    from dnslib import CLASS
+
+    if value not in CLASS.reverse:
+        raise ArgumentTypeError("invalid class: {0:s}".format(value))
+    return CLASS.reverse[value]
+
+
+def rtype(value):
+    from dnslib import QTYPE
+
+    if value not in QTYPE.reverse:
+        raise ArgumentTypeError("invalid type: {0:s}".format(value))
+    return QTYPE.reverse[value]
+
+
 def setup_database(args):
-    dbhost = args.dbhost
-    dbport = args.dbport
+    if args.storage == "sqlite":
+        from .storage import SQLiteStorage
+        return SQLiteStorage(args.dbfile)
 
-    connection_setup(host=dbhost, port=dbport)
+    from .storage import RedisStorage
+    return RedisStorage(args.dbhost, args.dbport)
 
 
-def parse_args():
+def parse_args(args=None):
     parser = ArgumentParser(
         formatter_class=ArgumentDefaultsHelpFormatter,
-        version=__version__,
+    )
+
+    parser.add_argument(
+        "-v", "--version", action="version", version=__version__
+    )
+
+    parser.add_argument(
+        "--storage", action="store", default="redis",
+        dest="storage", choices=("redis", "sqlite"),
+        help="storage backend to use for zones and records"
+    )
+
+    parser.add_argument(
+        "--dbfile", action="store", default="udns.db",
+        dest="dbfile", metavar="FILE", type=str,
+        help="set database file to FILE (SQLite)"
     )
 
     parser.add_argument(
@@ -165,14 +384,14 @@ def parse_args():
     add_parser.set_defaults(func=add)
 
     add_parser.add_argument(
-        "--class", default="IN", metavar="RCLASS", type=str,
-        dest="rclass", choices=CLASS.reverse.keys(),
+        "--class", default="IN", metavar="RCLASS", type=rclass,
+        dest="rclass",
         help="Resource class to add"
     )
 
     add_parser.add_argument(
-        "--type", default="A", metavar="RTYPE", type=str,
-        dest="rtype", choices=QTYPE.reverse.keys(),
+        "--type", default="A", metavar="RTYPE", type=rtype,
+        dest="rtype",
         help="Resource type to add"
     )
 
@@ -227,6 +446,12 @@ def parse_args():
     )
     show_parser.set_defaults(func=show)
 
+    show_parser.add_argument(
+        "--page-size", action="store", type=int,
+        default=1000, dest="page_size", metavar="N",
+        help="Number of records fetched at a time"
+    )
+
     show_parser.add_argument(
         "zone", metavar="ZONE", type=str,
         help="Zone to display"
@@ -239,11 +464,161 @@ def parse_args():
     )
     export_parser.set_defaults(func=export)
 
+    export_parser.add_argument(
+        "--gzip", action="store_true", default=False,
+        help="Compress the output with gzip"
+    )
+
+    export_parser.add_argument(
+        "--page-size", action="store", type=int,
+        default=1000, dest="page_size", metavar="N",
+        help="Number of records fetched at a time"
+    )
+
     export_parser.add_argument(
         "zone", metavar="ZONE", type=str,
         help="Zone to export"
     )
 
+    # batch
+    batch_parser = subparsers.add_parser(
+        "batch",
+        help="Apply a batch of add/delete/replace operations"
+    )
+    batch_parser.set_defaults(func=batch)
+
+    batch_parser.add_argument(
+        "--format", default="auto", metavar="FORMAT", type=str,
+        dest="format", choices=("auto", "json", "nsupdate"),
+        help="Input format (json lines or nsupdate syntax)"
+    )
+
+    batch_parser.add_argument(
+        "--size", default=1000, metavar="SIZE", type=int,
+        help="Maximum number of operations per transaction (json)"
+    )
+
+    batch_parser.add_argument(
+        "file", metavar="FILE", default="-", nargs="?", type=FileType("r"),
+        help="File to read operations from (default: stdin)"
+    )
+
+    # cache
+    cache_parser = subparsers.add_parser(
+        "cache",
+        help="Inspect, flush or warm the cache of a running server"
+    )
+
+    cache_parser.add_argument(
+        "--url", metavar="URL", type=str,
+        default=environ.get("UDNS_CONTROL_URL", "http://127.0.0.1:8053"),
+        help="URL of the server's control API (--control)"
+    )
+
+    cache_parser.add_argument(
+        "--token", default=None, metavar="TOKEN", type=str,
+        help="Control API token (default: $UDNS_CONTROL_TOKEN)"
+    )
+
+    cache_subparsers = cache_parser.add_subparsers(
+        title="Cache Commands",
+        description="Available Cache Commands",
+        help="Description"
+    )
+
+    cache_dump_parser = cache_subparsers.add_parser(
+        "dump",
+        help="List cached answers with their remaining ttls"
+    )
+    cache_dump_parser.set_defaults(func=cache_dump, database=False)
+
+    cache_dump_parser.add_argument(
+        "--json", action="store_true", default=False,
+        help="Output the entries (with their answers) as JSON"
+    )
+
+    cache_flush_parser = cache_subparsers.add_parser(
+        "flush",
+        help="Remove the cached answers of a name"
+    )
+    cache_flush_parser.set_defaults(func=cache_flush, database=False)
+
+    cache_flush_parser.add_argument(
+        "--suffix", action="store_true", default=False,
+        help="Remove the answers of all names under NAME"
+    )
+
+    cache_flush_parser.add_argument(
+        "name", metavar="NAME", type=str,
+        help="Name to remove answers of"
+    )
+
+    cache_warm_parser = cache_subparsers.add_parser(
+        "warm",
+        help="Load the answers of a list of names into the cache"
+    )
+    cache_warm_parser.set_defaults(func=cache_warm, database=False)
+
+    cache_warm_parser.add_argument(
+        "file", metavar="FILE", default="-", nargs="?", type=FileType("r"),
+        help="File of names (one NAME [TYPE] per line, default: stdin)"
+    )
+
+    # keygen
+    keygen_parser = subparsers.add_parser(
+        "keygen",
+        help="Generate a DNSSEC key for a Zone"
+    )
+    keygen_parser.set_defaults(func=keygen, database=False)
+
+    keygen_parser.add_argument(
+        "--ksk", action="store_true", default=False,
+        help="Generate a key signing key (SEP flag set)"
+    )
+
+    keygen_parser.add_argument(
+        "--algorithm", default="RSASHA256", metavar="ALGORITHM", type=str,
+        choices=("RSASHA256", "RSASHA512"),
+        help="Signing algorithm"
+    )
+
+    keygen_parser.add_argument(
+        "--bits", default=2048, metavar="BITS", type=int,
+        help="Key size in bits"
+    )
+
+    keygen_parser.add_argument(
+        "--directory", default=".", metavar="DIR", type=str,
+        help="Directory to write the key files to"
+    )
+
+    keygen_parser.add_argument(
+        "zone", metavar="ZONE", type=str,
+        help="Zone the key is for"
+    )
+
+    # sign
+    sign_parser = subparsers.add_parser(
+        "sign",
+        help="Sign a Zone (precompute its RRSIG, NSEC and DNSKEY records)"
+    )
+    sign_parser.set_defaults(func=sign)
+
+    sign_parser.add_argument(
+        "--validity", default=30, metavar="DAYS", type=int,
+        help="Number of days the signatures are valid for"
+    )
+
+    sign_parser.add_argument(
+        "zone", metavar="ZONE", type=str,
+        help="Zone to sign"
+    )
+
+    sign_parser.add_argument(
+        "keys", metavar="KEY", nargs="+", type=str,
+        help="Key files (K<zone>+<alg>+<tag>.private) to sign with"
+    )
+
     # dbshell
     dbshell_parser = subparsers.add_parser(
         "dbshell",
@@ -251,13 +626,13 @@ def parse_args():
     )
     dbshell_parser.set_defaults(func=dbshell)
 
-    return parser.parse_args()
+    return parser.parse_args(args)
 
 
-def main():
-    args = parse_args()
-    setup_database(args)
-    args.func(args)
+def main(args=None):
+    args = parse_args(args)
+    db = setup_database(args) if getattr(args, "database", True) else None
+    args.func(args, db)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,341 @@
+"""DNSSEC
+
+Offline signing of zones (RFC 4033, 4034, 4035): the RRSIG records of
+every RRset, the zone's DNSKEY RRset and its NSEC chain are computed by
+``udnsc sign`` and stored as ordinary records so that the server only
+ever selects precomputed signatures and never signs on the query path.
+
+Keys are RSA keys (RSASHA256 or RSASHA512) in the file format of BIND's
+dnssec-keygen (``K<zone>+<alg>+<tag>.key`` and ``.private``). Keys are
+generated and signatures made by the cryptography package (installed
+with ``pip install udns[dnssec]``).
+"""
+
+
+from os import path
+from time import time
+from struct import pack
+from binascii import hexlify, unhexlify
+from base64 import b64decode, b64encode
+
+
+from dnslib.label import DNSBuffer, DNSLabel
+from dnslib import DNSKEY, NSEC, QTYPE, RR, RRSIG
+
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+
+DNSKEY_TYPE = QTYPE.reverse["DNSKEY"]
+NSEC_TYPE = QTYPE.reverse["NSEC"]
+RRSIG_TYPE = QTYPE.reverse["RRSIG"]
+DS_TYPE = QTYPE.reverse["DS"]
+NS_TYPE = QTYPE.reverse["NS"]
+SOA_TYPE = QTYPE.reverse["SOA"]
+
+# Records maintained by signing a zone
+TYPES = (DNSKEY_TYPE, NSEC_TYPE, RRSIG_TYPE)
+
+# DNSKEY flags
+ZONE = 256
+SEP = 1
+
+RSASHA256 = 8
+RSASHA512 = 10
+
+# Algorithm number: (mnemonic, hash)
+ALGORITHMS = {
+    RSASHA256: ("RSASHA256", hashes.SHA256),
+    RSASHA512: ("RSASHA512", hashes.SHA512),
+}
+
+# Default validity of signatures (30 days)
+VALIDITY = 30 * 86400
+
+
+def to_int(data):
+    return int(hexlify(data), 16) if data else 0
+
+
+def to_bytes(n, size=None):
+    size = size or max(1, (n.bit_length() + 7) // 8)
+    return unhexlify("{0:x}".format(n).rjust(2 * size, "0"))
+
+
+class Key(object):
+    """RSA signing key (wrapping a cryptography private ``key``)"""
+
+    def __init__(self, algorithm, key, flags=ZONE):
+        if algorithm not in ALGORITHMS:
+            raise ValueError("Unsupported algorithm {0:d}".format(algorithm))
+
+        self.algorithm = algorithm
+        self.key = key
+        self.flags = flags
+
+        self.numbers = key.private_numbers()
+
+        self.n = self.numbers.public_numbers.n
+        self.e = self.numbers.public_numbers.e
+        self.d = self.numbers.d
+
+    @property
+    def ksk(self):
+        return bool(self.flags & SEP)
+
+    def public(self):
+        """Return the public key in DNSKEY format (RFC 3110)"""
+
+        exponent = to_bytes(self.e)
+        if len(exponent) < 256:
+            prefix = pack("!B", len(exponent))
+        else:
+            prefix = pack("!BH", 0, len(exponent))
+        return prefix + exponent + to_bytes(self.n)
+
+    def dnskey(self):
+        return DNSKEY(self.flags, 3, self.algorithm, self.public())
+
+    def tag(self):
+        """Return the key tag (RFC 4034 Appendix B)"""
+
+        data = bytearray(pack("!HBB", self.flags, 3, self.algorithm) +
+                         self.public())
+        ac = 0
+        for i, byte in enumerate(data):
+            ac += byte if i & 1 else byte << 8
+        ac += (ac >> 16) & 0xFFFF
+        return ac & 0xFFFF
+
+    def sign(self, data):
+        """Sign ``data`` (RSASSA-PKCS1-v1_5, RFC 8017)"""
+
+        _, digest = ALGORITHMS[self.algorithm]
+        return self.key.sign(data, padding.PKCS1v15(), digest())
+
+    def private(self):
+        """Return the private key in BIND's (v1.3) private key format"""
+
+        name = ALGORITHMS[self.algorithm][0]
+        numbers = self.numbers
+
+        fields = [
+            ("Private-key-format", "v1.3"),
+            ("Algorithm", "{0:d} ({1:s})".format(self.algorithm, name)),
+            ("Modulus", self.n),
+            ("PublicExponent", self.e),
+            ("PrivateExponent", self.d),
+            ("Prime1", numbers.p),
+            ("Prime2", numbers.q),
+            ("Exponent1", numbers.dmp1),
+            ("Exponent2", numbers.dmq1),
+            ("Coefficient", numbers.iqmp),
+        ]
+
+        return "".join(
+            "{0:s}: {1:s}\n".format(
+                field, value if isinstance(value, str)
+                else b64encode(to_bytes(value)).decode("ascii")
+            )
+            for field, value in fields
+        )
+
+
+def generate_key(bits=2048, algorithm=RSASHA256, flags=ZONE, e=65537):
+    """Generate a new RSA key of ``bits`` bits"""
+
+    key = rsa.generate_private_key(public_exponent=e, key_size=bits)
+    return Key(algorithm, key, flags)
+
+
+def load_key(filename):
+    """Load a key from a BIND ``.private`` file
+
+    The key's flags are read from the matching ``.key`` file if there is
+    one (otherwise the key is a zone signing key).
+    """
+
+    base = filename[:-len(".private")] \
+        if filename.endswith(".private") else filename
+
+    fields = {}
+    with open("{0:s}.private".format(base)) as f:
+        for line in f:
+            if ":" in line:
+                field, value = line.split(":", 1)
+                fields[field.strip()] = value.strip()
+
+    algorithm = int(fields["Algorithm"].split()[0])
+
+    def number(field):
+        return to_int(b64decode(fields[field]))
+
+    n = number("Modulus")
+    e = number("PublicExponent")
+    d = number("PrivateExponent")
+
+    if "Prime1" in fields and "Prime2" in fields:
+        p, q = number("Prime1"), number("Prime2")
+    else:
+        p, q = rsa.rsa_recover_prime_factors(n, e, d)
+
+    key = rsa.RSAPrivateNumbers(
+        p, q, d, rsa.rsa_crt_dmp1(d, p), rsa.rsa_crt_dmq1(d, q),
+        rsa.rsa_crt_iqmp(p, q), rsa.RSAPublicNumbers(e, n)
+    ).private_key()
+
+    flags = ZONE
+    if path.exists("{0:s}.key".format(base)):
+        with open("{0:s}.key".format(base)) as f:
+            for line in f:
+                tokens = line.split(";", 1)[0].split()
+                if "DNSKEY" in tokens:
+                    flags = int(tokens[tokens.index("DNSKEY") + 1])
+
+    return Key(algorithm, key, flags)
+
+
+def save_key(key, zone, directory="."):
+    """Save ``key`` of ``zone`` as BIND key files returning their base name"""
+
+    base = path.join(directory, "K{0:s}+{1:03d}+{2:05d}".format(
+        zone, key.algorithm, key.tag()
+    ))
+
+    with open("{0:s}.key".format(base), "w") as f:
+        f.write("{0:s} IN DNSKEY {1!r}\n".format(zone, key.dnskey()))
+
+    with open("{0:s}.private".format(base), "w") as f:
+        f.write(key.private())
+
+    return base
+
+
+class CanonicalBuffer(DNSBuffer):
+    """Buffer encoding names in canonical form (lowercase, uncompressed)"""
+
+    def encode_name(self, name):
+        self.encode_name_nocompress(name)
+
+    def encode_name_nocompress(self, name):
+        DNSBuffer.encode_name_nocompress(self, DNSLabel(str(name).lower()))
+
+
+def canonical(rr):
+    """Return the canonical wire format of the rdata of ``rr``"""
+
+    buffer = CanonicalBuffer()
+    rr.rdata.pack(buffer)
+    return bytes(buffer.data)
+
+
+def order(name):
+    """Sort key of names in canonical order (RFC 4034 6.1)"""
+
+    return tuple(reversed(DNSLabel(str(name).lower()).label))
+
+
+def sign_rrset(rrs, key, signer, inception, expiration):
+    """Return the RRSIG record of the RRset ``rrs`` made with ``key``"""
+
+    rr = rrs[0]
+    owner = DNSLabel(str(rr.rname).lower())
+
+    # The labels of the owner name not counting the root or a wildcard
+    labels = len(owner.label) - (1 if owner.label[:1] == (b"*",) else 0)
+
+    rrsig = RRSIG(
+        rr.rtype, key.algorithm, labels, rr.ttl, int(expiration),
+        int(inception), key.tag(), DNSLabel(str(signer).lower()), b""
+    )
+
+    buffer = CanonicalBuffer()
+    rrsig.pack(buffer)
+
+    for rdata in sorted(set(canonical(r) for r in rrs)):
+        buffer.encode_name(owner)
+        buffer.pack("!HHIH", rr.rtype, rr.rclass, rr.ttl, len(rdata))
+        buffer.append(rdata)
+
+    rrsig.sig = key.sign(bytes(buffer.data))
+
+    return RR(rr.rname, RRSIG_TYPE, rr.rclass, rr.ttl, rrsig)
+
+
+def sign_zone(zone, rrs, keys, inception=None, expiration=None):
+    """Sign the records ``rrs`` of ``zone`` with ``keys``
+
+    Returns the records to add to the (unsigned) zone: the DNSKEY RRset at
+    the apex, the NSEC chain and the RRSIG records of every authoritative
+    RRset. Key signing keys sign the DNSKEY RRset and zone signing keys
+    all others; if either kind is missing the other signs for it. Names
+    below a delegation are glue and are neither signed nor chained.
+    """
+
+    if not keys:
+        raise ValueError("No keys to sign {0:s} with".format(zone))
+
+    inception = int(time()) - 3600 if inception is None else inception
+    expiration = inception + VALIDITY if expiration is None else expiration
+
+    apex = str(zone).lower()
+
+    soa = [rr for rr in rrs if rr.rtype == SOA_TYPE]
+    if not soa:
+        raise ValueError("Zone {0:s} has no SOA record".format(zone))
+    soa = soa[0]
+
+    ksks = [key for key in keys if key.ksk] or list(keys)
+    zsks = [key for key in keys if not key.ksk] or list(keys)
+
+    rrs = [rr for rr in rrs if rr.rtype not in TYPES]
+    rrs.extend(
+        RR(apex, DNSKEY_TYPE, soa.rclass, soa.ttl, key.dnskey())
+        for key in keys
+    )
+
+    # RRsets by name and type
+    names = {}
+    for rr in rrs:
+        name = str(rr.rname).lower()
+        names.setdefault(name, {}).setdefault(rr.rtype, []).append(rr)
+
+    # Delegations (zone cuts) and the glue below them
+    cuts = [
+        name for name, rrsets in names.items()
+        if name != apex and NS_TYPE in rrsets
+    ]
+    glue = set(
+        name for name in names for cut in cuts
+        if name != cut and name.endswith("." + cut)
+    )
+
+    chain = sorted((name for name in names if name not in glue), key=order)
+
+    signed = [rr for rr in rrs if rr.rtype == DNSKEY_TYPE]
+
+    for i, name in enumerate(chain):
+        rrsets = names[name]
+        types = sorted(set(rrsets) | set([NSEC_TYPE, RRSIG_TYPE]))
+
+        nsec = RR(
+            name, NSEC_TYPE, soa.rclass, soa.rdata.times[4],
+            NSEC(chain[(i + 1) % len(chain)], [QTYPE[t] for t in types])
+        )
+        signed.append(nsec)
+
+        rrsets = dict(rrsets)
+        rrsets[NSEC_TYPE] = [nsec]
+
+        for rtype, rrset in sorted(rrsets.items()):
+            # Only the NSEC (and DS) records at a delegation are signed
+            if name in cuts and rtype not in (NSEC_TYPE, DS_TYPE):
+                continue
+
+            signers = ksks if rtype == DNSKEY_TYPE else zsks
+            signed.extend(
+                sign_rrset(rrset, key, apex, inception, expiration)
+                for key in signers
+            )
+
+    return signed
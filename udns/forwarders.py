@@ -0,0 +1,185 @@
+"""Forwarders
+
+Conditional forwarding: names under a configured zone (e.g:
+``corp.internal.``) are forwarded to that zone's own pool of upstream
+servers and all other names to the default servers (``--forward``). The
+forwarder of a name is the one of the longest zone containing it. Zones
+are held in a dict by name along with the label counts (depths) in use,
+so a match costs one dict lookup per distinct depth (not per zone) and
+a single hop replaces chains of resolvers.
+
+Forwarders are configured in a JSON file mapping zones to their servers
+and (optionally) bounds on the ttls of their answers held in the cache
+(overriding ``--min-ttl`` and ``--max-ttl``)::
+
+    {
+        "corp.internal.": {
+            "servers": ["10.0.0.1", "10.0.0.2:5353"],
+            "min_ttl": 30,
+            "max_ttl": 300
+        },
+        "svc.cluster.local.": {
+            "servers": ["10.96.0.10"]
+        }
+    }
+
+The servers of a forwarder are used in turn (round robin).
+"""
+
+
+from json import load
+from random import random
+from itertools import cycle
+
+
+def absolute(name):
+    return "{0:s}.".format(name.lower().strip("."))
+
+
+def labels(name):
+    name = name.lower().strip(".")
+    return name.split(".") if name else []
+
+
+def parse_server(s, port=53):
+    """Parse ``HOST[:PORT]`` (IPv6 hosts as ``[HOST]:PORT``)"""
+
+    if s.startswith("["):
+        host, _, rest = s[1:].partition("]")
+        return host, int(rest[1:]) if rest else port
+
+    if s.count(":") == 1:
+        host, _, p = s.partition(":")
+        return host, int(p)
+
+    return s, port
+
+
+def parse_servers(s):
+    """Parse a comma separated list of servers"""
+
+    return [parse_server(server.strip()) for server in s.split(",")]
+
+
+def valid_ttls(min_ttl, max_ttl):
+    """Return whether ``min_ttl`` and ``max_ttl`` (if given) are bounds"""
+
+    if any(ttl is not None and ttl < 0 for ttl in (min_ttl, max_ttl)):
+        return False
+
+    return None in (min_ttl, max_ttl) or min_ttl <= max_ttl
+
+
+class Forwarder(object):
+    """Upstream ``servers`` of the names under ``zone``
+
+    Answers are cached with their ttls bounded by ``min_ttl`` and
+    ``max_ttl`` and shortened by up to ``jitter`` (a fraction).
+    """
+
+    def __init__(self, zone, servers, min_ttl=None, max_ttl=None, jitter=0):
+        self.zone = absolute(zone)
+        self.servers = tuple(servers)
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.jitter = jitter
+
+        self._servers = cycle(self.servers)
+
+    def __repr__(self):
+        return "<Forwarder {0:s}>".format(self.zone)
+
+    def server(self):
+        """Return the next server of the pool"""
+
+        return next(self._servers)
+
+    def clamp(self, rrs):
+        """Bound the ttls of ``rrs`` (in place) by ``min_ttl``/``max_ttl``
+
+        All records of an answer are shortened by the same random
+        fraction so that answers cached together (popular names) do not
+        all expire (and get refreshed upstream) in the same second.
+        """
+
+        low = self.min_ttl or 0
+        high = self.max_ttl
+        cut = self.jitter * random()
+
+        for rr in rrs:
+            ttl = rr.ttl if high is None else min(rr.ttl, high)
+            rr.ttl = max(ttl - int(ttl * cut), low)
+
+        return rrs
+
+
+class Forwarders(object):
+    """Forwarders selected by longest zone falling back to ``default``"""
+
+    def __init__(self, default):
+        self.default = default
+        self.zones = {}
+        self.depths = ()
+
+    def __iter__(self):
+        yield self.default
+        for zone in sorted(self.zones):
+            yield self.zones[zone]
+
+    def __len__(self):
+        return len(self.zones) + 1
+
+    def add(self, forwarder):
+        self.zones[forwarder.zone] = forwarder
+
+        # Longest zones are tried first
+        depths = set(self.depths)
+        depths.add(len(labels(forwarder.zone)))
+        self.depths = tuple(sorted(depths, reverse=True))
+
+    def match(self, qname):
+        if not self.zones:
+            return self.default
+
+        names = labels(qname)
+        n = len(names)
+
+        for depth in self.depths:
+            if depth > n:
+                continue
+
+            zone = "{0:s}.".format(".".join(names[n - depth:]))
+            found = self.zones.get(zone)
+            if found is not None:
+                return found
+
+        return self.default
+
+
+def load_forwarders(filename):
+    """Load and validate the forwarder configuration in ``filename``
+
+    Returns a list of ``(zone, servers, min_ttl, max_ttl)`` tuples.
+    """
+
+    with open(filename) as f:
+        config = load(f)
+
+    forwarders = []
+
+    for zone, options in sorted(config.items()):
+        servers = options.get("servers", [])
+        if not servers:
+            raise ValueError("Forwarder {0:s} has no servers".format(zone))
+
+        min_ttl = options.get("min_ttl")
+        max_ttl = options.get("max_ttl")
+        if not valid_ttls(min_ttl, max_ttl):
+            raise ValueError("Invalid ttl bounds of {0:s}".format(zone))
+
+        forwarders.append((
+            absolute(zone), [parse_server(s) for s in servers],
+            min_ttl, max_ttl
+        ))
+
+    return forwarders
@@ -6,25 +6,31 @@
 """Data Models"""
 
 
-from dnslib import ZoneParser
-from dnslib import CLASS, QTYPE, RDMAP, RR
+from dnslib import CLASS, QTYPE
 
+from redisco import get_client
 from redisco.models import Model
+from redisco.models.utils import _encode_key
 from redisco.models import Attribute, IntegerField, ListField
 
 
+from .storage import to_rr
+
+
 class Zone(Model):
 
     name = Attribute(required=True, unique=True)
     ttl = IntegerField(default=0)
+    serial = IntegerField(default=0)
     records = ListField("Record")
 
     def delete(self):
         for record in self.records:
             record.delete()
+        self.db.delete(self.key()["journal"])
         super(Zone, self).delete()
 
-    def _add_record(self, rname, rdata, rclass=CLASS.IN, rtype=QTYPE.A, ttl=0):
+    def add_record(self, rname, rdata, rclass=CLASS.IN, rtype=QTYPE.A, ttl=0):
         record = Record(
             rname=rname, rdata=rdata,
             rclass=rclass, rtype=rtype, ttl=ttl
@@ -33,100 +39,104 @@ class Zone(Model):
         self.records.append(record)
         self.save()
 
-    def add_record(self, rname, rdata, **options):
-        rclass = options.get("rclass", CLASS.IN)
-        rtype = options.get("rtype", QTYPE.A)
-        ttl = options.get("ttl", self.ttl)
+    def delete_record(self, record):
+        for i, other in enumerate(self.records):
+            if other.id == record.id:
+                record.delete()
+                del self.records[i]
+                self.save()
+                return
 
-        rclass = rclass if rclass is not None else CLASS.IN
-        rtype = rtype if rtype is not None else QTYPE.A
-        ttl = ttl if ttl is not None else self.ttl
+    class Meta:
+        indicies = ("id", "name",)
 
-        self._add_record(
-            self.name
-            if rname == "@"
-            else "{0:s}.{1:s}".format(rname, self.name),
-            rdata,
-            rclass=rclass, rtype=rtype, ttl=ttl
-        )
 
-    def delete_record(self, rname):
-        fullname = (
-            self.name
-            if rname == "@"
-            else
-            "{0:s}.{1:s}".format(rname, self.name)
-        )
+class Record(Model):
 
-        records = [
-            (i, record)
-            for i, record in enumerate(self.records)
-            if record.rname == fullname
-        ]
+    rname = Attribute(required=True)
+    rdata = Attribute(required=True)
 
-        if not records:
-            return
+    ttl = IntegerField(default=0)
 
-        i, record = records[0]
-        record.delete()
+    rclass = IntegerField(default=CLASS.IN)
+    rtype = IntegerField(default=QTYPE.A)
 
-        del self.records[i]
-        self.save()
+    @property
+    def rr(self):
+        return to_rr(self.rname, self.rdata, self.rclass, self.rtype, self.ttl)
 
-    def load(self, f):
-        parser = ZoneParser(f.read())
+    @classmethod
+    def from_hash(cls, id, values):
+        """Create a Record from the raw values of its Redis hash"""
 
-        for rr in list(parser):
-            rname = str(rr.rname)
-            rdata = str(rr.rdata)
-            rclass = rr.rclass
-            rtype = rr.rtype
-            ttl = rr.ttl
+        record = cls()
+        record._id = str(id)
 
-            self._add_record(rname, rdata, rclass=rclass, rtype=rtype, ttl=ttl)
+        for name, attribute in cls._attributes.items():
+            value = values.get(name)
+            if value is not None:
+                setattr(record, name, attribute.typecast_for_read(value))
 
-        self.ttl = parser.ttl
-        self.save()
+        return record
 
-    def export(self):
-        out = [
-            "$TTL {0:d}".format(self.ttl),
-            "$ORIGIN {0:s}".format(self.name.rstrip(".")),
-            "",
-        ]
+    class Meta:
+        indicies = ("id", "rname", "rclass", "rtype", "ttl", "rdata",)
 
-        for record in self.records:
-            rr = record.rr
-            rname = str(rr.rname.stripSuffix(self.name))
-            out.append(
-                "{0:23s} {1:7d} {2:7s} {3:7s} {4:s}".format(
-                    rname, rr.ttl,
-                    CLASS.get(rr.rclass),
-                    QTYPE.get(rr.rtype),
-                    rr.rdata.toZone()
-                )
-            )
-
-        return "\n".join(out)
 
-    class Meta:
-        indicies = ("id", "name",)
+def find_records(rnames):
+    """Find the records of many names in two pipelined round trips
 
+    Returns a dict mapping each name to a (possibly empty) list of
+    :class:`Record` objects with all of their attributes preloaded.
+    """
 
-class Record(Model):
+    rnames = list(rnames)
+    attribute = Record._attributes["rname"]
 
-    rname = Attribute(required=True)
-    rdata = Attribute(required=True)
+    db = get_client()
 
-    ttl = IntegerField(default=0)
+    pipe = db.pipeline(transaction=False)
+    for rname in rnames:
+        value = attribute.typecast_for_storage(rname)
+        pipe.smembers(Record._key["rname"][_encode_key(value)])
+    ids = pipe.execute()
 
-    rclass = IntegerField(default=CLASS.IN)
-    rtype = IntegerField(default=QTYPE.A)
+    pipe = db.pipeline(transaction=False)
+    for members in ids:
+        for id in members:
+            pipe.hgetall(Record._key[id])
+    values = iter(pipe.execute())
 
-    @property
-    def rr(self):
-        rdata = RDMAP[QTYPE[self.rtype]](self.rdata)
-        return RR(self.rname, self.rtype, self.rclass, self.ttl, rdata)
+    return dict(
+        (rname, [Record.from_hash(id, next(values)) for id in members])
+        for rname, members in zip(rnames, ids)
+    )
 
-    class Meta:
-        indicies = ("id", "rname", "rclass", "rtype", "ttl", "rdata",)
+
+def iter_records(zone, size=1000):
+    """Yield the records of ``zone`` fetched ``size`` at a time
+
+    Each page of record ids is followed by a single pipelined round trip
+    for the records themselves.
+    """
+
+    db = get_client()
+    key = zone.key()["records"]
+
+    start = 0
+    while True:
+        ids = db.lrange(key, start, start + size - 1)
+        if not ids:
+            return
+
+        pipe = db.pipeline(transaction=False)
+        for id in ids:
+            pipe.hgetall(Record._key[id])
+
+        for id, values in zip(ids, pipe.execute()):
+            yield Record.from_hash(id, values)
+
+        if len(ids) < size:
+            return
+
+        start += size
@@ -0,0 +1,302 @@
+"""Response Policy
+
+Response policy zones (RPZ): lists of names (QNAME triggers) answered
+with a policy instead of their data. Policy files are RPZ zone files::
+
+    $ORIGIN rpz.local.
+    ads.example.com     CNAME   .               ; NXDOMAIN
+    *.ads.example.com   CNAME   .               ; NXDOMAIN (subdomains)
+    tracker.example.com CNAME   *.              ; NODATA
+    good.example.com    CNAME   rpz-passthru.   ; no policy
+    bad.example.com     CNAME   rpz-drop.       ; no response
+    home.example.com    A       127.0.0.1       ; rewrite (local data)
+
+or plain lists of names (one per line) to answer with NXDOMAIN.
+
+Feeds of millions of names are held in a compact form: the reversed
+trigger names (``com.example.ads`` and ``com.example.ads.*``) sorted in
+a single byte string with an array of their offsets and another of their
+actions, searched by bisection. A Bloom filter in front answers most
+misses (the common case) without searching at all. Policies are built
+in one process and never shared, so the filter uses Python's own hash.
+"""
+
+
+from os import path
+from array import array
+from operator import itemgetter
+from collections import namedtuple
+
+
+from dnslib import CLASS, QTYPE, RDMAP, RD, RR, TXT
+
+from .answers import wanted, CNAME
+
+
+NXDOMAIN = "nxdomain"
+NODATA = "nodata"
+PASSTHRU = "passthru"
+DROP = "drop"
+REWRITE = "rewrite"
+
+Action = namedtuple("Action", ("kind", "records",))
+
+CLASSES = ("IN", "CH", "HS")
+
+# Policies of the special CNAME targets (RFC draft-ietf-dnsop-dns-rpz)
+TARGETS = {
+    ".": Action(NXDOMAIN, ()),
+    "*.": Action(NODATA, ()),
+    "rpz-passthru.": Action(PASSTHRU, ()),
+    "rpz-drop.": Action(DROP, ()),
+}
+
+
+def absolute(name):
+    return "{0:s}.".format(name.lower().rstrip("."))
+
+
+def trigger(name):
+    """Return the key of the trigger ``name`` (its labels reversed)"""
+
+    labels = name.lower().rstrip(".").split(".")
+    labels.reverse()
+    return ".".join(labels).encode("utf-8")
+
+
+class Bloom(object):
+    """Bloom filter of ``n`` keys (about 1% false positives)"""
+
+    def __init__(self, n, bits=10, k=4):
+        self.k = k
+        self.size = max(64, n * bits)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def positions(self, key):
+        # Double hashing of the (per process) hash of the key
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) & 0xFFFFFFFF | 1
+        return [(h1 + i * h2) % self.size for i in range(self.k)]
+
+    def add(self, key):
+        for i in self.positions(key):
+            self.bits[i >> 3] |= 1 << (i & 7)
+
+    def __contains__(self, key):
+        bits, size = self.bits, self.size
+
+        h = hash(key)
+        h1, h2 = h & 0xFFFFFFFF, (h >> 32) & 0xFFFFFFFF | 1
+
+        # Most misses are told by the first bit
+        for _ in range(self.k):
+            i = h1 % size
+            if not bits[i >> 3] & (1 << (i & 7)):
+                return False
+            h1 += h2
+
+        return True
+
+
+class Rules(object):
+    """Sorted, compact mapping of trigger keys to actions"""
+
+    def __init__(self, entries, actions):
+        # Stable, so duplicates keep their order
+        entries.sort(key=itemgetter(0))
+
+        keys, indexes = [], []
+        for key, index in entries:
+            # The first of duplicate triggers applies
+            if keys and keys[-1] == key:
+                continue
+            keys.append(key)
+            indexes.append(index)
+
+        self.actions = actions
+        self.data = b"".join(keys)
+
+        self.offsets = array("I" if len(self.data) < 1 << 32 else "L", [0])
+        offset = 0
+        for key in keys:
+            offset += len(key)
+            self.offsets.append(offset)
+
+        self.indexes = array("I", indexes)
+
+        self.bloom = Bloom(len(keys))
+        for key in keys:
+            self.bloom.add(key)
+
+    def __len__(self):
+        return len(self.indexes)
+
+    def get(self, key):
+        if key not in self.bloom:
+            return None
+
+        data, offsets = self.data, self.offsets
+
+        lo, hi = 0, len(self.indexes)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            other = data[offsets[mid]:offsets[mid + 1]]
+            if other < key:
+                lo = mid + 1
+            elif other > key:
+                hi = mid
+            else:
+                return self.actions[self.indexes[mid]]
+
+        return None
+
+
+def parse(f, origin=None):
+    """Parse the RPZ zone (or list of names) ``f``
+
+    Yields ``(name, rtype, rclass, ttl, rdata)`` tuples; names of plain
+    lists yield the NXDOMAIN policy (``CNAME .``).
+    """
+
+    ttl = 300
+    owner = None
+    origin = origin and absolute(origin)
+
+    lines = iter(f)
+    for line in lines:
+        line = line.split(";", 1)[0].rstrip()
+        if not line.strip():
+            continue
+
+        # Records continued over several lines (SOA)
+        while "(" in line and ")" not in line:
+            line += " " + next(lines, ")").split(";", 1)[0].strip()
+        line = line.replace("(", " ").replace(")", " ")
+
+        tokens = line.split()
+
+        if tokens[0] == "$ORIGIN":
+            origin = absolute(tokens[1])
+            continue
+        if tokens[0] == "$TTL":
+            ttl = int(tokens[1])
+            continue
+
+        if len(tokens) == 1:
+            yield tokens[0], CNAME, CLASS.IN, ttl, "."
+            continue
+
+        if not line[0].isspace():
+            owner = tokens.pop(0)
+            if owner == "@" or owner.lower() == origin:
+                owner = "."
+            elif origin and owner.lower().endswith("." + origin):
+                owner = owner[:-len(origin) - 1]
+
+        rttl, rclass = ttl, CLASS.IN
+        while tokens and (tokens[0].isdigit() or tokens[0] in CLASSES):
+            token = tokens.pop(0)
+            if token.isdigit():
+                rttl = int(token)
+            else:
+                rclass = getattr(CLASS, token)
+
+        rtype = getattr(QTYPE, tokens[0].upper())
+
+        # The policy zone's own apex records
+        if owner in (None, ".") or rtype in (QTYPE.SOA, QTYPE.NS):
+            continue
+
+        yield owner, rtype, rclass, rttl, " ".join(tokens[1:])
+
+
+def action(rtype, rdata):
+    """Return the action of a policy record (or ``None`` for local data)"""
+
+    if rtype == CNAME:
+        return TARGETS.get(rdata.lower())
+
+
+class Policy(object):
+    """Response policy loaded from ``filenames``
+
+    Earlier files (and earlier triggers in a file) take precedence.
+    Exact triggers take precedence over wildcards and longer wildcards
+    over shorter ones.
+    """
+
+    def __init__(self, filenames):
+        self.filenames = list(filenames)
+        self.mtimes = self.stat()
+
+        actions = list(TARGETS.values())
+        indexes = dict((a, i) for i, a in enumerate(actions))
+
+        entries = []
+        rewrites = {}
+
+        for filename in self.filenames:
+            with open(filename) as f:
+                for name, rtype, rclass, ttl, rdata in parse(f):
+                    key = trigger(name)
+
+                    policy = action(rtype, rdata)
+                    if policy is not None:
+                        entries.append((key, indexes[policy]))
+                        continue
+
+                    # Local data of the same trigger is one rewrite
+                    if key not in rewrites:
+                        rewrites[key] = len(actions)
+                        actions.append(Action(REWRITE, []))
+                        entries.append((key, rewrites[key]))
+
+                    rd = RDMAP.get(QTYPE[rtype], RD)
+                    tokens = [rdata.strip('"')] if rd is TXT \
+                        else rdata.split()
+                    actions[rewrites[key]].records.append(
+                        (rtype, rclass, ttl, rd.fromZone(tokens))
+                    )
+
+        self.rules = Rules(entries, actions)
+
+    def __len__(self):
+        return len(self.rules)
+
+    def stat(self):
+        return [
+            path.getmtime(filename) if path.exists(filename) else None
+            for filename in self.filenames
+        ]
+
+    def changed(self):
+        return self.stat() != self.mtimes
+
+    def match(self, qname):
+        """Return the action for ``qname`` (``None`` if no trigger matches)"""
+
+        labels = qname.lower().rstrip(".").split(".")
+        labels.reverse()
+
+        rules = self.rules
+
+        found = rules.get(".".join(labels).encode("utf-8"))
+        if found is not None:
+            return found
+
+        # Wildcards (*.name) match the names below name
+        for i in range(len(labels) - 1, 0, -1):
+            found = rules.get(".".join(labels[:i] + ["*"]).encode("utf-8"))
+            if found is not None:
+                return found
+
+        return None
+
+    def answer(self, action, qname, qtype, qclass):
+        """Return the records of the rewrite ``action`` answering a query"""
+
+        return [
+            RR(qname, rtype, rclass, ttl, rdata)
+            for rtype, rclass, ttl, rdata in action.records
+            if rtype == CNAME or wanted(rtype, rclass, qtype, qclass)
+        ]
@@ -0,0 +1,150 @@
+"""Protocol
+
+Components parsing DNS messages off the datagram (UDP) and stream (TCP,
+TLS) transports and the peers replies are sent back to.
+"""
+
+
+from struct import pack, unpack
+from logging import getLogger
+
+
+from dnslib import DNSError, DNSRecord, QR
+
+from circuits import Component, Event
+from circuits.net.events import close, write
+
+
+from .update import parse as parse_update
+
+
+logger = getLogger(__name__)
+
+
+class request(Event):
+    """request Event"""
+
+
+class response(Event):
+    """response Event"""
+
+
+def parse(tracer, data):
+    start = tracer.clock()
+
+    try:
+        record = DNSRecord.parse(data)
+    except DNSError:
+        record = parse_update(data)
+
+    record.received = tracer.record("parse", start)
+
+    # Signatures (TSIG) are verified against the original message
+    record.wire = data
+
+    return record
+
+
+class Peer(tuple):
+    """Peer of a transport other than the datagram (UDP) one
+
+    Behaves as the ``(host, port)`` tuple of the remote end and knows how
+    to deliver a reply over its transport (on ``channel``).
+    """
+
+    def __new__(cls, host, port, channel):
+        self = tuple.__new__(cls, (host, port))
+        self.channel = channel
+        return self
+
+    def reply(self, manager, record, data):
+        raise NotImplementedError()
+
+
+class Connection(Peer):
+    """Peer of a stream (TCP or TLS) connection"""
+
+    def __new__(cls, sock, host, port, channel):
+        self = Peer.__new__(cls, host, port, channel)
+        self.sock = sock
+        return self
+
+    def reply(self, manager, record, data):
+        data = pack("!H", len(data)) + data
+        manager.fire(write(self.sock, data), self.channel)
+
+
+class Protocol(Component):
+    """Base of the DNS protocol components
+
+    Parses messages and fires them as request or response events on the
+    ``target`` channel.
+    """
+
+    def init(self, tracer, target=None, channel=None):
+        self.tracer = tracer
+        self.target = target or self.channel
+
+    def _dispatch(self, peer, data):
+        record = parse(self.tracer, data)
+
+        event = request if record.header.qr == QR.QUERY else response
+        return self.fire(event(peer, record), self.target)
+
+
+class DNS(Protocol):
+
+    def read(self, peer, data):
+        return self._dispatch(peer, data)
+
+
+class StreamDNS(Protocol):
+    """DNS over stream transports
+
+    Messages are prefixed with their two byte length (RFC 1035 4.2.2) and
+    several may be pipelined on (or split across reads of) a connection.
+    A message that does not parse closes its connection (the stream can
+    not be trusted to be in sync any more).
+    """
+
+    def init(self, tracer, target=None, channel=None):
+        super(StreamDNS, self).init(tracer, target=target, channel=channel)
+
+        self.buffers = {}
+        self.connections = {}
+
+    def connect(self, sock, host, port):
+        self.buffers[sock] = b""
+        self.connections[sock] = Connection(sock, host, port, self.channel)
+
+    def disconnect(self, sock):
+        self.buffers.pop(sock, None)
+        self.connections.pop(sock, None)
+
+    def read(self, sock, data):
+        if sock not in self.connections:
+            return
+
+        buffer = self.buffers[sock] + data
+
+        while len(buffer) >= 2:
+            length, = unpack("!H", buffer[:2])
+            if len(buffer) < length + 2:
+                break
+
+            message, buffer = buffer[2:length + 2], buffer[length + 2:]
+
+            peer = self.connections[sock]
+            try:
+                self._dispatch(peer, message)
+            except DNSError as error:
+                logger.warning(
+                    "Malformed message from {0:s}:{1:d}: {2:s}".format(
+                        peer[0], peer[1], str(error)
+                    )
+                )
+                self.disconnect(sock)
+                self.fire(close(sock), self.channel)
+                return
+
+        self.buffers[sock] = buffer
@@ -0,0 +1,94 @@
+"""Query Log
+
+Structured (JSON lines) query logging. Records are appended to a bounded
+ring buffer on the query path and drained by a background writer thread
+which performs all formatting and I/O. When the ring buffer is full the
+oldest records are dropped (and counted) rather than blocking.
+"""
+
+
+from json import dumps
+from time import time
+from random import random
+from collections import deque
+from threading import Event, Thread
+
+
+from dnslib import CLASS, QTYPE
+
+
+class QueryLog(object):
+
+    def __init__(self, f=None, sample=1.0, size=65536, interval=0.25):
+        self.f = f
+        self.sample = sample
+        self.interval = interval
+
+        self.enabled = f is not None and sample > 0
+
+        self.dropped = 0
+        self.buffer = deque(maxlen=size)
+
+        self._stop = Event()
+        self._thread = None
+
+        if self.enabled:
+            self._thread = Thread(target=self.run, name="querylog")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def log(self, kind, peer, qname, qtype, qclass, upstream=None):
+        if not self.enabled:
+            return
+
+        if self.sample < 1.0 and random() >= self.sample:
+            return
+
+        if len(self.buffer) == self.buffer.maxlen:
+            self.dropped += 1
+
+        self.buffer.append(
+            (time(), kind, peer, qname, qtype, qclass, upstream)
+        )
+
+    def format(self, record):
+        timestamp, kind, peer, qname, qtype, qclass, upstream = record
+
+        entry = {
+            "time": timestamp,
+            "type": kind,
+            "client": "{0:s}:{1:d}".format(*peer),
+            "qname": qname,
+            "qtype": QTYPE.get(qtype),
+            "qclass": CLASS.get(qclass),
+        }
+
+        if upstream is not None:
+            entry["upstream"] = "{0:s}:{1:d}".format(*upstream)
+
+        return dumps(entry, sort_keys=True)
+
+    def drain(self):
+        buffer = self.buffer
+
+        lines = []
+        while buffer:
+            lines.append(self.format(buffer.popleft()))
+
+        if lines:
+            lines.append("")
+            self.f.write("\n".join(lines))
+            self.f.flush()
+
+    def run(self):
+        while not self._stop.is_set():
+            self._stop.wait(self.interval)
+            self.drain()
+
+    def stop(self):
+        if self._thread is None:
+            return
+
+        self._stop.set()
+        self._thread.join()
+        self._thread = None
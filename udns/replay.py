@@ -0,0 +1,700 @@
+"""Replay
+
+Deterministic replay of recorded query streams against an in-process
+server for performance testing offline (no network, Redis or upstream
+resolvers). Queries are read from packet captures (classic pcap files of
+UDP DNS traffic) or query logs (the JSON lines of ``--querylog`` or lines
+of ``NAME [TYPE]``) and sent in their recorded order to a :class:`Server`
+listening on the loopback interface.
+
+The server forwards to a fake upstream answering from the responses
+recorded in the capture (or with answers derived from the query name
+when there are none) and serves zones from a fake, in-memory store::
+
+    $ udns-replay --zone abc.com.=abc.com capture.pcap -- --min-ttl 30
+
+Options after ``--`` are passed on to the server. Every ``--interval``
+queries a sample of the throughput, cache hit ratio and memory use is
+reported, so the samples of separate runs line up query for query.
+
+Replays are exactly repeatable with ``--concurrency 1`` and a fixed
+``PYTHONHASHSEED`` (cache shards are picked by hash); with more queries
+pending, misses of the same name in flight make hit ratios vary slightly.
+"""
+
+
+from __future__ import print_function
+
+
+import sys
+import logging
+from json import dumps, loads
+from zlib import crc32
+from logging import getLogger
+from struct import pack, unpack
+from collections import namedtuple
+from threading import Event as Flag, Thread
+from random import seed
+from select import select
+from socket import socket, timeout as SocketTimeout, AF_INET, SOCK_DGRAM
+from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter
+
+
+from dnslib import DNSRecord, A, AAAA, CLASS, QTYPE, RR
+
+from circuits import handler, BaseComponent
+
+
+from . import __version__
+from .storage import MemoryStorage
+from .server import parse_args as parse_server_args, Server
+from .stats import clock, Histogram
+
+
+Query = namedtuple("Query", ("time", "data"))
+
+# pcap magic numbers (microsecond and nanosecond timestamps)
+PCAP = 0xa1b2c3d4
+PCAP_NS = 0xa1b23c4d
+PCAPNG = 0x0a0d0d0a
+
+# Link layer header types
+NULL, ETHERNET, RAW, RAW_BSD, SLL, IPV4, IPV6, SLL2 = (
+    0, 1, 101, 12, 113, 228, 229, 276
+)
+
+UDP = 17
+
+# IPv6 extension headers (hop-by-hop, routing, destination options)
+EXTENSIONS = (0, 43, 60)
+
+
+def read_pcap(filename):
+    """Yield ``(time, sport, dport, payload)`` of the UDP packets captured
+
+    Fragmented datagrams are skipped.
+    """
+
+    with open(filename, "rb") as f:
+        header = f.read(24)
+        if len(header) < 24:
+            return
+
+        magic, = unpack("<I", header[:4])
+        if magic == PCAPNG:
+            raise ValueError(
+                "{0:s}: pcapng is not supported (convert it with "
+                "editcap -F pcap)".format(filename)
+            )
+
+        if magic in (PCAP, PCAP_NS):
+            order = "<"
+        else:
+            order = ">"
+            magic, = unpack(">I", header[:4])
+            if magic not in (PCAP, PCAP_NS):
+                raise ValueError("{0:s}: not a pcap file".format(filename))
+
+        scale = 1e-9 if magic == PCAP_NS else 1e-6
+        linktype, = unpack(order + "I", header[20:24])
+        record = order + "IIII"
+
+        while True:
+            header = f.read(16)
+            if len(header) < 16:
+                return
+
+            seconds, fraction, length, _ = unpack(record, header)
+            frame = f.read(length)
+
+            packet = decode(linktype, frame)
+            if packet is not None:
+                yield (seconds + fraction * scale,) + packet
+
+
+def decode(linktype, frame):
+    """Return ``(sport, dport, payload)`` of a UDP packet (or ``None``)"""
+
+    if linktype == ETHERNET:
+        offset, ethertype = 14, unpack("!H", frame[12:14])[0]
+        while ethertype in (0x8100, 0x88a8):  # VLAN tags
+            ethertype = unpack("!H", frame[offset + 2:offset + 4])[0]
+            offset += 4
+        if ethertype not in (0x0800, 0x86dd):
+            return None
+    elif linktype == SLL:
+        offset = 16
+    elif linktype == SLL2:
+        offset = 20
+    elif linktype == NULL:
+        offset = 4
+    elif linktype in (RAW, RAW_BSD, IPV4, IPV6):
+        offset = 0
+    else:
+        raise ValueError("Unsupported link type {0:d}".format(linktype))
+
+    data = bytearray(frame[offset:])
+    if not data:
+        return None
+
+    version = data[0] >> 4
+
+    if version == 4:
+        start = (data[0] & 0x0F) * 4
+        flags, = unpack("!H", bytes(data[6:8]))
+        if data[9] != UDP or flags & 0x3FFF:
+            return None
+    elif version == 6:
+        start, protocol = 40, data[6]
+        while protocol in EXTENSIONS:
+            protocol, size = data[start], (data[start + 1] + 1) * 8
+            start += size
+        if protocol != UDP:
+            return None
+    else:
+        return None
+
+    sport, dport, length = unpack("!HHH", bytes(data[start:start + 6]))
+    return sport, dport, bytes(data[start + 8:start + length])
+
+
+def is_response(payload):
+    # QR set and a standard QUERY opcode
+    return len(payload) > 12 and bytearray(payload[2:3])[0] & 0xF8 == 0x80
+
+
+def is_query(payload):
+    return len(payload) > 12 and bytearray(payload[2:3])[0] & 0xF8 == 0
+
+
+def question(record):
+    q = record.q
+    return str(q.qname).lower(), q.qtype, q.qclass
+
+
+def recorded(packets, port=53):
+    """Return the first response captured to each question"""
+
+    responses = {}
+
+    for _, sport, dport, payload in packets:
+        if sport != port or not is_response(payload):
+            continue
+
+        try:
+            key = question(DNSRecord.parse(payload))
+        except Exception:
+            continue
+
+        responses.setdefault(key, payload)
+
+    return responses
+
+
+def pcap_queries(packets, port=53):
+    for time, sport, dport, payload in packets:
+        if dport == port and is_query(payload):
+            yield Query(time, payload)
+
+
+def log_queries(filename):
+    """Yield the queries of a query log
+
+    Lines are either JSON objects (as written by ``--querylog``) or
+    ``NAME [TYPE]``; the latter carry no time.
+    """
+
+    with open(filename, "r") as f:
+        for entry in parse_log(f):
+            yield entry
+
+
+def parse_log(f):
+    for line in f:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+
+        if line.startswith("{"):
+            entry = loads(line)
+            time = entry.get("time")
+            qname = entry["qname"]
+            qtype = getattr(QTYPE, entry.get("qtype", "A"))
+            qclass = getattr(CLASS, entry.get("qclass", "IN"))
+        else:
+            tokens = line.split()
+            time, qname = None, tokens[0]
+            qtype = getattr(QTYPE, tokens[1].upper()) if len(tokens) > 1 \
+                else QTYPE.A
+            qclass = CLASS.IN
+
+        request = DNSRecord.question(qname, QTYPE[qtype], CLASS[qclass])
+        yield Query(time, request.pack())
+
+
+def is_capture(filename):
+    with open(filename, "rb") as f:
+        magic = f.read(4)
+
+    if len(magic) < 4:
+        return False
+
+    return unpack("<I", magic)[0] in (PCAP, PCAP_NS, PCAPNG) or \
+        unpack(">I", magic)[0] in (PCAP, PCAP_NS)
+
+
+def read_queries(filename, port=53):
+    """Return the queries (and recorded responses) of ``filename``"""
+
+    if is_capture(filename):
+        # Responses are all read first as they answer earlier queries
+        responses = recorded(read_pcap(filename), port)
+        return pcap_queries(read_pcap(filename), port), responses
+
+    return log_queries(filename), {}
+
+
+def synthesize(request, ttl):
+    """Answer ``request`` with data derived from its name
+
+    A and AAAA queries get an address from the CRC of the name and all
+    others an empty (NODATA) answer.
+    """
+
+    reply = request.reply()
+
+    qname, qtype, qclass = question(request)
+    n = crc32(qname.encode("utf-8")) & 0xFFFFFFFF
+
+    if qtype == QTYPE.A:
+        reply.add_answer(RR(
+            request.q.qname, QTYPE.A, qclass, ttl,
+            A("10.{0:d}.{1:d}.{2:d}".format(
+                n >> 16 & 0xFF, n >> 8 & 0xFF, n & 0xFF
+            ))
+        ))
+    elif qtype == QTYPE.AAAA:
+        reply.add_answer(RR(
+            request.q.qname, QTYPE.AAAA, qclass, ttl,
+            AAAA("fd00::{0:x}:{1:x}".format(n >> 16, n & 0xFFFF))
+        ))
+
+    return reply.pack()
+
+
+class Upstream(Thread):
+    """Fake upstream answering from recorded ``responses``"""
+
+    def __init__(self, responses, ttl=300):
+        super(Upstream, self).__init__()
+
+        self.daemon = True
+
+        self.responses = responses
+        self.ttl = ttl
+
+        self.recorded = 0
+        self.synthesized = 0
+
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+        self.sock.settimeout(0.1)
+
+        self.address = self.sock.getsockname()
+        self.stopped = Flag()
+
+    def run(self):
+        while not self.stopped.is_set():
+            try:
+                data, peer = self.sock.recvfrom(65535)
+            except SocketTimeout:
+                continue
+
+            try:
+                request = DNSRecord.parse(data)
+            except Exception:
+                continue
+
+            response = self.responses.get(question(request))
+            if response is not None:
+                self.recorded += 1
+                # Recorded responses are answered under the request's id
+                response = data[:2] + response[2:]
+            else:
+                self.synthesized += 1
+                response = synthesize(request, self.ttl)
+
+            self.sock.sendto(response, peer)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.sock.close()
+
+
+class Ready(BaseComponent):
+
+    def init(self):
+        self.flag = Flag()
+
+    @handler("ready", channel="server")
+    def _on_ready(self, server, bind):
+        self.flag.set()
+
+
+def rss():
+    """Return the resident memory of the process in bytes"""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * 4096
+    except (IOError, OSError):
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # kilobytes on Linux, bytes on OS X
+        return usage if sys.platform == "darwin" else usage * 1024
+
+
+def quantile(histogram, q):
+    """Return the bound of the bucket holding the ``q`` quantile"""
+
+    total, target = 0, q * histogram.count
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        total += count
+        if total >= target:
+            return bound
+    return float("inf")
+
+
+class Replay(object):
+    """Replays queries to ``address`` with up to ``concurrency`` pending"""
+
+    def __init__(self, server, address, args):
+        self.server = server
+        self.address = address
+        self.args = args
+
+        self.sock = socket(AF_INET, SOCK_DGRAM)
+        self.sock.bind(("127.0.0.1", 0))
+
+        self.pending = {}
+        self.sent = 0
+        self.answered = 0
+        self.lost = 0
+
+        self.latency = Histogram("latency", "Query latency")
+
+    def receive(self, wait):
+        """Receive replies for up to ``wait`` seconds"""
+
+        ready, _, _ = select([self.sock], [], [], max(wait, 0))
+        while ready:
+            data = self.sock.recv(65535)
+            sent = self.pending.pop(unpack("!H", data[:2])[0], None)
+            if sent is not None:
+                self.answered += 1
+                self.latency.observe(clock() - sent)
+            ready, _, _ = select([self.sock], [], [], 0)
+
+        # Dropped queries (e.g: by the response policy) are lost
+        deadline = clock() - self.args.timeout
+        for id, sent in list(self.pending.items()):
+            if sent < deadline:
+                del self.pending[id]
+                self.lost += 1
+
+    def drain(self):
+        while self.pending:
+            self.receive(0.01)
+
+    def expire(self, seconds):
+        for view in self.server.views:
+            view.cache.expire(seconds)
+
+    def sample(self, start, last):
+        """Return a sample of the interval since ``last``"""
+
+        now = clock()
+        server = self.server
+        elapsed = max(now - last["time"], 1e-6)
+
+        hits, misses = server.nhits.value, server.nmisses.value
+        queries = hits + misses - last["hits"] - last["misses"]
+
+        sample = {
+            "queries": self.sent,
+            "elapsed": round(now - start, 3),
+            "qps": round((self.sent - last["queries"]) / elapsed, 1),
+            "hit_ratio": round(
+                (hits - last["hits"]) / float(queries), 4
+            ) if queries else None,
+            "cache_entries": sum(len(view.cache) for view in server.views),
+            "rss_mb": round(rss() / 1048576.0, 1),
+        }
+
+        last.update(queries=self.sent, time=now, hits=hits, misses=misses)
+
+        return sample
+
+    def run(self, queries):
+        """Replay ``queries`` yielding a sample every ``--interval``"""
+
+        args = self.args
+        start = clock()
+        last = dict(queries=0, time=start, hits=0, misses=0)
+
+        first = now = None
+
+        for i, query in enumerate(queries):
+            if args.limit and i >= args.limit:
+                break
+
+            if query.time is not None:
+                if first is None:
+                    first, now = query.time, int(query.time)
+
+                # Cached answers age by the recorded time
+                if args.expire and int(query.time) > now:
+                    self.drain()
+                    self.expire(int(query.time) - now)
+                    now = int(query.time)
+
+                if args.speed:
+                    due = start + (query.time - first) / args.speed
+                    while clock() < due:
+                        self.receive(due - clock())
+
+            while len(self.pending) >= args.concurrency:
+                self.receive(0.01)
+
+            id = i & 0xFFFF
+            self.pending[id] = clock()
+            self.sock.sendto(pack("!H", id) + query.data[2:], self.address)
+            self.sent += 1
+
+            if self.sent % args.interval == 0:
+                self.receive(0)
+                yield self.sample(start, last)
+
+        self.drain()
+
+        if self.sent % args.interval:
+            yield self.sample(start, last)
+
+    def summary(self, elapsed, baseline):
+        server = self.server
+        hits, misses = server.nhits.value, server.nmisses.value
+
+        return {
+            "queries": self.sent,
+            "answered": self.answered,
+            "lost": self.lost,
+            "elapsed": round(elapsed, 3),
+            "qps": round(self.sent / elapsed, 1) if elapsed else None,
+            "hit_ratio": round(hits / float(hits + misses), 4)
+            if hits + misses else None,
+            "forwarded": server.nforwarded.value,
+            "latency_p50": quantile(self.latency, 0.5),
+            "latency_p99": quantile(self.latency, 0.99),
+            "rss_growth_mb": round((rss() - baseline) / 1048576.0, 1),
+        }
+
+
+FIELDS = (
+    ("queries", "{0:>10}"),
+    ("elapsed", "{0:>9}"),
+    ("qps", "{0:>10}"),
+    ("hit_ratio", "{0:>9}"),
+    ("cache_entries", "{0:>13}"),
+    ("rss_mb", "{0:>8}"),
+)
+
+
+def report(sample, json):
+    if json:
+        print(dumps(sample, sort_keys=True))
+    else:
+        print(" ".join(
+            fmt.format("-" if sample[name] is None else sample[name])
+            for name, fmt in FIELDS
+        ))
+    sys.stdout.flush()
+
+
+def parse_zone(s):
+    name, _, filename = s.partition("=")
+    if not name.endswith("."):
+        name = "{0:s}.".format(name)
+    return name, filename
+
+
+def parse_args(args=None):
+    args = list(sys.argv[1:] if args is None else args)
+
+    # Options following -- are the server's
+    if "--" in args:
+        i = args.index("--")
+        args, server = args[:i], args[i + 1:]
+    else:
+        server = []
+
+    parser = ArgumentParser(
+        formatter_class=ArgumentDefaultsHelpFormatter,
+        description="Replay recorded queries against an in-process server",
+        epilog="options following -- are passed on to the server "
+               "(e.g: -- --cachesize 10000 --min-ttl 30)"
+    )
+
+    add = parser.add_argument
+
+    add(
+        "--version", action="version", version=__version__
+    )
+
+    add(
+        "--zone", action="append", default=[],
+        dest="zones", metavar="NAME=FILE", type=parse_zone,
+        help="serve the zone NAME from the zone FILE (repeatable)"
+    )
+
+    add(
+        "--concurrency", action="store", default=64,
+        dest="concurrency", metavar="N", type=int,
+        help="keep up to N queries pending"
+    )
+
+    add(
+        "--speed", action="store", default=0.0,
+        dest="speed", metavar="FACTOR", type=float,
+        help="replay at FACTOR times the recorded rate (0: no pacing)"
+    )
+
+    add(
+        "--expire", action="store_true", default=False,
+        help="age cached answers by the recorded time between queries"
+    )
+
+    add(
+        "--interval", action="store", default=10000,
+        dest="interval", metavar="N", type=int,
+        help="report a sample every N queries"
+    )
+
+    add(
+        "--limit", action="store", default=0,
+        dest="limit", metavar="N", type=int,
+        help="replay only the first N queries (0: all)"
+    )
+
+    add(
+        "--timeout", action="store", default=1.0,
+        dest="timeout", metavar="SECONDS", type=float,
+        help="count queries unanswered after SECONDS as lost"
+    )
+
+    add(
+        "--upstream-ttl", action="store", default=300,
+        dest="upstream_ttl", metavar="SECONDS", type=int,
+        help="ttl of the upstream answers not recorded"
+    )
+
+    add(
+        "--port", action="store", default=53,
+        dest="port", metavar="PORT", type=int,
+        help="DNS port of the captured traffic"
+    )
+
+    add(
+        "--seed", action="store", default=0,
+        dest="seed", metavar="N", type=int,
+        help="seed of the random numbers (e.g: ttl jitter)"
+    )
+
+    add(
+        "--json", action="store_true", default=False,
+        help="report samples and the summary as JSON lines"
+    )
+
+    add(
+        "file", metavar="FILE", type=str,
+        help="pcap file or query log to replay"
+    )
+
+    args = parser.parse_args(args)
+    args.server = server
+
+    return args
+
+
+def main(args=None):
+    args = parse_args(args)
+
+    logging.basicConfig(
+        format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        level=logging.WARNING
+    )
+    logger = getLogger(__name__)
+
+    seed(args.seed)
+
+    queries, responses = read_queries(args.file, args.port)
+
+    upstream = Upstream(responses, args.upstream_ttl)
+    upstream.start()
+
+    db = MemoryStorage()
+    for name, filename in args.zones:
+        with open(filename) as f:
+            db.load(db.create_zone(name), f)
+
+    server_args = parse_server_args([
+        "--bind", "127.0.0.1:0",
+        "--forward", "{0:s}:{1:d}".format(*upstream.address),
+    ] + args.server)
+
+    server = Server(server_args, db, {}, logger)
+    ready = Ready().register(server)
+
+    if args.expire:
+        # The cache ages by recorded time instead of the server's clock
+        server.expiry.unregister()
+
+    server.start()
+    if not ready.flag.wait(5):
+        raise SystemExit("Server did not start")
+
+    # The harness' own memory (recorded responses) is not growth
+    baseline = rss()
+
+    address = server.transport.host, server.transport.port
+    replay = Replay(server, address, args)
+
+    if not args.json:
+        print(" ".join(
+            fmt.format(name) for name, fmt in FIELDS
+        ))
+
+    start = clock()
+    try:
+        for sample in replay.run(queries):
+            report(sample, args.json)
+    finally:
+        elapsed = clock() - start
+        server.stop()
+        upstream.stop()
+
+    summary = replay.summary(elapsed, baseline)
+    summary.update(
+        recorded=upstream.recorded, synthesized=upstream.synthesized
+    )
+
+    if args.json:
+        print(dumps(dict(summary, summary=True), sort_keys=True))
+    else:
+        print()
+        for name in sorted(summary):
+            print("{0:s}: {1}".format(name, summary[name]))
+
+
+if __name__ == "__main__":
+    main()
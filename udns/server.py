@@ -5,48 +5,92 @@ from __future__ import print_function
 
 
 import logging
-from time import sleep
 from os import environ, path
+from random import randint
+from signal import signal, SIGUSR1
 from logging import getLogger
 from collections import defaultdict
-from socket import AF_INET, SOCK_STREAM, socket
+from socket import create_connection, gethostbyname, error as SocketError
 from argparse import ArgumentParser, ArgumentDefaultsHelpFormatter, FileType
 
 
-from cachetools import LRUCache
-
-from dnslib import DNSQuestion, DNSRecord
-from dnslib import A, AAAA, CLASS, QR, QTYPE, RR
+from dnslib import DNSError, DNSQuestion, DNSRecord, EDNS0
+from dnslib import A, AAAA, CLASS, QTYPE, RCODE, RR
 
 from circuits.app import Daemon
 from circuits.net.events import write
-from circuits.net.sockets import UDPServer
-from circuits import Component, Debugger, Event, Timer
-
-from redisco import connection_setup, get_client
+from circuits.net.sockets import TCPServer, UDPServer
+from circuits import handler, task, Component, Debugger, Event, Timer, Worker
 
 
+from . import xfr
+from . import answers
+from . import tsig
+from . import update as updates
 from . import __version__
-from .models import Record
+from .cache import Cache
+from .views import load_views, View, Views
+from .forwarders import load_forwarders, parse_servers, valid_ttls
+from .forwarders import Forwarder, Forwarders
+from .policy import Policy, DROP, NODATA, NXDOMAIN, PASSTHRU
+from .batch import absolute
+from .storage import Entry, MemoryStorage, RedisStorage, SQLiteStorage
+from .stats import clock, Stats
+from .querylog import QueryLog
+from .tracing import NullTracer, Sampler, Tracer
+from .protocol import DNS, Peer, StreamDNS
+
+
+class ttl(Event):
+    """ttl Event"""
+
+
+class lookup(Event):
+    """lookup Event"""
+
+
+class resolved(Event):
+    """resolved Event"""
+
+
+class transfer(Event):
+    """transfer Event"""
+
+
+class transferred(Event):
+    """transferred Event"""
+
+
+class update(Event):
+    """update Event"""
 
 
-CNAME = QTYPE.reverse["CNAME"]
+class updated(Event):
+    """updated Event"""
 
 
-class request(Event):
-    """request Event"""
+class refresh(Event):
+    """refresh Event"""
 
 
-class response(Event):
-    """response Event"""
+class refreshed(Event):
+    """refreshed Event"""
 
 
-class DNS(Component):
+class check(Event):
+    """check Event"""
 
-    def read(self, peer, data):
-        record = DNSRecord.parse(data)
-        event = request if record.header.qr == QR.QUERY else response
-        return self.fire(event(peer, record))
+
+class checked(Event):
+    """checked Event"""
+
+
+class reload(Event):
+    """reload Event"""
+
+
+class attach(Event):
+    """attach Event"""
 
 
 class Server(Component):
@@ -61,11 +105,69 @@ class Server(Component):
         self.logger = logger
 
         self.bind = args.bind
-        self.forward = args.forward
+
+        self.forwarders = Forwarders(Forwarder(
+            ".", args.forward, args.min_ttl, args.max_ttl, args.ttl_jitter
+        ))
+        for zone, servers, min_ttl, max_ttl in args.forwarders or ():
+            self.forwarders.add(Forwarder(
+                zone, servers,
+                args.min_ttl if min_ttl is None else min_ttl,
+                args.max_ttl if max_ttl is None else max_ttl,
+                args.ttl_jitter
+            ))
+
+        # Upstream servers by (host, port) to the address replies come from
+        self.addresses = dict(
+            (server, (address_of(server[0]), server[1]))
+            for forwarder in self.forwarders for server in forwarder.servers
+        )
 
         self.peers = {}
         self.requests = {}
-        self.cache = LRUCache(maxsize=args.cachesize)
+        self.upstreams = {}
+        self.servers = {}
+        self.attempts = {}
+        self.timestamps = {}
+        self.lookups = defaultdict(lambda: defaultdict(list))
+        self.cache = Cache(args.cachesize, args.cacheshards)
+
+        self.views = Views(View("default", db, hosts, self.cache))
+        for name, networks, dbfile, hostsfile in args.views or ():
+            self.views.add(View(
+                name,
+                SQLiteStorage(dbfile) if dbfile else db,
+                parse_hosts(hostsfile) if hostsfile else hosts,
+                Cache(args.cachesize, args.cacheshards),
+                networks
+            ))
+
+        self.serials = None
+        self.keys = dict((key.name, key) for key in args.tsig_keys)
+        self.replicas = MemoryStorage()
+        self.secondaries = dict(args.secondaries)
+        self.primaries = dict(
+            (zone, address_of(host))
+            for zone, (host, port) in self.secondaries.items()
+        )
+        self.refreshing = {}
+
+        self.policy = Policy(args.policy) if args.policy else None
+
+        self.setup_stats()
+
+        if args.profile:
+            self.tracer = Tracer(self.stats)
+            self.sampler = Sampler()
+            self.sampler.start()
+            signal(SIGUSR1, self._on_sigusr1)
+        else:
+            self.tracer = NullTracer()
+
+        self.querylog = QueryLog(
+            args.querylog, sample=args.querylog_sample,
+            size=args.querylog_size
+        )
 
         if args.daemon:
             Daemon(args.pidfile).register(self)
@@ -76,28 +178,255 @@ class Server(Component):
         self.transport = UDPServer(
             self.bind, channel=self.channel
         ).register(self)
-        self.protocol = DNS(channel=self.channel).register(self)
+        self.protocol = DNS(self.tracer, channel=self.channel).register(self)
+
+        self.stream = TCPServer(self.bind, channel="tcp").register(self)
+        StreamDNS(
+            self.tracer, target=self.channel, channel="tcp"
+        ).register(self)
+
+        self.worker = Worker(
+            workers=args.dbworkers, channel="db"
+        ).register(self)
+
+        # Cached answers count down their ttls and expire once a second
+        self.expiry = Timer(
+            1, ttl(), persist=True, channel=self.channel
+        ).register(self)
+
+        if self.policy is not None:
+            # Policies are reloaded without holding up database lookups
+            Worker(workers=1, channel="policy").register(self)
+
+        # circuits.web and ssl are only imported by the servers using them
+
+        if args.tls:
+            from .tls import create_context, TLSServer
+
+            context = create_context(args.certfile, args.keyfile, ["dot"])
+            self.tls = TLSServer(args.tls, context, channel="tls")
+            self.tls.register(self)
+            StreamDNS(
+                self.tracer, target=self.channel, channel="tls"
+            ).register(self)
+
+        if args.https:
+            from .web import DNSQuery
+            from .tls import create_context, HTTPSServer
+
+            context = create_context(
+                args.certfile, args.keyfile, ["http/1.1"]
+            )
+            self.https = HTTPSServer(args.https, context).register(self)
+            DNSQuery(self.tracer, self.channel).register(self.https)
+
+        if args.metrics:
+            from .web import Metrics
+            from circuits.web import Server as WebServer
+
+            self.web = WebServer(args.metrics, channel="web").register(self)
+            Metrics(self.stats).register(self.web)
+
+        if args.control:
+            from .web import Control
+            from circuits.web import Server as WebServer
+
+            self.control = WebServer(
+                args.control, channel="control"
+            ).register(self)
+            Control(self, args.control_token).register(self.control)
+
+    def setup_stats(self):
+        self.stats = stats = Stats()
+
+        self.nqueries = stats.counter(
+            "queries_total", "Total queries received"
+        )
+        self.nhits = stats.counter(
+            "cache_hits_total", "Queries answered from the cache"
+        )
+        self.nmisses = stats.counter(
+            "cache_misses_total", "Queries not found in the cache"
+        )
+        self.nhosts = stats.counter(
+            "hosts_answers_total", "Queries answered from the hosts file"
+        )
+        self.nauthoritative = stats.counter(
+            "authoritative_answers_total", "Queries answered from local zones"
+        )
+        self.nforwarded = stats.counter(
+            "forwarded_total", "Queries forwarded upstream"
+        )
+        self.nresponses = stats.counter(
+            "responses_total", "Upstream responses received"
+        )
+        self.nunknown = stats.counter(
+            "unknown_responses_total", "Upstream responses with no request"
+        )
+        self.ntimeouts = stats.counter(
+            "upstream_timeouts_total", "Forwarded requests timed out"
+        )
+        self.noverflows = stats.counter(
+            "pending_overflows_total",
+            "Queries refused with too many forwarded requests pending"
+        )
+        self.ntransfers = stats.counter(
+            "transfers_total", "Zone transfers served"
+        )
+        self.nnotifies = stats.counter(
+            "notifies_total", "NOTIFY messages received"
+        )
+        self.nupdates = stats.counter(
+            "updates_total", "Dynamic updates applied"
+        )
+        self.npolicy = stats.counter(
+            "policy_answers_total", "Queries answered by the response policy"
+        )
+
+        stats.gauge(
+            "pending_requests", "Forwarded requests awaiting a response",
+            lambda: len(self.peers)
+        )
+        stats.gauge(
+            "cache_entries", "Entries held in the cache",
+            lambda: sum(len(view.cache) for view in self.views)
+        )
+        stats.gauge(
+            "policy_rules", "Triggers of the response policy",
+            lambda: len(self.policy) if self.policy is not None else 0
+        )
+        stats.gauge(
+            "querylog_dropped", "Query log records dropped on overflow",
+            lambda: self.querylog.dropped
+        )
+
+        self.upstream_rtt = stats.histogram(
+            "upstream_rtt_seconds", "Round trip time of forwarded requests"
+        )
+        self.database_latency = stats.histogram(
+            "database_latency_seconds", "Latency of batched database lookups"
+        )
+        self.database_batch = stats.histogram(
+            "database_batch_size", "Names per batched database lookup",
+            (1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+        )
 
     def ready(self, server, bind):
         self.logger.info(
             "DNS Server Ready! Listening on {0:s}:{1:d}".format(*bind)
         )
 
-        # Timer(1, Event.create("ttl"), persist=True, channel=self.channel).register(self)
+        if self.db is None:
+            self.fire(attach())
+
+        if self.secondaries:
+            self.fire(refresh())
+            Timer(
+                self.args.refresh, refresh(), persist=True,
+                channel=self.channel
+            ).register(self)
+
+        if self.args.notify:
+            Timer(
+                self.args.notify_interval, check(), persist=True,
+                channel=self.channel
+            ).register(self)
+
+        if self.policy is not None:
+            Timer(
+                self.args.policy_reload, reload(), persist=True,
+                channel=self.channel
+            ).register(self)
+
+    @handler("stopped", channel="*")
+    def _on_stopped(self, manager):
+        self.querylog.stop()
+
+    def _on_sigusr1(self, signum, frame):
+        prefix = self.args.profile_output
+
+        with open("{0:s}.folded".format(prefix), "w") as f:
+            self.sampler.dump(f)
+
+        with open("{0:s}.stages".format(prefix), "w") as f:
+            f.write(self.tracer.summary())
+            f.write("\n")
+
+        self.logger.info(
+            "Profile written to {0:s}.{{folded,stages}}".format(prefix)
+        )
+
+    def send(self, peer, reply):
+        start = self.tracer.clock()
+        if isinstance(peer, Peer):
+            data = reply.pack()
+        else:
+            # UDP replies are limited to the payload size of the client
+            # (offered back in the reply's OPT record)
+            data = answers.truncate(reply, answers.payload(reply))
+        self.tracer.record("pack", start)
+
+        context = getattr(reply, "tsig", None)
+        if context is not None:
+            data = context.sign(data)
+
+        if isinstance(peer, Peer):
+            peer.reply(self, reply, data)
+        else:
+            self.fire(write(peer, data))
 
     def ttl(self):
-        for k, rrs in self.cache.items()[:]:
-            if any(rr.ttl == 0 for rr in rrs):
-                qname, qtype, qclass = k
-                self.logger.info(
-                    "Expired Entry: {0:s} {1:s} {2:s}".format(
-                        CLASS.get(qclass), QTYPE.get(qtype), qname
-                    )
+        for view in self.views:
+            expired = view.cache.expire()
+            if expired:
+                self.logger.debug(
+                    "Expired {0:d} cache entries".format(len(expired))
                 )
-                del self.cache[k]
-            else:
-                for rr in rrs:
-                    rr.ttl -= 1
+
+        self._retry()
+
+    def _retry(self):
+        """Retry forwarded requests left unanswered (on the next server)
+
+        Requests every server of their forwarder failed to answer within
+        ``--upstream-timeout`` seconds are answered with SERVFAIL.
+        """
+
+        deadline = clock() - self.args.upstream_timeout
+
+        for id, timestamp in list(self.timestamps.items()):
+            if timestamp > deadline:
+                continue
+
+            self.ntimeouts.inc()
+
+            request = self.requests[id]
+            servers = self.upstreams[id].servers
+
+            if self.attempts[id] < len(servers):
+                i = servers.index(self.servers[id])
+                server = servers[(i + 1) % len(servers)]
+
+                self.servers[id] = server
+                self.attempts[id] += 1
+                self.timestamps[id] = clock()
+
+                self.fire(write(server, upstream_query(request, id).pack()))
+                continue
+
+            reply = request.reply()
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(self.peers[id], reply)
+
+            self._forget(id)
+
+    def _forget(self, id):
+        del self.peers[id]
+        del self.requests[id]
+        del self.upstreams[id]
+        del self.servers[id]
+        del self.attempts[id]
+        del self.timestamps[id]
 
     def request(self, peer, request):
         qname = str(request.q.qname)
@@ -106,30 +435,78 @@ class Server(Component):
 
         key = (qname, qtype, qclass)
 
-        if key in self.cache:
-            self.logger.info(
-                "Cached Request ({0:s}): {1:s} {2:s} {3:s}".format(
-                    "{0:s}:{1:d}".format(*peer),
-                    CLASS.get(qclass), QTYPE.get(qtype), qname
-                )
-            )
+        self.nqueries.inc()
+
+        if request.header.opcode == xfr.NOTIFY:
+            self.notified(peer, request)
+            return
+
+        if request.header.opcode == updates.UPDATE:
+            self.fire(update(peer, request))
+            return
+
+        if qtype in (xfr.AXFR, xfr.IXFR):
+            self.fire(transfer(peer, request))
+            return
+
+        start = self.tracer.record("dispatch", request.received)
+
+        view = request.view = self.views.match(peer[0])
+
+        policy = self.policy
+        action = policy.match(qname) if policy is not None else None
+        start = self.tracer.record("policy", start)
+
+        if action is not None and action.kind != PASSTHRU:
+            self.npolicy.inc()
+
+            self.querylog.log("policy", peer, qname, qtype, qclass)
+
+            if action.kind == DROP:
+                return
 
             reply = request.reply()
-            for rr in self.cache[key]:
-                reply.add_answer(rr)
-            self.fire(write(peer, reply.pack()))
+            if action.kind == NXDOMAIN:
+                reply.header.rcode = RCODE.NXDOMAIN
+            elif action.kind != NODATA:
+                reply.add_answer(*policy.answer(action, qname, qtype, qclass))
+            reply.add_ar(*answers.edns(request))
+            self.send(peer, reply)
             return
 
-        if key in self.hosts:
-            self.logger.info(
-                "Local Hosts Request ({0:s}): {1:s} {2:s} {3:s}".format(
-                    "{0:s}:{1:d}".format(*peer),
-                    CLASS.get(qclass), QTYPE.get(qtype), qname
-                )
+        cached = view.cache.get(key)
+        start = self.tracer.record("cache", start)
+
+        if cached is not None:
+            self.nhits.inc()
+
+            self.querylog.log("cached", peer, qname, qtype, qclass)
+
+            rr, auth = answers.sections(
+                cached, qtype, answers.dnssec_ok(request), qname
             )
 
             reply = request.reply()
-            for rdata in self.hosts[key]:
+            reply.add_answer(*rr)
+            reply.add_auth(*auth)
+            if not self.args.minimal_responses:
+                reply.add_ar(*self.glue(rr, cache=view.cache))
+            reply.add_ar(*answers.edns(request))
+            self.send(peer, reply)
+            return
+
+        self.nmisses.inc()
+
+        hosted = key in view.hosts
+        start = self.tracer.record("hosts", start)
+
+        if hosted:
+            self.nhosts.inc()
+
+            self.querylog.log("hosts", peer, qname, qtype, qclass)
+
+            reply = request.reply()
+            for rdata in view.hosts[key]:
                 rr = RR(
                     qname,
                     rclass=CLASS.IN,
@@ -138,54 +515,535 @@ class Server(Component):
                 )
                 reply.add_answer(rr)
 
-            self.cache[key] = rr
+            view.cache[key] = reply.rr
+
+            reply.add_ar(*answers.edns(request))
 
-            self.fire(write(peer, reply.pack()))
+            self.send(peer, reply)
 
             return
 
-        records = Record.objects.filter(rname=qname)
+        if self.secondaries and view.db is self.db:
+            records = self.replicas.resolve([qname]).get(qname)
+            if records:
+                names = answers.targets([record.rr for record in records])
+                local = self.replicas.find_records(names) if names else {}
+                soa = authorities(
+                    self.replicas, {qname: [(qtype, qclass)]},
+                    {qname: records}
+                ).get(qname)
+                self.answer(peer, request, records, local, soa)
+                return
+
+        if view.db is None:
+            # The database is not attached yet
+            reply = request.reply()
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(peer, reply)
+            return
 
-        if not records:
+        lookups = self.lookups[view]
+
+        if not lookups:
+            self.fire(lookup(view))
+
+        lookups[qname].append((peer, request))
+
+    def lookup(self, view):
+        lookups = self.lookups.pop(view, {})
+
+        self.database_batch.observe(len(lookups))
+
+        # The results come back as an event (fired from the worker thread)
+        # rather than to a waiting generator: circuits only steps those once
+        # per tick, idling up to 0.1s between steps.
+        questions = dict(
+            (qname, set((r.q.qtype, r.q.qclass) for peer, r in requests))
+            for qname, requests in lookups.items()
+        )
+
+        glue = not self.args.minimal_responses
+        self.worker.pool.apply_async(
+            fetch, (view.db, questions, glue, clock()),
+            callback=lambda result: self.fire(resolved(lookups, *result))
+        )
+
+    def resolved(self, lookups, results, local, soas, error, start):
+        self.database_latency.observe(clock() - start)
+        self.tracer.record("database", start)
+
+        if error is not None:
+            self.logger.error(
+                "Database lookup failed: {0:s}".format(repr(error))
+            )
+
+            # Without the database it is not known whether the names are
+            # local so they are not relayed upstream either
+            for requests in lookups.values():
+                for peer, request in requests:
+                    reply = request.reply()
+                    reply.header.rcode = RCODE.SERVFAIL
+                    self.send(peer, reply)
+            return
+
+        for qname, requests in lookups.items():
+            records = results.get(qname)
+            for peer, request in requests:
+                if records:
+                    self.answer(
+                        peer, request, records, local, soas.get(qname)
+                    )
+                else:
+                    self.relay(peer, request)
+
+    def notified(self, peer, request):
+        zone = str(request.q.qname)
+
+        self.nnotifies.inc()
+
+        reply = request.reply()
+        reply.header.opcode = xfr.NOTIFY
+
+        if zone not in self.secondaries:
+            reply.header.rcode = RCODE.REFUSED
+        elif peer[0] != self.primaries[zone]:
+            # Only the primary may NOTIFY a change (RFC 1996 3.10)
+            self.logger.warning(
+                "NOTIFY for {0:s} from {1:s} refused".format(zone, peer[0])
+            )
+            reply.header.rcode = RCODE.REFUSED
+        else:
+            self.logger.info("NOTIFY received for {0:s}".format(zone))
+            self.fire(refresh(zone))
+
+        self.send(peer, reply)
+
+    def transfer(self, peer, request):
+        qname = str(request.q.qname)
+
+        reply = request.reply()
+
+        if not isinstance(peer, Peer):
+            # Zone transfers are only served over TCP (RFC 5936 4.2)
+            reply.header.tc = 1
+            self.send(peer, reply)
+            return
+
+        allowed = self.args.allow_transfer
+        if allowed and peer[0] not in allowed:
+            reply.header.rcode = RCODE.REFUSED
+            self.send(peer, reply)
+            return
+
+        serial = None
+        if request.q.qtype == xfr.IXFR and request.auth:
+            serial = xfr.serial_of(request.auth[0])
+
+        if qname in self.secondaries:
+            rrs = xfr.records(self.replicas, qname, serial)
+            self.transferred(peer, request, rrs, None)
+        elif self.db is None:
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(peer, reply)
+        else:
+            self._submit(
+                transferred, (peer, request),
+                xfr.records, self.db, qname, serial
+            )
+
+    def transferred(self, peer, request, rrs, error):
+        qname = str(request.q.qname)
+
+        reply = request.reply()
+
+        if error is not None:
+            self.logger.error(
+                "Zone transfer failed: {0:s}".format(repr(error))
+            )
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(peer, reply)
+            return
+
+        if rrs is None:
+            reply.header.rcode = RCODE.NOTAUTH
+            self.send(peer, reply)
+            return
+
+        self.ntransfers.inc()
+
+        self.logger.info(
+            "{0:s} of {1:s} to {2:s}:{3:d} ({4:d} records)".format(
+                QTYPE.get(request.q.qtype), qname, peer[0], peer[1], len(rrs)
+            )
+        )
+
+        for reply in xfr.messages(request, rrs):
+            self.send(peer, reply)
+
+    def update(self, peer, request):
+        reply = request.reply()
+
+        try:
+            context = tsig.verify(request.wire, self.keys)
+        except DNSError:
+            reply.header.rcode = RCODE.FORMERR
+            self.send(peer, reply)
+            return
+
+        reply.tsig = context
+
+        if context is None:
+            # Only updates signed with one of our keys are accepted
+            reply.header.rcode = RCODE.REFUSED
+            self.send(peer, reply)
+            return
+
+        if context.error:
+            reply.header.rcode = RCODE.NOTAUTH
+            self.send(peer, reply)
+            return
+
+        if len(request.questions) != 1 or request.q.qtype != QTYPE.SOA:
+            reply.header.rcode = RCODE.FORMERR
+            self.send(peer, reply)
+            return
+
+        zone = str(request.q.qname)
+
+        if zone in self.secondaries:
+            reply.header.rcode = RCODE.NOTAUTH
+            self.send(peer, reply)
+            return
+
+        db = self.views.match(peer[0]).db
+
+        if db is None:
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(peer, reply)
+            return
+
+        self._submit(
+            updated, (peer, reply, zone),
+            updates.apply, db, zone, request.rr, request.auth
+        )
+
+    def updated(self, peer, reply, zone, result, error):
+        if error is not None:
+            self.logger.error(
+                "Update of {0:s} failed: {1:s}".format(zone, repr(error))
+            )
+            reply.header.rcode = RCODE.SERVFAIL
+        else:
+            rcode, names = result
+            reply.header.rcode = rcode
+            if rcode == RCODE.NOERROR:
+                self.nupdates.inc()
+                self.invalidate(names)
+
+        self.send(peer, reply)
+
+    def invalidate(self, names):
+        """Remove cached answers of (or through CNAMEs to) ``names``"""
+
+        for view in self.views:
+            view.cache.evict(
+                lambda key, rrs: key[0] in names or any(
+                    str(rr.rname) in names for rr in rrs
+                )
+            )
+
+    def purge(self, name=None, suffix=None):
+        """Remove the cached answers of ``name`` or of names under ``suffix``
+
+        Returns the removed keys.
+        """
+
+        name = name and absolute(name).lower()
+        suffix = suffix and absolute(suffix).lower()
+
+        def matches(key, rrs):
+            qname = key[0].lower()
+            if qname == name:
+                return True
+            if suffix is not None:
+                return qname == suffix or qname.endswith("." + suffix)
+            return False
+
+        removed = []
+        for view in self.views:
+            removed.extend(view.cache.evict(matches))
+
+        self.logger.info(
+            "Flushed {0:d} cache entries ({1:s})".format(
+                len(removed), name or "*.{0:s}".format(suffix)
+            )
+        )
+
+        return removed
+
+    def refresh(self, *zones):
+        for zone in zones or sorted(self.secondaries):
+            if zone in self.refreshing:
+                # One transfer per zone at a time, followed by another if
+                # asked again meanwhile (e.g: a burst of NOTIFYs)
+                self.refreshing[zone] = True
+                continue
+
+            self.refreshing[zone] = False
+
+            host, port = self.secondaries[zone]
+
+            local = self.replicas.get_zone(zone)
+            serial = local.serial if local is not None else None
+
+            # Zones are transferred concurrently (one per worker)
+            self._submit(
+                refreshed, (zone, host, port),
+                xfr.transfer, host, port, zone, serial
+            )
+
+    def refreshed(self, zone, host, port, result, error):
+        if self.refreshing.pop(zone, False):
+            self.fire(refresh(zone))
+
+        if error is not None:
+            self.logger.error(
+                "Zone transfer of {0:s} from {1:s}:{2:d} failed: "
+                "{3:s}".format(zone, host, port, repr(error))
+            )
+            return
+
+        kind, soa, data = result
+
+        self.invalidate(xfr.apply(self.replicas, zone, result))
+
+        if kind != "current":
             self.logger.info(
-                "Request ({0:s}): {1:s} {2:s} {3:s} -> {4:s}:{5:d}".format(
-                    "{0:s}:{1:d}".format(*peer),
-                    CLASS.get(qclass), QTYPE.get(qtype), qname,
-                    self.forward, 53
+                "{0:s} of {1:s} from {2:s}:{3:d} (serial {4:d})".format(
+                    kind.upper(), zone, host, port, xfr.serial_of(soa)
                 )
             )
 
-            lookup = DNSRecord(q=DNSQuestion(qname, qtype, qclass))
-            id = lookup.header.id
-            self.peers[id] = peer
-            self.requests[id] = request
+    def attach(self, attempt=0):
+        """Attach the (Redis) database once it is reachable
+
+        Until then the hosts file and the cache are served and queries
+        needing the database are answered with SERVFAIL.
+        """
+
+        host, port = self.args.dbhost, self.args.dbport
+
+        if not attempt:
+            self.logger.info(
+                "Waiting for Redis on {0:s}:{1:d} ...".format(host, port)
+            )
+
+        value = yield self.call(task(connect, host, port), "db")
+
+        if value.errors or value.value is None:
+            Timer(1, attach(attempt + 1), channel=self.channel).register(self)
+            return
+
+        self.db = value.value
+        for view in self.views:
+            if view.db is None:
+                view.db = self.db
+
+        self.logger.info(
+            "Connected to Redis on {0:s}:{1:d}".format(host, port)
+        )
+
+    def reload(self):
+        """Reload the response policy if any of its files changed
+
+        The new policy is built by the policy worker and swapped in when
+        complete; queries are answered by the old policy until then.
+        """
+
+        if not self.policy.changed():
+            return
 
-            self.fire(write((self.forward, 53), lookup.pack()))
+        filenames = self.policy.filenames
+        value = yield self.call(task(Policy, filenames), "policy")
 
+        if value.errors:
+            etype, evalue, traceback = value.value
+            self.logger.error(
+                "Response policy reload failed: {0:s}".format(repr(evalue))
+            )
             return
 
+        self.policy = value.value
+
         self.logger.info(
-            "Authoritative Request ({0:s}): {1:s} {2:s} {3:s}".format(
-                "{0:s}:{1:d}".format(*peer),
-                CLASS.get(qclass), QTYPE.get(qtype), qname
+            "Response policy reloaded ({0:d} triggers)".format(
+                len(self.policy)
             )
         )
 
-        rr = []
-        reply = request.reply()
+    def check(self):
+        if self.db is None:
+            return
+
+        self._submit(checked, (), self.db.serials)
+
+    def checked(self, serials, error):
+        if error is not None:
+            return
+
+        previous = self.serials
+        self.serials = serials
+
+        if previous is None:
+            return
+
+        for zone, serial in serials.items():
+            if previous.get(zone) == serial:
+                continue
+
+            data = xfr.notify(zone).pack()
+            for target in self.args.notify:
+                self.fire(write(target, data))
+
+    def _submit(self, done, context, f, *args):
+        """Run ``f(*args)`` on the database worker pool
+
+        ``done(*context + (value, error))`` is fired (from the worker
+        thread) when it returns. Unlike yielding ``self.call(task(...))``
+        this does not wait on circuits' task polling (up to 0.1s a step).
+        """
 
-        if len(records) == 1 and records[0].rtype == CNAME:
-            rr.append(records[0].rr)
-            records = Record.objects.filter(rname=records[0].rdata)
+        self.worker.pool.apply_async(
+            call, (f,) + args,
+            callback=lambda result: self.fire(done(*(context + result)))
+        )
+
+    def answer(self, peer, request, records, local=None, soa=None):
+        """Answer ``request`` from the ``records`` of its name
+
+        ``soa`` holds the SOA record (and RRSIGs) of the zone the answer
+        is from, added to negative answers.
+        """
+
+        qname = str(request.q.qname)
+        qtype = request.q.qtype
+        qclass = request.q.qclass
 
-        for record in records:
-            rr.append(record.rr)
+        self.querylog.log("authoritative", peer, qname, qtype, qclass)
 
+        self.nauthoritative.inc()
+
+        # No records of the type is an empty (NODATA) answer
+        selected = [
+            record.rr for record in answers.select(records, qtype, qclass)
+        ]
+
+        nxdomain = bool(soa) and answers.nxdomain(qname, records)
+        if soa and (nxdomain or answers.nodata(records, qtype, qclass)):
+            selected.extend(answers.negative([record.rr for record in soa]))
+
+        cache = request.view.cache
+        if not nxdomain:
+            # The cache holds no rcodes (and only serves NOERROR answers)
+            cache[(qname, qtype, qclass)] = selected
+
+        # Precomputed signatures only go to clients asking for them
+        rr, auth = answers.sections(
+            selected, qtype, answers.dnssec_ok(request), qname
+        )
+
+        reply = request.reply()
+        if nxdomain:
+            reply.header.rcode = RCODE.NXDOMAIN
         reply.add_answer(*rr)
+        reply.add_auth(*auth)
+
+        if not self.args.minimal_responses:
+            reply.add_ar(*self.glue(rr, local, cache))
+
+        reply.add_ar(*answers.edns(request))
+
+        self.send(peer, reply)
+
+    def glue(self, rrs, local=None, cache=None):
+        """Return the addresses of the MX, NS and SRV targets of ``rrs``
+
+        Taken from ``local`` (records by name) or else from the ``cache``
+        (of the view).
+        """
+
+        cache = self.cache if cache is None else cache
+
+        names = answers.targets(rrs)
+        if not names:
+            return []
+
+        local = local or {}
+        rrs = answers.glue(names, local)
+        found = set(str(rr.rname) for rr in rrs)
+
+        # Cached too, for the answers served from the cache. Entries are
+        # selected from all records of the name as for a query of their
+        # own (RRSIGs included); types without data are left to a query
+        # (for their negative answer).
+        for name in found:
+            for rtype in answers.ADDRESSES:
+                key = (name, rtype, CLASS.IN)
+                records = local[name]
+                if key not in cache and \
+                        not answers.nodata(records, rtype, CLASS.IN):
+                    cache[key] = [
+                        record.rr for record in
+                        answers.select(records, rtype, CLASS.IN)
+                    ]
+
+        for name in names:
+            if name in found:
+                continue
+            for rtype in answers.ADDRESSES:
+                rrs.extend(
+                    rr for rr in cache.get((name, rtype, CLASS.IN), ())
+                    if rr.rtype == rtype
+                )
+
+        return rrs
+
+    def relay(self, peer, request):
+        qname = str(request.q.qname)
+        qtype = request.q.qtype
+        qclass = request.q.qclass
+
+        if len(self.peers) >= self.args.max_pending:
+            # Upstream servers are not keeping up (or are down)
+            self.noverflows.inc()
+            reply = request.reply()
+            reply.header.rcode = RCODE.SERVFAIL
+            self.send(peer, reply)
+            return
+
+        self.nforwarded.inc()
+
+        forwarder = self.forwarders.match(qname)
+        server = forwarder.server()
+
+        self.querylog.log("forwarded", peer, qname, qtype, qclass, server)
+
+        lookup = upstream_query(request)
+
+        # Pending ids must be unique (as there are fewer than 65536 of them
+        # a free one is found)
+        while lookup.header.id in self.peers:
+            lookup.header.id = randint(0, 0xFFFF)
 
-        self.cache[key] = rr
+        id = lookup.header.id
+        self.peers[id] = peer
+        self.requests[id] = request
+        self.upstreams[id] = forwarder
+        self.servers[id] = server
+        self.attempts[id] = 1
+        self.timestamps[id] = clock()
 
-        self.fire(write(peer, reply.pack()))
+        self.fire(write(server, lookup.pack()))
 
     def response(self, peer, response):
         id = response.header.id
@@ -194,66 +1052,229 @@ class Server(Component):
         qtype = response.q.qtype
         qclass = response.q.qclass
 
-        if id not in self.peers:
-            self.logger.info(
-                "Unknown Response ({0:s}): {1:s} {2:s} {3:s}".format(
-                    "{0:s}:{1:d}".format(*peer),
-                    CLASS.get(qclass), QTYPE.get(qtype), qname
-                )
-            )
+        if response.header.opcode == xfr.NOTIFY:
+            return
+
+        # Only a response from the server asked (to the question asked) is
+        # accepted; anything else may be spoofed (and would be cached)
+        if id not in self.peers or \
+                tuple(peer[:2]) != self.addresses[self.servers[id]] or \
+                not same_question(response, self.requests[id]):
+            self.nunknown.inc()
+
+            self.querylog.log("unknown", peer, qname, qtype, qclass)
 
             return
 
+        self.nresponses.inc()
+        self.upstream_rtt.observe(clock() - self.timestamps[id])
+
         peer = self.peers[id]
         request = self.requests[id]
 
-        key = (str(request.q.qname), request.q.qtype, request.q.qclass)
+        qname = str(request.q.qname)
+        qtype = request.q.qtype
+        qclass = request.q.qclass
+
+        rcode = response.header.rcode
+        rrs = list(response.rr)
+
+        if rcode in (RCODE.NOERROR, RCODE.NXDOMAIN) and qtype != answers.ANY \
+                and answers.nodata(rrs, qtype, qclass):
+            # Negative answers keep the SOA (and NSEC proofs) of the zone
+            rrs.extend(rr for rr in response.auth if answers.negated(rr))
+
+        if rcode == RCODE.NOERROR and rrs:
+            # Cached with their RRSIGs (if any) for clients setting DO;
+            # NODATA with its SOA (so it expires by the negative ttl)
+            key = (qname, qtype, qclass)
+            request.view.cache[key] = self.upstreams[id].clamp(rrs)
+
+        dnssec = answers.dnssec_ok(request)
+        rr, auth = answers.sections(rrs, qtype, dnssec, qname)
 
         reply = request.reply()
+        reply.header.rcode = rcode
 
-        reply.add_answer(*response.rr)
+        reply.add_answer(*rr)
+        reply.add_auth(*auth)
 
-        self.cache[key] = reply.rr
+        if not self.args.minimal_responses:
+            reply.add_ar(*(
+                record for record in response.ar
+                if record.rtype != answers.OPT and
+                (dnssec or record.rtype not in answers.DNSSEC)
+            ))
 
-        self.fire(write(peer, reply.pack()))
+        reply.add_ar(*answers.edns(request))
 
-        del self.peers[id]
-        del self.requests[id]
+        self.send(peer, reply)
+
+        self._forget(id)
+
+
+def upstream_query(request, id=None):
+    """Return the query forwarding ``request`` upstream (with ``id``)
+
+    Signatures are asked for (DO) to cache them along with the answers.
+    """
+
+    q = request.q
+
+    lookup = DNSRecord(
+        q=DNSQuestion(q.qname, q.qtype, q.qclass),
+        ar=[EDNS0(flags="do", udp_len=answers.PAYLOAD)]
+    )
+
+    if id is not None:
+        lookup.header.id = id
+
+    return lookup
+
+
+def same_question(response, request):
+    """Return whether ``response`` answers the question of ``request``"""
+
+    return bool(response.questions) and \
+        str(response.q.qname).lower() == str(request.q.qname).lower() and \
+        response.q.qtype == request.q.qtype and \
+        response.q.qclass == request.q.qclass
+
+
+def call(f, *args):
+    """Return ``(f(*args), None)`` or ``(None, error)`` if it raised"""
+
+    try:
+        return f(*args), None
+    except Exception as error:
+        return None, error
+
+
+def authority(db, name):
+    """Return the SOA record (and its RRSIGs) of the zone of ``name``
+
+    Zones without a SOA record get one synthesized (see
+    :meth:`~udns.storage.Storage.soa`). Names in no zone get none.
+    """
+
+    zone = db.find_zone(name)
+    if zone is None:
+        return []
+
+    records = [
+        record for record in db.stamp(db.find_records([zone.name])[zone.name])
+        if record.rtype == QTYPE.SOA or (
+            record.rtype == QTYPE.RRSIG and
+            answers.covered(record) == QTYPE.SOA
+        )
+    ]
+
+    if not any(record.rtype == QTYPE.SOA for record in records):
+        records = [Entry.from_rr(db.soa(zone))]
+
+    return records
+
+
+def authorities(db, questions, results):
+    """Return the SOA records of the negative answers to ``questions``
+
+    ``questions`` maps names to their ``(qtype, qclass)`` pairs and
+    ``results`` to their records. Only names with no data for one of
+    their types (or a CNAME to a missing name) get an entry.
+    """
+
+    soas = {}
+
+    for qname, types in questions.items():
+        records = results.get(qname)
+        if not records:
+            continue
+
+        if answers.nxdomain(qname, records) or any(
+            answers.nodata(records, qtype, qclass) for qtype, qclass in types
+        ):
+            soa = authority(db, answers.terminal(qname, records))
+            if soa:
+                soas[qname] = soa
+
+    return soas
+
+
+def fetch(db, questions, glue, start):
+    """Look up the names of ``questions`` in ``db`` (in a worker thread)
+
+    Returns ``(results, local, soas, error, start)``: the records of the
+    names and (if ``glue``) those of their MX, NS and SRV targets as well,
+    fetched in a second batch, and the SOA records of negative answers.
+    """
+
+    try:
+        results = db.resolve(list(questions))
+    except Exception as error:
+        return {}, {}, {}, error, start
+
+    local = results
+
+    if results and glue:
+        targets = set(
+            name for records in results.values()
+            for name in answers.targets([record.rr for record in records])
+        ) - set(results)
+
+        if targets:
+            try:
+                local = dict(results)
+                local.update(db.find_records(targets))
+            except Exception:
+                local = results
+
+    try:
+        soas = authorities(db, questions, results)
+    except Exception:
+        soas = {}
 
+    return results, local, soas, None, start
 
-def waitfor(host, port, timeout=10):
-    sock = socket(AF_INET, SOCK_STREAM)
 
-    while not sock.connect_ex((host, port)) == 0 and timeout:
-        timeout -= 1
-        sleep(1)
+def connect(host, port, timeout=1):
+    """Connect to Redis on ``host:port`` (``None`` if not reachable)"""
 
-    if timeout <= 0:
-        print("Timed out waiting for {0:s}:{1:d}".format(host, port))
-        raise SystemExit(1)
+    try:
+        create_connection((host, port), timeout).close()
+    except SocketError:
+        return None
+
+    return RedisStorage(host, port)
 
 
 def setup_database(args, logger):
-    dbhost = args.dbhost
-    dbport = args.dbport
+    if args.storage == "sqlite":
+        logger.debug("Opening SQLite database {0:s} ...".format(args.dbfile))
+        return SQLiteStorage(args.dbfile)
 
-    logger.debug(
-        "Waiting for Redis Service on {0:s}:{1:d} ...".format(dbhost, dbport)
-    )
+    # Redis is attached once reachable without holding up start up
+    return None
 
-    waitfor(dbhost, dbport)
 
-    logger.debug(
-        "Connecting to Redis on {0:s}:{1:d} ...".format(dbhost, dbport)
-    )
+def parse_address(s, port=53):
+    host, _, p = s.partition(":")
+    return host, int(p) if p else port
+
 
-    connection_setup(host=dbhost, port=dbport)
+def address_of(host):
+    """Return the (IPv4) address of ``host`` or ``host`` if not resolved"""
 
-    logger.debug("Success!")
+    try:
+        return gethostbyname(host)
+    except SocketError:
+        return host
 
-    db = get_client()
 
-    return db
+def parse_secondary(s):
+    zone, _, primary = s.partition("=")
+    if not zone.endswith("."):
+        zone = "{0:s}.".format(zone)
+    return zone, parse_address(primary)
 
 
 def setup_logging(args):
@@ -270,11 +1291,14 @@ def setup_logging(args):
 def parse_args(args=None):
     parser = ArgumentParser(
         formatter_class=ArgumentDefaultsHelpFormatter,
-        version=__version__,
     )
 
     add = parser.add_argument
 
+    add(
+        "-v", "--version", action="version", version=__version__
+    )
+
     add(
         "--debug", action="store_true", default=False,
         dest="debug",
@@ -299,6 +1323,18 @@ def parse_args(args=None):
         help="write process id to FILE"
     )
 
+    add(
+        "--storage", action="store", default="redis",
+        dest="storage", choices=("redis", "sqlite"),
+        help="storage backend to use for zones and records"
+    )
+
+    add(
+        "--dbfile", action="store", default="udns.db",
+        dest="dbfile", metavar="FILE", type=str,
+        help="set database file to FILE (SQLite)"
+    )
+
     add(
         "--dbhost", action="store",
         default=environ.get("REDIS_PORT_6379_TCP_ADDR", "localhost"),
@@ -313,6 +1349,13 @@ def parse_args(args=None):
         help="set database port to PORT (Redis)"
     )
 
+    add(
+        "--dbworkers", action="store",
+        default=int(environ.get("DBWORKERS", "4")),
+        dest="dbworkers", metavar="N", type=int,
+        help="perform database lookups on a pool of N threads"
+    )
+
     add(
         "--cachesize", action="store",
         default=int(environ.get("CACHESIZEE", "1024")),
@@ -320,6 +1363,145 @@ def parse_args(args=None):
         help="set cache size to SIZE"
     )
 
+    add(
+        "--cacheshards", action="store", default=16,
+        dest="cacheshards", metavar="N", type=int,
+        help="partition the cache into N independently locked shards"
+    )
+
+    add(
+        "--views", action="store", default=None,
+        dest="views", metavar="FILE", type=load_views,
+        help="serve split-horizon views (by client network) from FILE (JSON)"
+    )
+
+    add(
+        "--policy", action="append", default=[],
+        dest="policy", metavar="FILE", type=str,
+        help="apply the response policy zone (RPZ) or list of names in FILE"
+    )
+
+    add(
+        "--policy-reload", action="store", default=60,
+        dest="policy_reload", metavar="SECONDS", type=int,
+        help="check the response policy files for changes every SECONDS"
+    )
+
+    add(
+        "--minimal-responses", action="store_true", default=False,
+        dest="minimal_responses",
+        help="only send answers (no glue in the additional section)"
+    )
+
+    add(
+        "--querylog", action="store", default=None,
+        dest="querylog", metavar="FILE", type=FileType("a"),
+        help="write a structured (JSON lines) query log to FILE"
+    )
+
+    add(
+        "--querylog-sample", action="store", default=1.0,
+        dest="querylog_sample", metavar="RATE", type=float,
+        help="log only a RATE (0.0-1.0) fraction of queries"
+    )
+
+    add(
+        "--querylog-size", action="store", default=65536,
+        dest="querylog_size", metavar="SIZE", type=int,
+        help="buffer up to SIZE query log records before dropping"
+    )
+
+    add(
+        "--profile", action="store_true", default=False,
+        dest="profile",
+        help="enable per-stage tracing and stack sampling (dump on SIGUSR1)"
+    )
+
+    add(
+        "--profile-output", action="store", default="udns-profile",
+        dest="profile_output", metavar="PREFIX", type=str,
+        help="write profiles dumped on SIGUSR1 to PREFIX.{folded,stages}"
+    )
+
+    add(
+        "--metrics", action="store", default=None,
+        dest="metrics", metavar="BIND", type=str,
+        help="serve prometheus metrics over HTTP on BIND (address:port)"
+    )
+
+    add(
+        "--control", action="store", default=None,
+        dest="control", metavar="BIND", type=str,
+        help="serve the cache control API over HTTP on BIND (address:port)"
+    )
+
+    add(
+        "--control-token", action="store", default=None,
+        dest="control_token", metavar="TOKEN", type=str,
+        help="bearer token required by the control API "
+             "(or $UDNS_CONTROL_TOKEN)"
+    )
+
+    add(
+        "--tls", action="store", default=None,
+        dest="tls", metavar="BIND", type=str,
+        help="serve DNS-over-TLS on BIND (address:port, e.g: 0.0.0.0:853)"
+    )
+
+    add(
+        "--https", action="store", default=None,
+        dest="https", metavar="BIND", type=str,
+        help="serve DNS-over-HTTPS on BIND (address:port, e.g: 0.0.0.0:443)"
+    )
+
+    add(
+        "--certfile", action="store", default=None,
+        dest="certfile", metavar="FILE", type=str,
+        help="TLS certificate (chain) for --tls and --https"
+    )
+
+    add(
+        "--keyfile", action="store", default=None,
+        dest="keyfile", metavar="FILE", type=str,
+        help="TLS private key (if not included in --certfile)"
+    )
+
+    add(
+        "--secondary", action="append", default=[],
+        dest="secondaries", metavar="ZONE=HOST[:PORT]", type=parse_secondary,
+        help="serve ZONE as a secondary transferred from HOST"
+    )
+
+    add(
+        "--refresh", action="store", default=3600,
+        dest="refresh", metavar="SECONDS", type=int,
+        help="refresh secondary zones every SECONDS (besides on NOTIFY)"
+    )
+
+    add(
+        "--notify", action="append", default=[],
+        dest="notify", metavar="HOST[:PORT]", type=parse_address,
+        help="send NOTIFY to HOST when a zone's serial changes"
+    )
+
+    add(
+        "--notify-interval", action="store", default=1,
+        dest="notify_interval", metavar="SECONDS", type=float,
+        help="check zone serials for changes every SECONDS"
+    )
+
+    add(
+        "--tsig-key", action="append", default=[],
+        dest="tsig_keys", metavar="[ALG:]NAME:SECRET", type=tsig.parse_key,
+        help="accept dynamic updates signed with the (base64) SECRET of NAME"
+    )
+
+    add(
+        "--allow-transfer", action="append", default=[],
+        dest="allow_transfer", metavar="ADDRESS", type=str,
+        help="only allow zone transfers to ADDRESS (repeatable)"
+    )
+
     add(
         "-b", "--bind",
         action="store", type=str,
@@ -335,12 +1517,68 @@ def parse_args(args=None):
 
     add(
         "-f", "--forward",
-        action="store", type=str,
+        action="store", type=parse_servers,
         default="8.8.8.8", dest="forward",
-        help="DNS server to forward to"
+        help="DNS servers to forward to (HOST[:PORT],...)"
+    )
+
+    add(
+        "--forwarders", action="store", default=None,
+        dest="forwarders", metavar="FILE", type=load_forwarders,
+        help="forward the names of zones to their own servers (JSON FILE)"
+    )
+
+    add(
+        "--upstream-timeout", action="store", default=2.0,
+        dest="upstream_timeout", metavar="SECONDS", type=float,
+        help="retry forwarded queries on the next server after SECONDS"
+    )
+
+    add(
+        "--max-pending", action="store", default=10000,
+        dest="max_pending", metavar="N", type=int,
+        help="answer SERVFAIL rather than forward with N queries pending"
+    )
+
+    add(
+        "--min-ttl", action="store", default=None,
+        dest="min_ttl", metavar="SECONDS", type=int,
+        help="cache forwarded answers for at least SECONDS"
     )
 
-    return parser.parse_args(args)
+    add(
+        "--max-ttl", action="store", default=None,
+        dest="max_ttl", metavar="SECONDS", type=int,
+        help="cache forwarded answers for at most SECONDS"
+    )
+
+    add(
+        "--ttl-jitter", action="store", default=0.0,
+        dest="ttl_jitter", metavar="FRACTION", type=float,
+        help="shorten the ttls of cached answers by up to FRACTION (e.g: 0.1)"
+    )
+
+    args = parser.parse_args(args)
+
+    if (args.tls or args.https) and not args.certfile:
+        parser.error("--certfile is required by --tls and --https")
+
+    args.control_token = \
+        args.control_token or environ.get("UDNS_CONTROL_TOKEN")
+
+    if args.control and not args.control_token:
+        parser.error("--control requires --control-token")
+
+    if not valid_ttls(args.min_ttl, args.max_ttl):
+        parser.error("--min-ttl and --max-ttl must be 0 <= min <= max")
+
+    if not 0 < args.max_pending < 0x10000:
+        parser.error("--max-pending must be between 1 and 65535")
+
+    if not 0 <= args.ttl_jitter < 1:
+        parser.error("--ttl-jitter must be a fraction (0 <= FRACTION < 1)")
+
+    return args
 
 
 def parse_hosts(filename):
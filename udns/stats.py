@@ -0,0 +1,131 @@
+"""Statistics
+
+Counters, gauges and fixed-bucket histograms updated from the query path
+and rendered in the Prometheus text exposition format.
+
+All updates happen on the event loop thread so no locking is required;
+a counter update is a single integer addition and a histogram observation
+is a bisection over a small, fixed tuple of bucket bounds.
+"""
+
+
+from bisect import bisect_left
+
+
+try:
+    from time import perf_counter as clock
+except ImportError:  # pragma: no cover
+    from time import time as clock  # noqa
+
+
+# Latency buckets in seconds (100us .. 5s)
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005,
+    0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class Counter(object):
+
+    type = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+
+        self.value = 0
+
+    def inc(self, n=1):
+        self.value += n
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Gauge(object):
+    """Gauge whose value is computed by calling ``f`` at collection time"""
+
+    type = "gauge"
+
+    def __init__(self, name, help, f):
+        self.name = name
+        self.help = help
+
+        self.f = f
+
+    @property
+    def value(self):
+        return self.f()
+
+    def samples(self):
+        yield self.name, self.value
+
+
+class Histogram(object):
+
+    type = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        total = 0
+        for bound, count in zip(self.buckets, self.counts):
+            total += count
+            yield "{0:s}_bucket{{le=\"{1:s}\"}}".format(
+                self.name, repr(bound)
+            ), total
+
+        yield "{0:s}_bucket{{le=\"+Inf\"}}".format(self.name), self.count
+        yield "{0:s}_sum".format(self.name), self.sum
+        yield "{0:s}_count".format(self.name), self.count
+
+
+class Stats(object):
+    """Registry of named metrics"""
+
+    def __init__(self, prefix="udns"):
+        self.prefix = prefix
+
+        self.metrics = []
+
+    def _register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def _name(self, name):
+        return "{0:s}_{1:s}".format(self.prefix, name)
+
+    def counter(self, name, help):
+        return self._register(Counter(self._name(name), help))
+
+    def gauge(self, name, help, f):
+        return self._register(Gauge(self._name(name), help, f))
+
+    def histogram(self, name, help, buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(self._name(name), help, buckets))
+
+    def render(self):
+        out = []
+
+        for metric in self.metrics:
+            out.append("# HELP {0:s} {1:s}".format(metric.name, metric.help))
+            out.append("# TYPE {0:s} {1:s}".format(metric.name, metric.type))
+            for name, value in metric.samples():
+                out.append("{0:s} {1:s}".format(name, repr(value)))
+
+        out.append("")
+
+        return "\n".join(out)
@@ -0,0 +1,797 @@
+"""Storage Backends
+
+Backends implement a small set of primitive operations on zones and
+records keyed by fully qualified name. The zone file conventions
+(relative names, default ttls, import and export), zone serials and the
+change journal used for incremental zone transfers and CNAME following
+are implemented once in :class:`Storage` in terms of those primitives.
+
+Three backends are provided:
+
+- :class:`RedisStorage` backed by the redisco models in :mod:`udns.models`
+- :class:`SQLiteStorage` an embedded, memory-mapped SQLite database in
+  WAL mode for single node deployments that need no network service
+- :class:`MemoryStorage` a volatile in-process store (e.g: the copies of
+  zones held by a secondary server)
+"""
+
+
+import sqlite3
+from threading import local
+from contextlib import contextmanager
+from json import dumps, loads
+from collections import defaultdict, deque, namedtuple
+
+
+from dnslib import ZoneParser
+from dnslib import CLASS, QTYPE, RD, RDMAP, RR, SOA, TXT
+
+
+CNAME = QTYPE.reverse["CNAME"]
+NSEC = QTYPE.reverse["NSEC"]
+RRSIG = QTYPE.reverse["RRSIG"]
+
+
+# Number of changes kept in each zone's journal for incremental transfers
+JOURNAL_SIZE = 1000
+
+
+def to_rr(rname, rdata, rclass, rtype, ttl):
+    """Build a Resource Record from its zone file representation"""
+
+    rd = RDMAP.get(QTYPE[rtype], RD)
+    tokens = [rdata] if rd is TXT else rdata.split()
+    return RR(rname, rtype, rclass, ttl, rd.fromZone(tokens))
+
+
+_Entry = namedtuple("Entry", ("rname", "rdata", "rclass", "rtype", "ttl",))
+
+
+class Entry(_Entry):
+    """Resource Record entry as stored by non-Redis backends"""
+
+    __slots__ = ()
+
+    @classmethod
+    def from_rr(cls, rr):
+        return cls(str(rr.rname), str(rr.rdata), rr.rclass, rr.rtype, rr.ttl)
+
+    @property
+    def rr(self):
+        return to_rr(*self)
+
+
+class ZoneInfo(object):
+
+    def __init__(self, name, ttl=0, serial=0):
+        self.name = name
+        self.ttl = ttl
+        self.serial = serial
+
+    def __repr__(self):
+        return "<ZoneInfo {0:s} ttl={1:d} serial={2:d}>".format(
+            self.name, self.ttl, self.serial
+        )
+
+
+def next_serial(serial):
+    """Return the serial following ``serial`` (RFC 1982, skipping 0)"""
+
+    return serial % 0xFFFFFFFF + 1
+
+
+class Storage(object):
+
+    def zones(self):
+        """Return the names of all zones"""
+        raise NotImplementedError()
+
+    def get_zone(self, name):
+        """Return the zone ``name`` or ``None`` if it does not exist"""
+        raise NotImplementedError()
+
+    def find_zone(self, name):
+        """Return the zone holding ``name`` (the longest zone it ends with)
+
+        Returns ``None`` if ``name`` is in none of the zones.
+        """
+
+        name = name.lower()
+        zones = [
+            zone for zone in self.zones()
+            if name == zone.lower() or name.endswith("." + zone.lower())
+        ]
+
+        return self.get_zone(max(zones, key=len)) if zones else None
+
+    def create_zone(self, name, ttl=None):
+        raise NotImplementedError()
+
+    def delete_zone(self, zone):
+        raise NotImplementedError()
+
+    def set_ttl(self, zone, ttl):
+        raise NotImplementedError()
+
+    def set_serial(self, zone, serial):
+        raise NotImplementedError()
+
+    def records(self, zone):
+        """Return all records of ``zone`` in insertion order"""
+        raise NotImplementedError()
+
+    def iter_records(self, zone, size=1000):
+        """Yield the records of ``zone`` fetched ``size`` at a time
+
+        Backends override this to hold no more than a page of records in
+        memory (e.g: when exporting very large zones).
+        """
+
+        return iter(self.records(zone))
+
+    def insert_record(self, zone, rname, rdata, rclass, rtype, ttl):
+        raise NotImplementedError()
+
+    def remove_record(self, zone, rname, rtype=None, rdata=None):
+        """Remove the first record of ``zone`` matching the given fields
+
+        Returns the removed record as an :class:`Entry` or ``None``.
+        """
+        raise NotImplementedError()
+
+    def append_journal(self, zone, serial, deleted, added):
+        raise NotImplementedError()
+
+    def journal(self, zone):
+        """Return the ``(serial, deleted, added)`` journal of ``zone``"""
+        raise NotImplementedError()
+
+    def find_records(self, rnames):
+        """Return a dict mapping each of ``rnames`` to its records"""
+        raise NotImplementedError()
+
+    @contextmanager
+    def transaction(self):
+        """Run the primitives within as a single transaction
+
+        Backends without transactions simply run them as they go.
+        """
+
+        yield
+
+    def serials(self):
+        """Return a dict mapping the name of each zone to its serial"""
+
+        return dict(
+            (name, self.get_zone(name).serial) for name in self.zones()
+        )
+
+    def fqdn(self, zone, rname):
+        if rname == "@":
+            return zone.name
+        return "{0:s}.{1:s}".format(rname, zone.name)
+
+    def commit(self, zone, deleted=(), added=()):
+        """Record a change to ``zone`` in its journal under a new serial"""
+
+        serial = next_serial(zone.serial)
+        self.set_serial(zone, serial)
+        self.append_journal(zone, serial, list(deleted), list(added))
+
+        return serial
+
+    def changes(self, zone, serial):
+        """Return the journal entries of ``zone`` following ``serial``
+
+        Returns ``None`` if the journal does not reach back to ``serial``
+        (the caller should then fall back to a full zone transfer).
+        """
+
+        if serial == zone.serial:
+            return []
+
+        entries = self.journal(zone)
+
+        for i, entry in enumerate(entries):
+            if entry[0] == next_serial(serial):
+                return entries[i:]
+
+    def soa(self, zone):
+        """Return the SOA record of ``zone`` carrying the zone's serial
+
+        Zones without a SOA record get one synthesized from their name.
+        """
+
+        for record in self.find_records([zone.name])[zone.name]:
+            if record.rtype == QTYPE.SOA:
+                rr = record.rr
+                rr.rdata.times = (zone.serial,) + tuple(rr.rdata.times[1:])
+                return rr
+
+        return RR(
+            zone.name, QTYPE.SOA, CLASS.IN, zone.ttl,
+            SOA(
+                zone.name, "hostmaster.{0:s}".format(zone.name),
+                (zone.serial, 3600, 600, 86400, zone.ttl)
+            )
+        )
+
+    def stamp(self, records):
+        """Return ``records`` with their SOA records carrying the serial
+
+        Zone serials are kept by the zone (and bumped on every change)
+        rather than in its stored SOA record, whose serial is rewritten
+        here for the SOA records being served.
+        """
+
+        stamped = []
+        for record in records:
+            if record.rtype == QTYPE.SOA:
+                zone = self.get_zone(record.rname)
+                if zone is not None:
+                    tokens = record.rdata.split()
+                    tokens[2] = str(zone.serial)
+                    record = Entry(
+                        record.rname, " ".join(tokens),
+                        record.rclass, record.rtype, record.ttl
+                    )
+            stamped.append(record)
+
+        return stamped
+
+    def add_record(self, zone, rname, rdata, **options):
+        rclass = options.get("rclass", CLASS.IN)
+        rtype = options.get("rtype", QTYPE.A)
+        ttl = options.get("ttl", zone.ttl)
+
+        rclass = rclass if rclass is not None else CLASS.IN
+        rtype = rtype if rtype is not None else QTYPE.A
+        ttl = ttl if ttl is not None else zone.ttl
+
+        record = Entry(self.fqdn(zone, rname), rdata, rclass, rtype, ttl)
+
+        self.insert_record(zone, *record)
+        self.commit(zone, added=[record])
+
+    def delete_record(self, zone, rname):
+        record = self.remove_record(zone, self.fqdn(zone, rname))
+
+        if record is not None:
+            self.commit(zone, deleted=[record])
+
+    def update(self, zone, deletes=(), adds=()):
+        """Apply many changes to ``zone`` as one under a single new serial
+
+        ``deletes`` are ``(rname, rtype, rdata)`` tuples removing every
+        matching record (``rtype`` and ``rdata`` may be ``None`` to match
+        any) and are applied before ``adds``, a list of :class:`Entry`.
+
+        Returns the list of removed records.
+        """
+
+        deleted = []
+
+        with self.transaction():
+            for rname, rtype, rdata in deletes:
+                record = self.remove_record(zone, rname, rtype, rdata)
+                while record is not None:
+                    deleted.append(record)
+                    record = self.remove_record(zone, rname, rtype, rdata)
+
+            for record in adds:
+                self.insert_record(zone, *record)
+
+            if deleted or adds:
+                self.commit(zone, deleted, adds)
+
+        return deleted
+
+    def load(self, zone, f):
+        parser = ZoneParser(f.read())
+
+        records = [Entry.from_rr(rr) for rr in list(parser)]
+
+        for record in records:
+            self.insert_record(zone, *record)
+            if record.rtype == QTYPE.SOA:
+                serial = int(record.rdata.split()[2])
+                if serial > zone.serial:
+                    self.set_serial(zone, serial)
+
+        self.set_ttl(zone, parser.ttl)
+        self.commit(zone, added=records)
+
+    def export(self, zone):
+        return "\n".join(self.iter_export(zone))
+
+    def iter_export(self, zone, size=1000):
+        """Yield the lines of ``zone`` in zone file format
+
+        Records are fetched ``size`` at a time (see :meth:`iter_records`).
+        """
+
+        yield "$TTL {0:d}".format(zone.ttl)
+        yield "$ORIGIN {0:s}".format(zone.name.rstrip("."))
+        yield ""
+
+        for record in self.iter_records(zone, size):
+            rr = record.rr
+            rname = str(rr.rname.stripSuffix(zone.name))
+            yield "{0:23s} {1:7d} {2:7s} {3:7s} {4:s}".format(
+                rname, rr.ttl,
+                CLASS.get(rr.rclass),
+                QTYPE.get(rr.rtype),
+                rr.rdata.toZone()
+            )
+
+    def resolve(self, rnames):
+        """Find the records of many names following single CNAME records
+
+        A name whose only record is a CNAME (besides its DNSSEC records)
+        resolves to its records followed by the records of its target, as
+        looked up in a second batch. SOA records carry the zone's serial
+        (see :meth:`stamp`).
+        """
+
+        results = self.find_records(rnames)
+
+        aliases = {}
+        for rname, records in results.items():
+            data = [r for r in records if r.rtype not in (NSEC, RRSIG)]
+            if len(data) == 1 and data[0].rtype == CNAME:
+                aliases[rname] = data[0]
+
+        if aliases:
+            targets = self.find_records(
+                set(record.rdata for record in aliases.values())
+            )
+            for rname, record in aliases.items():
+                results[rname] = results[rname] + targets[record.rdata]
+
+        for rname, records in results.items():
+            if any(record.rtype == QTYPE.SOA for record in records):
+                results[rname] = self.stamp(records)
+
+        return results
+
+
+def matches(record, rname, rtype=None, rdata=None):
+    return (
+        record.rname == rname and
+        (rtype is None or record.rtype == rtype) and
+        (rdata is None or record.rdata == rdata)
+    )
+
+
+def _encode_journal(serial, deleted, added):
+    return dumps([serial, deleted, added])
+
+
+def _decode_journal(data):
+    serial, deleted, added = loads(data)
+    return (
+        serial,
+        [Entry(*record) for record in deleted],
+        [Entry(*record) for record in added]
+    )
+
+
+class RedisStorage(Storage):
+    """Redis backend
+
+    redisco (and the models) are only imported when the backend is used.
+    """
+
+    def __init__(self, host, port):
+        from redisco import connection_setup
+
+        connection_setup(host=host, port=port)
+
+    def zones(self):
+        from .models import Zone
+
+        return [zone.name for zone in Zone.objects.all()]
+
+    def get_zone(self, name):
+        from .models import Zone
+
+        return Zone.objects.filter(name=name).first()
+
+    def create_zone(self, name, ttl=None):
+        from .models import Zone
+
+        zone = Zone(name=name, ttl=ttl)
+        zone.save()
+        return zone
+
+    def delete_zone(self, zone):
+        zone.delete()
+
+    def set_ttl(self, zone, ttl):
+        zone.ttl = ttl
+        zone.save()
+
+    def set_serial(self, zone, serial):
+        zone.serial = serial
+        zone.save()
+
+    def records(self, zone):
+        return zone.records
+
+    def iter_records(self, zone, size=1000):
+        from .models import iter_records
+
+        return iter_records(zone, size)
+
+    def insert_record(self, zone, rname, rdata, rclass, rtype, ttl):
+        zone.add_record(rname, rdata, rclass=rclass, rtype=rtype, ttl=ttl)
+
+    def remove_record(self, zone, rname, rtype=None, rdata=None):
+        for record in zone.records:
+            if matches(record, rname, rtype, rdata):
+                entry = Entry(
+                    record.rname, record.rdata,
+                    record.rclass, record.rtype, record.ttl
+                )
+                zone.delete_record(record)
+                return entry
+
+    def update(self, zone, deletes=(), adds=()):
+        # Records to delete are fetched in one pipelined round trip and
+        # the zone is saved once rather than once per record.
+        from .models import find_records, Record
+
+        records = zone.records
+        ids = set(record.id for record in records)
+
+        found = find_records(set(rname for rname, _, _ in deletes))
+
+        deleted, doomed = [], set()
+        for rname, rtype, rdata in deletes:
+            for record in found[rname]:
+                if record.id in ids and record.id not in doomed and \
+                        matches(record, rname, rtype, rdata):
+                    doomed.add(record.id)
+                    deleted.append(Entry(
+                        record.rname, record.rdata,
+                        record.rclass, record.rtype, record.ttl
+                    ))
+                    record.delete()
+
+        records[:] = [record for record in records if record.id not in doomed]
+
+        for rname, rdata, rclass, rtype, ttl in adds:
+            record = Record(
+                rname=rname, rdata=rdata, rclass=rclass, rtype=rtype, ttl=ttl
+            )
+            record.save()
+            records.append(record)
+
+        if deleted or adds:
+            zone.serial = next_serial(zone.serial)
+            zone.save()
+            self.append_journal(zone, zone.serial, deleted, list(adds))
+
+        return deleted
+
+    def append_journal(self, zone, serial, deleted, added):
+        from redisco import get_client
+
+        key = zone.key()["journal"]
+
+        pipe = get_client().pipeline()
+        pipe.rpush(key, _encode_journal(serial, deleted, added))
+        pipe.ltrim(key, -JOURNAL_SIZE, -1)
+        pipe.execute()
+
+    def journal(self, zone):
+        from redisco import get_client
+
+        key = zone.key()["journal"]
+        return [_decode_journal(x) for x in get_client().lrange(key, 0, -1)]
+
+    def find_records(self, rnames):
+        from .models import find_records
+
+        return find_records(rnames)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS zones (
+    name TEXT PRIMARY KEY,
+    ttl INTEGER NOT NULL DEFAULT 0,
+    serial INTEGER NOT NULL DEFAULT 0
+);
+
+CREATE TABLE IF NOT EXISTS records (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    zone TEXT NOT NULL REFERENCES zones (name) ON DELETE CASCADE,
+    rname TEXT NOT NULL,
+    rdata TEXT NOT NULL,
+    rclass INTEGER NOT NULL,
+    rtype INTEGER NOT NULL,
+    ttl INTEGER NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS journal (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    zone TEXT NOT NULL REFERENCES zones (name) ON DELETE CASCADE,
+    change TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS records_rname ON records (rname);
+CREATE INDEX IF NOT EXISTS records_zone ON records (zone, id);
+CREATE INDEX IF NOT EXISTS journal_zone ON journal (zone, id);
+"""
+
+
+class SQLiteStorage(Storage):
+    """SQLite backend
+
+    Each thread (e.g: database workers of the server) gets its own
+    connection. The database is opened in WAL mode so that readers never
+    block on a writer (e.g: ``udnsc`` updating a zone of a running server)
+    and is memory-mapped so that lookups of hot data are served from the
+    page cache without read syscalls.
+    """
+
+    # Maximum number of bound parameters per query (SQLITE_MAX_VARIABLE_NUMBER)
+    chunksize = 500
+
+    def __init__(self, filename, mmap_size=256 * 1024 * 1024):
+        self.filename = filename
+        self.mmap_size = mmap_size
+
+        self._local = local()
+
+        with self.transaction() as db:
+            db.executescript(SCHEMA)
+
+    @property
+    def db(self):
+        db = getattr(self._local, "db", None)
+
+        if db is None:
+            db = self._local.db = sqlite3.connect(self.filename)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute("PRAGMA foreign_keys=ON")
+            db.execute("PRAGMA mmap_size={0:d}".format(self.mmap_size))
+
+        return db
+
+    @contextmanager
+    def transaction(self):
+        db = self.db
+
+        if getattr(self._local, "transaction", False):
+            yield db
+            return
+
+        self._local.transaction = True
+        try:
+            with db:
+                yield db
+        finally:
+            self._local.transaction = False
+
+    def zones(self):
+        rows = self.db.execute("SELECT name FROM zones ORDER BY name")
+        return [name for name, in rows]
+
+    def serials(self):
+        return dict(self.db.execute("SELECT name, serial FROM zones"))
+
+    def get_zone(self, name):
+        row = self.db.execute(
+            "SELECT name, ttl, serial FROM zones WHERE name = ?", (name,)
+        ).fetchone()
+
+        return ZoneInfo(*row) if row is not None else None
+
+    def create_zone(self, name, ttl=None):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO zones (name, ttl) VALUES (?, ?)", (name, ttl or 0)
+            )
+
+        return ZoneInfo(name, ttl or 0)
+
+    def delete_zone(self, zone):
+        with self.transaction() as db:
+            db.execute("DELETE FROM zones WHERE name = ?", (zone.name,))
+
+    def set_ttl(self, zone, ttl):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE zones SET ttl = ? WHERE name = ?", (ttl, zone.name)
+            )
+
+        zone.ttl = ttl
+
+    def set_serial(self, zone, serial):
+        with self.transaction() as db:
+            db.execute(
+                "UPDATE zones SET serial = ? WHERE name = ?",
+                (serial, zone.name)
+            )
+
+        zone.serial = serial
+
+    def records(self, zone):
+        return [
+            Entry(*row)
+            for row in self.db.execute(
+                "SELECT rname, rdata, rclass, rtype, ttl FROM records "
+                "WHERE zone = ? ORDER BY id", (zone.name,)
+            )
+        ]
+
+    def iter_records(self, zone, size=1000):
+        # Pages follow the last id seen (rather than rescanning an OFFSET)
+        last = 0
+        while True:
+            rows = self.db.execute(
+                "SELECT id, rname, rdata, rclass, rtype, ttl FROM records "
+                "WHERE zone = ? AND id > ? ORDER BY id LIMIT ?",
+                (zone.name, last, size)
+            ).fetchall()
+
+            for row in rows:
+                yield Entry(*row[1:])
+
+            if len(rows) < size:
+                return
+
+            last = rows[-1][0]
+
+    def insert_record(self, zone, rname, rdata, rclass, rtype, ttl):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO records (zone, rname, rdata, rclass, rtype, ttl) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (zone.name, rname, rdata, rclass, rtype, ttl)
+            )
+
+    def remove_record(self, zone, rname, rtype=None, rdata=None):
+        query = [
+            "SELECT id, rname, rdata, rclass, rtype, ttl FROM records "
+            "WHERE zone = ? AND rname = ?"
+        ]
+        params = [zone.name, rname]
+
+        if rtype is not None:
+            query.append("AND rtype = ?")
+            params.append(rtype)
+
+        if rdata is not None:
+            query.append("AND rdata = ?")
+            params.append(rdata)
+
+        query.append("ORDER BY id LIMIT 1")
+
+        with self.transaction() as db:
+            row = db.execute(" ".join(query), params).fetchone()
+            if row is None:
+                return None
+
+            db.execute("DELETE FROM records WHERE id = ?", (row[0],))
+
+        return Entry(*row[1:])
+
+    def append_journal(self, zone, serial, deleted, added):
+        with self.transaction() as db:
+            db.execute(
+                "INSERT INTO journal (zone, change) VALUES (?, ?)",
+                (zone.name, _encode_journal(serial, deleted, added))
+            )
+            db.execute(
+                "DELETE FROM journal WHERE zone = ? AND id <= ("
+                "SELECT id FROM journal WHERE zone = ? "
+                "ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                (zone.name, zone.name, JOURNAL_SIZE)
+            )
+
+    def journal(self, zone):
+        return [
+            _decode_journal(change)
+            for change, in self.db.execute(
+                "SELECT change FROM journal WHERE zone = ? ORDER BY id",
+                (zone.name,)
+            )
+        ]
+
+    def find_records(self, rnames):
+        rnames = list(rnames)
+        results = dict((rname, []) for rname in rnames)
+
+        for i in range(0, len(rnames), self.chunksize):
+            chunk = rnames[i:i + self.chunksize]
+            rows = self.db.execute(
+                "SELECT rname, rdata, rclass, rtype, ttl FROM records "
+                "WHERE rname IN ({0:s}) ORDER BY id".format(
+                    ", ".join("?" * len(chunk))
+                ),
+                chunk
+            )
+            for row in rows:
+                results[row[0]].append(Entry(*row))
+
+        return results
+
+
+def _unindex(index, record):
+    records = index[record.rname]
+    records.remove(record)
+    if not records:
+        del index[record.rname]
+
+
+class MemoryZone(ZoneInfo):
+
+    def __init__(self, name, ttl=0, serial=0):
+        super(MemoryZone, self).__init__(name, ttl, serial)
+
+        self.records = []
+        self.index = defaultdict(list)
+        self.journal = deque(maxlen=JOURNAL_SIZE)
+
+
+class MemoryStorage(Storage):
+    """Volatile in-process backend
+
+    Lookups are plain dictionary accesses so this backend is cheap enough
+    to be queried directly on the event loop.
+    """
+
+    def __init__(self):
+        self._zones = {}
+        self._index = defaultdict(list)
+
+    def zones(self):
+        return sorted(self._zones)
+
+    def get_zone(self, name):
+        return self._zones.get(name)
+
+    def create_zone(self, name, ttl=None):
+        zone = self._zones[name] = MemoryZone(name, ttl or 0)
+        return zone
+
+    def delete_zone(self, zone):
+        for record in zone.records:
+            _unindex(self._index, record)
+        del self._zones[zone.name]
+
+    def set_ttl(self, zone, ttl):
+        zone.ttl = ttl
+
+    def set_serial(self, zone, serial):
+        zone.serial = serial
+
+    def records(self, zone):
+        return list(zone.records)
+
+    def insert_record(self, zone, rname, rdata, rclass, rtype, ttl):
+        record = Entry(rname, rdata, rclass, rtype, ttl)
+        zone.records.append(record)
+        zone.index[rname].append(record)
+        self._index[rname].append(record)
+
+    def remove_record(self, zone, rname, rtype=None, rdata=None):
+        for record in zone.index.get(rname, ()):
+            if matches(record, rname, rtype, rdata):
+                zone.records.remove(record)
+                _unindex(zone.index, record)
+                _unindex(self._index, record)
+                return record
+
+    def append_journal(self, zone, serial, deleted, added):
+        zone.journal.append((serial, deleted, added))
+
+    def journal(self, zone):
+        return list(zone.journal)
+
+    def find_records(self, rnames):
+        index = self._index
+        return dict((rname, list(index.get(rname, ()))) for rname in rnames)
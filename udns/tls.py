@@ -0,0 +1,148 @@
+"""TLS
+
+Listeners for DNS-over-TLS (RFC 7858) and DNS-over-HTTPS (RFC 8484).
+
+Every connection of a listener is wrapped with the listener's single
+server side :class:`ssl.SSLContext` (rather than a new context per
+connection) so that session tickets issued on one connection can be used
+to resume the session on the next one, saving clients a full handshake.
+
+Handshakes are stepped as their sockets become ready (rather than waiting
+on them with circuits' blocking handshake) so that a client stalling its
+handshake holds up nothing but its own connection, which is closed if
+the handshake is not complete in time.
+"""
+
+
+from ssl import SSLContext, SSLError, SSLWantReadError, SSLWantWriteError
+from ssl import OP_NO_COMPRESSION, OP_NO_SSLv2, OP_NO_SSLv3
+
+try:
+    from ssl import PROTOCOL_TLS_SERVER as PROTOCOL
+except ImportError:  # pragma: no cover
+    from ssl import PROTOCOL_SSLv23 as PROTOCOL  # noqa
+
+
+from circuits.web.http import HTTP
+from circuits.web.servers import BaseServer
+from circuits.net.sockets import TCPServer
+from circuits import handler, BaseComponent, Event, Timer
+
+
+from .stats import clock
+
+
+class sweep(Event):
+    """sweep Event"""
+
+
+def create_context(certfile, keyfile=None, protocols=None):
+    """Create a server side context for ``certfile`` (and ``keyfile``)
+
+    ``protocols`` is an optional list of ALPN protocol names to offer.
+    """
+
+    context = SSLContext(PROTOCOL)
+    context.options |= OP_NO_SSLv2 | OP_NO_SSLv3 | OP_NO_COMPRESSION
+    context.load_cert_chain(certfile, keyfile)
+
+    if protocols:
+        context.set_alpn_protocols(protocols)
+
+    return context
+
+
+class TLSServer(TCPServer):
+    """TCP Server wrapping connections with a shared ``context``
+
+    Connections not done with their handshake within ``timeout`` seconds
+    are closed.
+    """
+
+    def __init__(self, bind, context, timeout=10, **kwargs):
+        # The certificate chain is loaded into the context; TCPServer
+        # only checks for the presence of a certfile when secure.
+        super(TLSServer, self).__init__(
+            bind, secure=True, certfile=True, **kwargs
+        )
+
+        self.context = context
+        self.timeout = timeout
+
+        # Sockets in their handshake (by deadline)
+        self.handshakes = {}
+
+        Timer(1, sweep(), persist=True, channel=self.channel).register(self)
+
+    def _do_handshake(self, sock, fire_connect_event=True):
+        sslsock = self.context.wrap_socket(
+            sock, server_side=True, do_handshake_on_connect=False
+        )
+        sslsock.setblocking(False)
+
+        self.handshakes[sslsock] = clock() + self.timeout
+        self._step(sslsock)
+
+        # Called as a generator by TCPServer
+        return iter(())
+
+    def _step(self, sock):
+        poller = self._poller
+
+        try:
+            sock.do_handshake()
+        except SSLWantReadError:
+            poller.removeWriter(sock)
+            if not poller.isReading(sock):
+                poller.addReader(self, sock)
+        except SSLWantWriteError:
+            poller.removeReader(sock)
+            if not poller.isWriting(sock):
+                poller.addWriter(self, sock)
+        except (SSLError, OSError):
+            self._abort(sock)
+        else:
+            del self.handshakes[sock]
+            poller.discard(sock)
+            self._on_accept_done(sock)
+
+    def _abort(self, sock):
+        del self.handshakes[sock]
+        self._poller.discard(sock)
+
+        try:
+            sock.close()
+        except (SSLError, OSError):
+            pass
+
+    @handler("_read", "_write", priority=2)
+    def _on_handshake(self, event, sock):
+        # Sockets in their handshake are not (yet) clients of TCPServer
+        if sock in self.handshakes:
+            event.stop()
+            self._step(sock)
+
+    @handler("sweep")
+    def _on_sweep(self):
+        now = clock()
+        for sock, deadline in list(self.handshakes.items()):
+            if deadline <= now:
+                self._abort(sock)
+
+
+class HTTPSServer(BaseServer):
+    """HTTP Server on a :class:`TLSServer`
+
+    Without a dispatcher: requests are handled by a component listening
+    for ``request`` events on the server's channel.
+    """
+
+    channel = "https"
+
+    def __init__(self, bind, context, channel=channel):
+        BaseComponent.__init__(self, channel=channel)
+
+        self._display_banner = False
+
+        self.server = TLSServer(bind, context, channel=channel).register(self)
+        self.http = HTTP(self, channel=channel).register(self)
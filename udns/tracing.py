@@ -0,0 +1,105 @@
+"""Tracing and Profiling
+
+Per-stage latency tracing of the query path and a low overhead statistical
+(SIGPROF) stack sampler whose output is in the "folded" format understood
+by flamegraph.pl and compatible tools.
+
+The :class:`NullTracer` is used when profiling is disabled so that the
+query path only pays for a no-op method call per stage.
+"""
+
+
+from collections import defaultdict
+from signal import setitimer, signal, ITIMER_PROF, SIGPROF
+
+
+from .stats import clock
+
+
+STAGES = (
+    "parse", "dispatch", "policy", "cache", "hosts", "database", "pack"
+)
+
+
+class NullTracer(object):
+
+    enabled = False
+
+    def clock(self):
+        return 0
+
+    def record(self, stage, start):
+        return 0
+
+
+class Tracer(object):
+
+    enabled = True
+
+    def __init__(self, stats, stages=STAGES):
+        self.histograms = dict(
+            (
+                stage,
+                stats.histogram(
+                    "stage_{0:s}_seconds".format(stage),
+                    "Time spent in the {0:s} stage".format(stage)
+                )
+            )
+            for stage in stages
+        )
+
+    def clock(self):
+        return clock()
+
+    def record(self, stage, start):
+        now = clock()
+        self.histograms[stage].observe(now - start)
+        return now
+
+    def summary(self):
+        out = []
+
+        for stage in STAGES:
+            histogram = self.histograms.get(stage)
+            if histogram is None:
+                continue
+
+            mean = histogram.sum / histogram.count if histogram.count else 0.0
+            out.append(
+                "{0:10s} {1:10d} {2:12.3f}us".format(
+                    stage, histogram.count, mean * 1e6
+                )
+            )
+
+        return "\n".join(out)
+
+
+class Sampler(object):
+    """Statistical profiler sampling the main thread's stack on SIGPROF"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+
+        self.stacks = defaultdict(int)
+
+    def start(self):
+        signal(SIGPROF, self._sample)
+        setitimer(ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self):
+        setitimer(ITIMER_PROF, 0, 0)
+
+    def _sample(self, signum, frame):
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            stack.append(
+                "{0:s}:{1:s}".format(code.co_filename, code.co_name)
+            )
+            frame = frame.f_back
+
+        self.stacks[";".join(reversed(stack))] += 1
+
+    def dump(self, f):
+        for stack, count in sorted(self.stacks.items()):
+            f.write("{0:s} {1:d}\n".format(stack, count))
@@ -0,0 +1,278 @@
+"""Transaction Signatures
+
+TSIG (RFC 8945) verification of signed requests and signing of their
+responses with shared secret (HMAC) keys. dnslib only knows TSIG records
+as opaque data so they are (un)packed here, on the wire format of the
+message, which is also what the MAC is computed over.
+"""
+
+
+import hmac
+import hashlib
+from time import time
+from base64 import b64decode
+from struct import pack, unpack
+
+
+from dnslib import DNSError
+from dnslib.label import DNSBuffer
+from dnslib import DNSHeader, DNSQuestion, QTYPE
+
+
+TSIG = QTYPE.reverse["TSIG"]
+
+# CLASS ANY
+ANY = 255
+
+# TSIG error codes (RFC 8945 3)
+BADSIG = 16
+BADKEY = 17
+BADTIME = 18
+BADTRUNC = 22
+
+ALGORITHMS = {
+    "hmac-md5.sig-alg.reg.int.": hashlib.md5,
+    "hmac-sha1.": hashlib.sha1,
+    "hmac-sha224.": hashlib.sha224,
+    "hmac-sha256.": hashlib.sha256,
+    "hmac-sha384.": hashlib.sha384,
+    "hmac-sha512.": hashlib.sha512,
+}
+
+# Allowed clock skew between signer and verifier in seconds
+FUDGE = 300
+
+
+class Key(object):
+    """Shared secret key ``name`` for ``algorithm``"""
+
+    def __init__(self, name, secret, algorithm="hmac-sha256."):
+        self.name = canonical(name)
+        self.secret = secret
+        self.algorithm = canonical(algorithm)
+
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError(
+                "Unsupported TSIG algorithm {0:s}".format(algorithm)
+            )
+
+    def mac(self, *parts):
+        digest = hmac.new(self.secret, digestmod=ALGORITHMS[self.algorithm])
+        for part in parts:
+            digest.update(part)
+        return digest.digest()
+
+
+def parse_key(s):
+    """Parse a key given as ``[algorithm:]name:secret`` (as dig -y)
+
+    The secret is base64 encoded.
+    """
+
+    parts = s.split(":")
+
+    if len(parts) == 2:
+        name, secret = parts
+        return Key(name, b64decode(secret))
+
+    algorithm, name, secret = parts
+    if not algorithm.startswith("hmac-"):
+        algorithm = "hmac-{0:s}".format(algorithm)
+    if algorithm == "hmac-md5":
+        algorithm = "hmac-md5.sig-alg.reg.int"
+
+    return Key(name, b64decode(secret), algorithm)
+
+
+def canonical(name):
+    name = str(name).lower()
+    return name if name.endswith(".") else "{0:s}.".format(name)
+
+
+def wire(name):
+    """Encode ``name`` in canonical (uncompressed) wire format"""
+
+    labels = [
+        label.encode("ascii") for label in canonical(name).split(".") if label
+    ]
+    return b"".join(pack("!B", len(label)) + label for label in labels) + \
+        b"\x00"
+
+
+class Signature(object):
+    """TSIG record of a message"""
+
+    def __init__(self, key, algorithm, signed, fudge, mac, original_id,
+                 error=0, other=b""):
+        self.key = key
+        self.algorithm = algorithm
+        self.signed = signed
+        self.fudge = fudge
+        self.mac = mac
+        self.original_id = original_id
+        self.error = error
+        self.other = other
+
+    def variables(self):
+        timers = pack(
+            "!HIH", self.signed >> 32, self.signed & 0xFFFFFFFF, self.fudge
+        )
+
+        return b"".join((
+            wire(self.key), pack("!HI", ANY, 0), wire(self.algorithm),
+            timers, pack("!HH", self.error, len(self.other)), self.other
+        ))
+
+    def pack(self):
+        rdata = b"".join((
+            wire(self.algorithm),
+            pack("!HIH", self.signed >> 32, self.signed & 0xFFFFFFFF,
+                 self.fudge),
+            pack("!H", len(self.mac)), self.mac,
+            pack("!HHH", self.original_id, self.error, len(self.other)),
+            self.other
+        ))
+
+        return wire(self.key) + pack("!HHIH", TSIG, ANY, 0, len(rdata)) + \
+            rdata
+
+
+def split(data):
+    """Split a signed message into its unsigned form and :class:`Signature`
+
+    Returns ``(data, None)`` if the message is not signed.
+    """
+
+    buffer = DNSBuffer(data)
+
+    header = DNSHeader.parse(buffer)
+
+    if not header.ar:
+        return data, None
+
+    for _ in range(header.q):
+        DNSQuestion.parse(buffer)
+
+    # Skipped rather than parsed: records may be empty (e.g. in UPDATEs)
+    for _ in range(header.a + header.auth + header.ar - 1):
+        buffer.decode_name()
+        rdlength = buffer.unpack("!HHIH")[-1]
+        buffer.get(rdlength)
+
+    offset = buffer.offset
+
+    key = buffer.decode_name()
+    rtype, rclass, ttl, rdlength = buffer.unpack("!HHIH")
+
+    if rtype != TSIG:
+        return data, None
+
+    if buffer.remaining() != rdlength:
+        raise DNSError("TSIG record is not the last record")
+
+    algorithm = buffer.decode_name()
+    high, low, fudge, size = buffer.unpack("!HIHH")
+    mac = buffer.get(size)
+    original_id, error, length = buffer.unpack("!HHH")
+    other = buffer.get(length)
+
+    signature = Signature(
+        str(key), str(algorithm), (high << 32) | low, fudge, mac,
+        original_id, error, other
+    )
+
+    unsigned = pack(
+        "!HHHHHH", original_id, header.bitmap,
+        header.q, header.a, header.auth, header.ar - 1
+    ) + data[12:offset]
+
+    return unsigned, signature
+
+
+class Context(object):
+    """Verification result of a signed request
+
+    ``error`` is the TSIG error (``0`` when valid); :meth:`sign` signs
+    (the packed) response to the request.
+    """
+
+    def __init__(self, key, signature, error=0):
+        self.key = key
+        self.signature = signature
+        self.error = error
+
+    def sign(self, data, now=None):
+        request = self.signature
+
+        signed = request.signed if self.error == BADTIME else \
+            int(now if now is not None else time())
+
+        other = pack("!HI", signed >> 32, signed & 0xFFFFFFFF) \
+            if self.error == BADTIME else b""
+
+        response = Signature(
+            request.key, request.algorithm, signed, request.fudge, b"",
+            unpack("!H", bytes(data[:2]))[0], self.error, other
+        )
+
+        if self.key is not None and self.error not in (BADKEY, BADSIG):
+            response.mac = self.key.mac(
+                pack("!H", len(request.mac)), request.mac,
+                bytes(data), response.variables()
+            )
+
+        header = bytearray(data[:12])
+        header[10:12] = pack("!H", unpack("!H", bytes(header[10:12]))[0] + 1)
+
+        return bytes(header) + bytes(data[12:]) + response.pack()
+
+
+def verify(data, keys, now=None):
+    """Verify the signature of the message ``data`` with one of ``keys``
+
+    ``keys`` maps names to :class:`Key`. Returns ``None`` if the message
+    is not signed or a :class:`Context` otherwise.
+    """
+
+    unsigned, signature = split(bytes(data))
+
+    if signature is None:
+        return None
+
+    key = keys.get(canonical(signature.key))
+
+    if key is None or key.algorithm != canonical(signature.algorithm):
+        return Context(None, signature, BADKEY)
+
+    expected = key.mac(unsigned, signature.variables())
+
+    if not hmac.compare_digest(expected, signature.mac):
+        return Context(None, signature, BADSIG)
+
+    now = int(now if now is not None else time())
+    if abs(now - signature.signed) > signature.fudge:
+        return Context(key, signature, BADTIME)
+
+    return Context(key, signature)
+
+
+def sign(data, key, fudge=FUDGE, now=None):
+    """Sign the (request) message ``data`` with ``key``
+
+    Returns the signed message and its :class:`Signature` (whose MAC is
+    needed to verify the response).
+    """
+
+    data = bytes(data)
+
+    signature = Signature(
+        key.name, key.algorithm,
+        int(now if now is not None else time()), fudge, b"",
+        unpack("!H", data[:2])[0]
+    )
+    signature.mac = key.mac(data, signature.variables())
+
+    count, = unpack("!H", data[10:12])
+
+    return data[:10] + pack("!H", count + 1) + data[12:] + \
+        signature.pack(), signature
@@ -0,0 +1,232 @@
+"""Dynamic Updates
+
+Processing of DNS UPDATE (RFC 2136) messages against a
+:class:`~udns.storage.Storage` backend: the prerequisites are checked
+and the updates applied as a single change (under one new serial) of the
+zone while holding a lock, so that concurrent updates (e.g: on several
+database workers) are serialized.
+"""
+
+
+from threading import Lock
+
+
+from dnslib.bimap import BimapError
+from dnslib.buffer import BufferError
+from dnslib.label import DNSBuffer, DNSLabelError
+from dnslib import DNSError, DNSHeader, DNSQuestion, DNSRecord, RD, RDMAP, RR
+from dnslib import CLASS, OPCODE, QTYPE, RCODE
+
+
+from .storage import matches, Entry
+
+
+UPDATE = OPCODE.reverse["UPDATE"]
+
+# Classes of prerequisite and update records (RFC 2136 2.4, 2.5)
+NONE = 254
+ANY = 255
+
+NS = QTYPE.reverse["NS"]
+SOA = QTYPE.reverse["SOA"]
+
+# Meta types that cannot be added to a zone
+META = (QTYPE.reverse["ANY"], QTYPE.reverse["AXFR"], QTYPE.reverse["IXFR"],
+        QTYPE.reverse["OPT"], QTYPE.reverse["TSIG"])
+
+
+class UpdateError(Exception):
+    """Raised with the ``rcode`` an update is refused with"""
+
+    def __init__(self, rcode, message=""):
+        super(UpdateError, self).__init__(message or RCODE.get(rcode))
+        self.rcode = rcode
+
+
+def parse(data):
+    """Parse an UPDATE message
+
+    Unlike :meth:`dnslib.DNSRecord.parse` (of recent dnslib versions)
+    records without data, as used by prerequisites and deletions, are
+    accepted. Malformed (e.g: truncated) messages raise :class:`DNSError`
+    as with :meth:`~dnslib.DNSRecord.parse`.
+    """
+
+    buffer = DNSBuffer(data)
+
+    try:
+        return _parse(buffer)
+    except DNSError:
+        raise
+    except (BufferError, BimapError, DNSLabelError) as e:
+        raise DNSError(
+            "Error unpacking UPDATE [offset={0:d}]: {1:s}".format(
+                buffer.offset, str(e)
+            )
+        )
+
+
+def _parse(buffer):
+    header = DNSHeader.parse(buffer)
+
+    if header.opcode != UPDATE:
+        raise DNSError("Not an UPDATE message")
+
+    questions = [DNSQuestion.parse(buffer) for _ in range(header.q)]
+
+    def records(count):
+        rrs = []
+        for _ in range(count):
+            rname = buffer.decode_name()
+            rtype, rclass, ttl, rdlength = buffer.unpack("!HHIH")
+            if rdlength:
+                rdata = RDMAP.get(QTYPE.get(rtype), RD).parse(buffer, rdlength)
+            else:
+                rdata = RD(b"")
+            rrs.append(RR(rname, rtype, rclass, ttl, rdata))
+        return rrs
+
+    # Zone, Prerequisite, Update and Additional sections (RFC 2136 2)
+    rr, auth, ar = records(header.a), records(header.auth), records(header.ar)
+
+    return DNSRecord(header, questions, rr=rr, auth=auth, ar=ar)
+
+
+def in_zone(zone, rname):
+    return rname == zone or rname.endswith(".{0:s}".format(zone))
+
+
+def check(db, zone, prerequisites):
+    """Check the ``prerequisites`` (RR objects) of an update of ``zone``"""
+
+    rnames = set(str(rr.rname) for rr in prerequisites)
+    records = db.find_records(rnames) if rnames else {}
+
+    # Value dependent prerequisites are compared as whole RRsets
+    expected = {}
+
+    for rr in prerequisites:
+        rname = str(rr.rname)
+
+        if rr.ttl != 0:
+            raise UpdateError(RCODE.FORMERR)
+
+        if not in_zone(zone, rname):
+            raise UpdateError(RCODE.NOTZONE)
+
+        found = records[rname]
+        rrset = [r for r in found if r.rtype == rr.rtype]
+
+        if rr.rclass == ANY:
+            if rr.rtype == QTYPE.ANY:
+                if not found:
+                    raise UpdateError(RCODE.NXDOMAIN)
+            elif not rrset:
+                raise UpdateError(RCODE.NXRRSET)
+        elif rr.rclass == NONE:
+            if rr.rtype == QTYPE.ANY:
+                if found:
+                    raise UpdateError(RCODE.YXDOMAIN)
+            elif rrset:
+                raise UpdateError(RCODE.YXRRSET)
+        elif rr.rclass == CLASS.IN:
+            key = (rname, rr.rtype)
+            expected.setdefault(key, set()).add(str(rr.rdata))
+        else:
+            raise UpdateError(RCODE.FORMERR)
+
+    for (rname, rtype), rdatas in expected.items():
+        actual = set(r.rdata for r in records[rname] if r.rtype == rtype)
+        if actual != rdatas:
+            raise UpdateError(RCODE.NXRRSET)
+
+
+def changes(zone, updates, apex=()):
+    """Return the ``(deletes, adds)`` of the ``updates`` of ``zone``
+
+    ``apex`` are the records of the zone's apex. As
+    :meth:`~udns.storage.Storage.update` applies deletes first, adds which
+    are deleted again by a later update are dropped and adds of existing
+    records replace them (updating their ttl).
+    """
+
+    deletes, adds = [], []
+
+    for rr in updates:
+        rname = str(rr.rname)
+
+        if not in_zone(zone, rname):
+            raise UpdateError(RCODE.NOTZONE)
+
+        if rr.rclass == CLASS.IN:
+            if rr.rtype in META:
+                raise UpdateError(RCODE.FORMERR)
+
+            # Changes to the SOA record are made through the zone serial
+            if rr.rtype == SOA:
+                continue
+
+            entry = Entry.from_rr(rr)
+            adds = [other for other in adds if not matches(
+                other, entry.rname, entry.rtype, entry.rdata
+            )]
+            adds.append(entry)
+            deletes.append((entry.rname, entry.rtype, entry.rdata))
+            continue
+
+        if rr.ttl != 0:
+            raise UpdateError(RCODE.FORMERR)
+
+        if rr.rclass == ANY:
+            delete = (rname, None if rr.rtype == QTYPE.ANY else rr.rtype, None)
+        elif rr.rclass == NONE:
+            delete = (rname, rr.rtype, str(rr.rdata))
+        else:
+            raise UpdateError(RCODE.FORMERR)
+
+        if rname == zone and delete[1] is None:
+            # All records of the apex but its SOA and NS (RFC 2136 3.4.2.3)
+            rtypes = set(r.rtype for r in apex) | set(a.rtype for a in adds)
+            expanded = [
+                (rname, rtype, None) for rtype in sorted(rtypes)
+                if rtype not in (SOA, NS)
+            ]
+        elif rname == zone and delete[1] == SOA:
+            expanded = []
+        else:
+            expanded = [delete]
+
+        for delete in expanded:
+            deletes.append(delete)
+            adds = [entry for entry in adds if not matches(entry, *delete)]
+
+    return deletes, adds
+
+
+_lock = Lock()
+
+
+def apply(db, name, prerequisites, updates):
+    """Apply an update of the zone ``name``
+
+    Returns the rcode of the update and the set of names whose records
+    changed.
+    """
+
+    with _lock:
+        zone = db.get_zone(name)
+
+        if zone is None:
+            return RCODE.NOTAUTH, set()
+
+        try:
+            check(db, name, prerequisites)
+
+            apex = db.find_records([name])[name]
+            deletes, adds = changes(name, updates, apex)
+        except UpdateError as error:
+            return error.rcode, set()
+
+        deleted = db.update(zone, deletes, adds)
+
+    return RCODE.NOERROR, set(entry.rname for entry in deleted + adds)
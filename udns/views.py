@@ -0,0 +1,187 @@
+"""Views
+
+Split-horizon views: each view has its own zones (storage), hosts data
+and cache and is selected by the longest of its network prefixes that
+matches the client's source address. Prefixes are held in a binary radix
+trie so a match costs at most one step per address bit (32 for IPv4, 128
+for IPv6) no matter how many prefixes are configured.
+
+Views are configured in a JSON file mapping view names to their networks
+and (optionally) their own SQLite database and hosts file::
+
+    {
+        "internal": {
+            "networks": ["10.0.0.0/8", "fd00::/8"],
+            "dbfile": "/var/lib/udns/internal.db",
+            "hosts": "/etc/hosts.internal"
+        }
+    }
+
+Clients matching no view are served by the default view.
+"""
+
+
+from json import load
+from binascii import hexlify
+from socket import error as SocketError
+from socket import inet_pton, AF_INET, AF_INET6
+
+
+WIDTHS = {AF_INET: 32, AF_INET6: 128}
+
+# IPv4-mapped IPv6 addresses (::ffff:0:0/96)
+MAPPED = 0xFFFF << 32
+
+
+def parse_address(address):
+    """Parse an IP address into its ``(family, value)``
+
+    IPv4-mapped IPv6 addresses (as seen on dual stack sockets) are
+    returned as IPv4 addresses.
+    """
+
+    for family in (AF_INET, AF_INET6):
+        try:
+            value = int(hexlify(inet_pton(family, address)), 16)
+        except (SocketError, ValueError):
+            continue
+
+        if family == AF_INET6 and value >> 32 == 0xFFFF:
+            return AF_INET, value & 0xFFFFFFFF
+
+        return family, value
+
+    raise ValueError("Invalid address {0:s}".format(address))
+
+
+def parse_network(network):
+    """Parse ``address/length`` into its ``(family, value, length)``"""
+
+    address, _, length = network.partition("/")
+    family, value = parse_address(address)
+    width = WIDTHS[family]
+
+    length = int(length) if length else width
+    if not 0 <= length <= width:
+        raise ValueError("Invalid prefix length in {0:s}".format(network))
+
+    # Host bits are ignored
+    value &= ((1 << width) - 1) ^ ((1 << (width - length)) - 1)
+
+    return family, value, length
+
+
+class Node(object):
+
+    __slots__ = ("children", "value")
+
+    def __init__(self):
+        self.children = [None, None]
+        self.value = None
+
+
+class Radix(object):
+    """Longest prefix match of IPv4 and IPv6 networks"""
+
+    def __init__(self):
+        self.roots = {AF_INET: Node(), AF_INET6: Node()}
+
+    def insert(self, network, value):
+        family, prefix, length = parse_network(network)
+        width = WIDTHS[family]
+
+        node = self.roots[family]
+        for i in range(length):
+            bit = (prefix >> (width - 1 - i)) & 1
+            if node.children[bit] is None:
+                node.children[bit] = Node()
+            node = node.children[bit]
+
+        node.value = value
+
+    def lookup(self, address, default=None):
+        """Return the value of the longest network containing ``address``"""
+
+        family, value = parse_address(address)
+        width = WIDTHS[family]
+
+        node = self.roots[family]
+        found = node.value
+
+        for i in range(width):
+            node = node.children[(value >> (width - 1 - i)) & 1]
+            if node is None:
+                break
+            if node.value is not None:
+                found = node.value
+
+        return default if found is None else found
+
+
+class View(object):
+    """View ``name`` of the zones in ``db``, ``hosts`` and ``cache``"""
+
+    def __init__(self, name, db, hosts, cache, networks=()):
+        self.name = name
+        self.db = db
+        self.hosts = hosts
+        self.cache = cache
+        self.networks = tuple(networks)
+
+    def __repr__(self):
+        return "<View {0:s}>".format(self.name)
+
+
+class Views(object):
+    """Views selected by client address falling back to ``default``"""
+
+    def __init__(self, default):
+        self.default = default
+        self.views = [default]
+        self.radix = Radix()
+
+    def __iter__(self):
+        return iter(self.views)
+
+    def __len__(self):
+        return len(self.views)
+
+    def add(self, view):
+        for network in view.networks:
+            self.radix.insert(network, view)
+        self.views.append(view)
+
+    def match(self, address):
+        if len(self.views) == 1:
+            return self.default
+
+        try:
+            return self.radix.lookup(address, self.default)
+        except ValueError:
+            return self.default
+
+
+def load_views(filename):
+    """Load and validate the view configuration in ``filename``
+
+    Returns a list of ``(name, networks, dbfile, hosts)`` tuples.
+    """
+
+    with open(filename) as f:
+        config = load(f)
+
+    views = []
+
+    for name, options in sorted(config.items()):
+        networks = options.get("networks", [])
+        if not networks:
+            raise ValueError("View {0:s} has no networks".format(name))
+
+        for network in networks:
+            parse_network(network)
+
+        views.append(
+            (name, networks, options.get("dbfile"), options.get("hosts"))
+        )
+
+    return views
@@ -0,0 +1,254 @@
+"""Web Interface"""
+
+
+from hmac import compare_digest
+from json import dumps
+from collections import deque
+from binascii import Error as DecodeError
+from base64 import urlsafe_b64decode
+
+try:
+    from urllib.parse import parse_qs
+except ImportError:  # pragma: no cover
+    from urlparse import parse_qs  # noqa
+
+
+from dnslib import DNSRecord, DNSError, CLASS, QR, QTYPE, RCODE
+
+from circuits.web.errors import httperror, unauthorized
+from circuits.web.events import response
+from circuits import handler, Component, Event, Timer
+from circuits.web import Controller
+
+
+from .stats import clock
+from .protocol import parse, request, Peer
+
+
+MIMETYPE = "application/dns-message"
+
+
+class expire(Event):
+    """expire Event"""
+
+
+class Metrics(Controller):
+
+    channel = "/metrics"
+
+    def __init__(self, stats, *args, **kwargs):
+        super(Metrics, self).__init__(*args, **kwargs)
+
+        self.stats = stats
+
+    def index(self):
+        self.response.headers["Content-Type"] = "text/plain; version=0.0.4"
+        return self.stats.render()
+
+
+class Warmup(Peer):
+    """Peer of a cache warm-up query; the reply is only cached"""
+
+    def reply(self, manager, record, data):
+        pass
+
+
+class Control(Controller):
+    """Cache control API
+
+    ``GET /cache`` dumps the cache, ``POST /cache/flush`` removes the
+    entries of a ``name`` (or of all names under a ``suffix``) and
+    ``POST /cache/warm`` queries a list of names (one ``name [type]`` per
+    line) to load their answers into the cache. Requests must carry the
+    ``token`` as ``Authorization: Bearer <token>``.
+    """
+
+    channel = "/cache"
+
+    def __init__(self, server, token, *args, **kwargs):
+        super(Control, self).__init__(*args, **kwargs)
+
+        self.server = server
+        self.token = token
+
+    def _authorized(self):
+        header = self.request.headers.get("Authorization", "")
+        expected = "Bearer {0:s}".format(self.token)
+        return compare_digest(header.encode("utf-8"), expected.encode("utf-8"))
+
+    def _json(self, data):
+        self.response.headers["Content-Type"] = "application/json"
+        return dumps(data, sort_keys=True)
+
+    def index(self):
+        if not self._authorized():
+            return unauthorized(self.request, self.response)
+
+        entries = []
+        for view in self.server.views:
+            for (qname, qtype, qclass), rrs, age in view.cache.dump():
+                # The ttls of cached records are counted down as they age
+                ttl = min(rr.ttl for rr in rrs) if rrs else 0
+                entries.append({
+                    "view": view.name,
+                    "name": qname,
+                    "type": QTYPE.get(qtype),
+                    "class": CLASS.get(qclass),
+                    "ttl": ttl,
+                    "age": int(age),
+                    "answers": [rr.toZone() for rr in rrs],
+                })
+
+        entries.sort(
+            key=lambda entry: (entry["view"], entry["name"], entry["type"])
+        )
+
+        return self._json(entries)
+
+    def flush(self, name=None, suffix=None):
+        if not self._authorized():
+            return unauthorized(self.request, self.response)
+
+        if self.request.method != "POST":
+            return httperror(self.request, self.response, 405)
+
+        if name is None and suffix is None:
+            return httperror(
+                self.request, self.response, 400,
+                description="Missing name or suffix"
+            )
+
+        removed = self.server.purge(name=name, suffix=suffix)
+
+        return self._json({"flushed": len(removed)})
+
+    def warm(self):
+        if not self._authorized():
+            return unauthorized(self.request, self.response)
+
+        if self.request.method != "POST":
+            return httperror(self.request, self.response, 405)
+
+        questions = []
+        for line in self.request.body.read().decode("utf-8").splitlines():
+            tokens = line.split("#", 1)[0].split()
+            if not tokens:
+                continue
+            qtype = tokens[1].upper() if len(tokens) > 1 else "A"
+            if qtype not in QTYPE.reverse:
+                return httperror(
+                    self.request, self.response, 400,
+                    description="Unknown type {0:s}".format(qtype)
+                )
+            questions.append((tokens[0], qtype))
+
+        peer = Warmup(
+            self.request.remote.ip, self.request.remote.port,
+            self.server.channel
+        )
+
+        # Fired all at once; misses are forwarded concurrently
+        for qname, qtype in questions:
+            data = DNSRecord.question(qname, qtype).pack()
+            record = parse(self.server.tracer, data)
+            self.fire(request(peer, record), self.server.channel)
+
+        return self._json({"queued": len(questions)})
+
+
+class Exchange(Peer):
+    """Peer of a DNS-over-HTTPS request awaiting its reply"""
+
+    def __new__(cls, req, res, channel):
+        self = Peer.__new__(cls, req.remote.ip, req.remote.port, channel)
+        self.response = res
+        self.answered = False
+        return self
+
+    def reply(self, manager, record, data):
+        # A late reply (after the timeout) has nowhere to go
+        if self.answered:
+            return
+        self.answered = True
+
+        res = self.response
+
+        res.headers["Content-Type"] = MIMETYPE
+        if record.rr:
+            res.headers["Cache-Control"] = "max-age={0:d}".format(
+                min(rr.ttl for rr in record.rr)
+            )
+        res.body = bytes(data)
+
+        manager.fire(response(res), self.channel)
+
+
+class DNSQuery(Component):
+    """DNS-over-HTTPS (RFC 8484) on ``path``
+
+    Queries are fired as request events on the ``target`` channel like
+    those of any other transport; the reply is sent (as the response to
+    the HTTP request) once the query has been answered. Queries left
+    unanswered (dropped by policy, upstream replies lost) are answered
+    with SERVFAIL after ``timeout`` seconds.
+    """
+
+    channel = "https"
+
+    def init(self, tracer, target, path="/dns-query", timeout=5,
+             channel=channel):
+        self.tracer = tracer
+        self.target = target
+        self.path = path
+        self.timeout = timeout
+
+        # (deadline, peer, record) in order of deadline
+        self.pending = deque()
+
+        Timer(1, expire(), persist=True, channel=self.channel).register(self)
+
+    def expire(self):
+        now = clock()
+        pending = self.pending
+
+        while pending and pending[0][0] <= now:
+            deadline, peer, record = pending.popleft()
+            if not peer.answered:
+                reply = record.reply()
+                reply.header.rcode = RCODE.SERVFAIL
+                peer.reply(self, reply, reply.pack())
+
+    @handler("request")
+    def _on_request(self, event, req, res, peer_cert=None):
+        if req.path != self.path:
+            return httperror(req, res, 404)
+
+        if req.method == "POST":
+            if req.headers.get("Content-Type") != MIMETYPE:
+                return httperror(req, res, 415)
+            data = req.body.read()
+        elif req.method == "GET":
+            dns = parse_qs(req.qs).get("dns")
+            if not dns:
+                return httperror(req, res, 400)
+            try:
+                data = urlsafe_b64decode(dns[0] + "=" * (-len(dns[0]) % 4))
+            except (DecodeError, TypeError, ValueError):
+                return httperror(req, res, 400)
+        else:
+            return httperror(req, res, 405)
+
+        try:
+            record = parse(self.tracer, data)
+        except DNSError:
+            return httperror(req, res, 400)
+
+        if record.header.qr != QR.QUERY:
+            return httperror(req, res, 400)
+
+        peer = Exchange(req, res, self.channel)
+        self.pending.append((clock() + self.timeout, peer, record))
+        self.fire(request(peer, record), self.target)
+
+        # The response is fired by Exchange.reply
+        return True
@@ -0,0 +1,260 @@
+"""Zone Transfers
+
+Full (AXFR, RFC 5936) and incremental (IXFR, RFC 1995) zone transfers,
+both serving them from a :class:`~udns.storage.Storage` backend and
+requesting them from a primary server, as well as applying the result
+to a (secondary's) backend.
+"""
+
+
+from struct import pack, unpack
+from socket import create_connection
+
+
+from dnslib import DNSHeader, DNSQuestion, DNSRecord
+from dnslib import CLASS, QTYPE, RR, SOA
+
+
+from .storage import Entry
+
+
+AXFR = QTYPE.reverse["AXFR"]
+IXFR = QTYPE.reverse["IXFR"]
+
+# NOTIFY (RFC 1996) is not known to dnslib's OPCODE table
+NOTIFY = 4
+
+# Maximum number of records sent in each message of a transfer
+CHUNKSIZE = 100
+
+
+def with_serial(soa, serial):
+    """Return a copy of the SOA record ``soa`` with the given ``serial``"""
+
+    rdata = soa.rdata
+    return RR(
+        soa.rname, soa.rtype, soa.rclass, soa.ttl,
+        SOA(rdata.mname, rdata.rname, (serial,) + tuple(rdata.times[1:]))
+    )
+
+
+def serial_of(soa):
+    return soa.rdata.times[0]
+
+
+def records(db, name, serial=None):
+    """Return the records answering a transfer of zone ``name``
+
+    An incremental transfer is returned if ``serial`` is given and the
+    zone's journal reaches back to it; otherwise a full transfer. Returns
+    ``None`` if the zone does not exist.
+    """
+
+    zone = db.get_zone(name)
+
+    if zone is None:
+        return None
+
+    soa = db.soa(zone)
+
+    if serial is not None:
+        changes = db.changes(zone, serial)
+
+        if changes == []:
+            return [soa]
+
+        if changes is not None:
+            rrs = [soa]
+            previous = serial
+
+            for current, deleted, added in changes:
+                rrs.append(with_serial(soa, previous))
+                rrs.extend(r.rr for r in deleted if r.rtype != QTYPE.SOA)
+                rrs.append(with_serial(soa, current))
+                rrs.extend(r.rr for r in added if r.rtype != QTYPE.SOA)
+                previous = current
+
+            rrs.append(soa)
+
+            return rrs
+
+    rrs = [soa]
+    rrs.extend(r.rr for r in db.records(zone) if r.rtype != QTYPE.SOA)
+    rrs.append(soa)
+
+    return rrs
+
+
+def messages(request, rrs):
+    """Split the records of a transfer into replies to ``request``"""
+
+    for i in range(0, len(rrs), CHUNKSIZE):
+        reply = request.reply()
+        reply.add_answer(*rrs[i:i + CHUNKSIZE])
+        yield reply
+
+
+def notify(zone):
+    """Return a NOTIFY message announcing a change to ``zone``"""
+
+    return DNSRecord(
+        DNSHeader(opcode=NOTIFY, aa=1),
+        q=DNSQuestion(zone, QTYPE.SOA, CLASS.IN)
+    )
+
+
+def _recv(sock, n):
+    data = b""
+    while len(data) < n:
+        chunk = sock.recv(n - len(data))
+        if not chunk:
+            raise EOFError("Connection closed during zone transfer")
+        data += chunk
+    return data
+
+
+def transfer(host, port, name, serial=None, timeout=10):
+    """Request a transfer of zone ``name`` from the primary ``host:port``
+
+    Performs an incremental transfer if ``serial`` is given and returns a
+    ``(kind, soa, data)`` tuple where ``kind`` is one of:
+
+    - ``"current"`` the zone is up to date (``data`` is ``None``)
+    - ``"axfr"`` ``data`` is the list of the zone's records (without SOA)
+    - ``"ixfr"`` ``data`` is a list of ``(deleted, added)`` record lists
+    """
+
+    query = DNSRecord(q=DNSQuestion(name, AXFR if serial is None else IXFR))
+    if serial is not None:
+        query.add_auth(
+            RR(name, QTYPE.SOA, rdata=SOA(name, name, (serial, 0, 0, 0, 0)))
+        )
+
+    data = query.pack()
+
+    sock = create_connection((host, port), timeout)
+
+    try:
+        sock.sendall(pack("!H", len(data)) + data)
+
+        rrs = []
+        complete = False
+
+        while not complete:
+            length, = unpack("!H", _recv(sock, 2))
+            reply = DNSRecord.parse(_recv(sock, length))
+
+            if reply.header.rcode:
+                raise ValueError(
+                    "Zone transfer of {0:s} refused (rcode {1:d})".format(
+                        name, reply.header.rcode
+                    )
+                )
+
+            rrs.extend(reply.rr)
+
+            complete = _complete(rrs, serial)
+    finally:
+        sock.close()
+
+    soa = rrs[0]
+
+    if len(rrs) == 1:
+        if serial_of(soa) == serial:
+            return "current", soa, None
+        return transfer(host, port, name, timeout=timeout)
+
+    if _incremental(rrs):
+        return "ixfr", soa, _diffs(rrs)
+
+    return "axfr", soa, rrs[1:-1]
+
+
+def _incremental(rrs):
+    # IXFR responses start with the new SOA followed by the SOA of the
+    # oldest version, whose serial differs from the new one.
+    return (
+        len(rrs) > 1 and rrs[1].rtype == QTYPE.SOA and
+        serial_of(rrs[1]) != serial_of(rrs[0])
+    )
+
+
+def _complete(rrs, serial):
+    if not rrs or rrs[0].rtype != QTYPE.SOA:
+        return False
+
+    if len(rrs) == 1:
+        # A single SOA answers an incremental transfer request
+        return serial is not None
+
+    new = serial_of(rrs[0])
+
+    count = sum(
+        1 for rr in rrs if rr.rtype == QTYPE.SOA and serial_of(rr) == new
+    )
+
+    return count == (3 if _incremental(rrs) else 2)
+
+
+def _diffs(rrs):
+    diffs = []
+
+    # Skip the leading and trailing SOA records
+    current = None
+    for rr in rrs[1:-1]:
+        if rr.rtype == QTYPE.SOA:
+            if current is None or current is diffs[-1][1]:
+                diffs.append(([], []))
+                current = diffs[-1][0]
+            else:
+                current = diffs[-1][1]
+        else:
+            current.append(rr)
+
+    return diffs
+
+
+def apply(db, name, result):
+    """Apply the ``result`` of :func:`transfer` to the zone ``name``
+
+    Returns the set of names whose records changed.
+    """
+
+    kind, soa, data = result
+
+    if kind == "current":
+        return set()
+
+    zone = db.get_zone(name)
+    changed = set()
+
+    if kind == "axfr":
+        if zone is not None:
+            changed.update(record.rname for record in db.records(zone))
+            db.delete_zone(zone)
+
+        zone = db.create_zone(name, ttl=soa.ttl)
+
+        for rr in data:
+            db.insert_record(zone, *Entry.from_rr(rr))
+            changed.add(str(rr.rname))
+    else:
+        for deleted, added in data:
+            for rr in deleted:
+                record = Entry.from_rr(rr)
+                db.remove_record(
+                    zone, record.rname, record.rtype, record.rdata
+                )
+                changed.add(record.rname)
+
+            for rr in added:
+                db.insert_record(zone, *Entry.from_rr(rr))
+                changed.add(str(rr.rname))
+
+        db.remove_record(zone, name, QTYPE.SOA)
+
+    db.insert_record(zone, *Entry.from_rr(soa))
+    db.set_serial(zone, serial_of(soa))
+    changed.add(name)
+
+    return changed